@@ -0,0 +1,44 @@
+"""
+Runs the benchmarks against in-process fakes, no database needed.
+
+    python -m benchmarks [-k PATTERN] [--save FILE] [--compare BASELINE]
+
+--compare exits with status 1 if any benchmark is slower than in the
+baseline by more than --threshold.
+"""
+import argparse
+import sys
+
+import tests.ctx
+
+from . import cases
+from .runner import compare, load, run, save
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("-k", dest="pattern", help="run matching names or a group")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--save", metavar="FILE", help="write the results as json")
+    parser.add_argument("--compare", metavar="BASELINE", help="a saved result file")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    options = parser.parse_args()
+
+    results = run(options.pattern, options.repeat, options.min_time)
+
+    if options.save:
+        save(results, options.save)
+
+    if options.compare:
+        print()
+        regressions = compare(results, load(options.compare), options.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+from datetime import datetime
+from typing import Any, Optional
+
+from pgdc import And, DcBuilder, Limit, Or, Session, Verbatim, Where, render
+from pgdc.clauses import SqlOp
+from tests.fakes import FakeRecord
+from tests.models import SearchIndexInt, SearchKey
+
+from .runner import benchmark
+
+NOW = datetime(2024, 1, 1)
+
+
+def search_key_rows(n: int) -> list[FakeRecord]:
+    return [
+        FakeRecord({"id": i, "key": f"key-{i}", "date_created": NOW}) for i in range(n)
+    ]
+
+
+class CannedConnection:
+    """Answers every query with the same rows, without any other work."""
+
+    def __init__(self, rows: list[Any]):
+        self.rows = rows
+
+    async def fetch(self, query: str, *args) -> list[Any]:
+        return self.rows
+
+    async def fetchrow(self, query: str, *args) -> Optional[Any]:
+        return self.rows[0] if self.rows else None
+
+    async def execute(self, query: str, *args) -> str:
+        return f"UPDATE {len(self.rows)}"
+
+
+def nested(depth: int, width: int) -> SqlOp:
+    """Alternating And and Or clauses, each with width conditions."""
+    kwargs = {f"c{depth}_{i}": i for i in range(width)}
+    if depth == 1:
+        return And(**kwargs)
+
+    inner = [nested(depth - 1, width) for _ in range(2)]
+    return (Or if depth % 2 else And)(*inner, **kwargs)
+
+
+# Builders
+
+
+@benchmark("build.select", "build")
+def build_select():
+    builder = DcBuilder(SearchKey)
+    return lambda: builder.select(Where(id=1), limit=Limit(1))
+
+
+@benchmark("build.insert", "build")
+def build_insert():
+    builder = DcBuilder(SearchKey)
+    return lambda: builder.insert(key="key", date_created=Verbatim("NOW()"))
+
+
+@benchmark("build.update", "build")
+def build_update():
+    builder = DcBuilder(SearchIndexInt)
+    return lambda: builder.update(Where(doc_id=1, key_id=2), value=3)
+
+
+# Clauses
+
+
+for width in (1, 10, 100):
+
+    @benchmark(f"clauses.where.width_{width}", "clauses")
+    def clauses_width(width=width):
+        kwargs = {f"c{i}": i for i in range(width)}
+        return lambda: Where(**kwargs).build()
+
+
+for depth in (1, 3, 6):
+
+    @benchmark(f"clauses.nested.depth_{depth}", "clauses")
+    def clauses_depth(depth=depth):
+        def build():
+            where = Where(nested(depth, 3))
+            return where.build(), where.args()
+
+        return build
+
+
+# Rendering
+
+
+for flavor in ("asyncpg", "psycopg2"):
+
+    @benchmark(f"render.select.{flavor}", "render")
+    def render_select(flavor=flavor):
+        template, args = DcBuilder(SearchKey).select(Where(id=1, key="key"))
+        return lambda: render(template, args, flavor)
+
+    @benchmark(f"render.insert.{flavor}", "render")
+    def render_insert(flavor=flavor):
+        template, args = DcBuilder(SearchKey).insert(
+            key="key", date_created=Verbatim("NOW()")
+        )
+        return lambda: render(template, args, flavor)
+
+
+# Hydration
+
+
+for n in (1, 1_000, 100_000):
+
+    @benchmark(f"hydrate.rows_{n}", "hydrate")
+    def hydrate(n=n):
+        session = Session(CannedConnection([]))
+        rows = search_key_rows(n)
+        return lambda: session.hydrate_many(SearchKey, rows)
+
+
+# End to end, from clauses to instances
+
+
+@benchmark("session.get_one", "session")
+def session_get_one():
+    session = Session(
+        CannedConnection(search_key_rows(1)),
+        statement_cache_size=0,
+        identity_map_size=0,
+    )
+
+    async def get_one():
+        return await session.get_one(SearchKey, Where(id=1))
+
+    return get_one
+
+
+@benchmark("session.get.rows_1000", "session")
+def session_get():
+    session = Session(
+        CannedConnection(search_key_rows(1_000)),
+        statement_cache_size=0,
+        identity_map_size=0,
+    )
+
+    async def get():
+        return await session.get(SearchKey, Where(key="key"), limit=Limit(1_000))
+
+    return get
+
+
+@benchmark("session.update", "session")
+def session_update():
+    session = Session(
+        CannedConnection(search_key_rows(1)),
+        statement_cache_size=0,
+        identity_map_size=0,
+    )
+
+    async def update():
+        return await session.update(SearchKey, Where(id=1), key="key")
+
+    return update
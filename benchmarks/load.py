@@ -0,0 +1,329 @@
+"""
+Drives concurrent Session operations and reports how they hold up.
+
+    python -m benchmarks.load --ops 50000 --concurrency 10000 \
+        --mix get_one=70,create=20,update=10 --pool-size 10 --latency 0.002
+
+Without --dsn, queries go to a simulated pool answering after an injected
+latency, uniformly spread by --jitter. With --dsn, they go to a Postgres
+whose tables are created from docker/create_table.sql when --init is set.
+
+Reported per operation: throughput, latency percentiles and the time spent
+waiting for a pool connection. Client CPU is the process CPU time of the
+whole run divided by the number of operations, as coroutines interleave
+too finely to attribute it to one of them.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Optional
+
+import tests.ctx
+
+import asyncpg
+
+from pgdc import Limit, Session, Where
+from pgdc.instrument import QueryEvent, QueryHook
+from tests.fakes import FakeConnection, FakePool, FakeRecord
+from tests.models import SearchKey
+
+from .runner import format_time
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+SCHEMA = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "docker",
+    "create_table.sql",
+)
+
+Operation = Callable[[Session, "Workload"], Awaitable[Any]]
+
+_current: contextvars.ContextVar[str] = contextvars.ContextVar("operation")
+
+
+def search_key_row(query: str, args: tuple) -> list[dict]:
+    key_id = args[0] if args and isinstance(args[0], int) else 1
+    return [{"id": key_id, "key": f"key-{key_id}", "date_created": NOW}]
+
+
+class SimulatedConnection(FakeConnection):
+    """A FakeConnection answering after latency() seconds, without a log."""
+
+    def __init__(self, latency: Callable[[], float]):
+        super().__init__(search_key_row)
+        self.latency = latency
+
+    async def _respond(self, query: str, args: tuple) -> list[FakeRecord]:
+        await asyncio.sleep(self.latency())
+        return [FakeRecord(row) for row in self.handler(query, args)]
+
+
+class SimulatedPool(FakePool):
+    def __init__(self, size: int, latency: Callable[[], float]):
+        super().__init__(size=0)
+        self.connections = [SimulatedConnection(latency) for _ in range(size)]
+        for conn in self.connections:
+            self._idle.put_nowait(conn)
+
+
+class Workload:
+    """The keys operations pick from, filled by the seed phase."""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.ids: list[int] = []
+
+    def some_id(self) -> int:
+        return self.rng.choice(self.ids)
+
+
+async def get_one(session: Session, workload: Workload) -> Any:
+    return await session.get_one(SearchKey, Where(id=workload.some_id()))
+
+
+async def get(session: Session, workload: Workload) -> Any:
+    return await session.get(
+        SearchKey, Where("id >= {id}", id=workload.some_id()), limit=Limit(100)
+    )
+
+
+async def create(session: Session, workload: Workload) -> Any:
+    obj = await session.create(SearchKey, key=f"load-{uuid.uuid4().hex}")
+    workload.ids.append(obj.id)
+    return obj
+
+
+async def update(session: Session, workload: Workload) -> Any:
+    return await session.update(
+        SearchKey, Where(id=workload.some_id()), key=f"load-{uuid.uuid4().hex}"
+    )
+
+
+async def load(session: Session, workload: Workload) -> Any:
+    return await session.load(SearchKey, workload.some_id())
+
+
+OPERATIONS: dict[str, Operation] = {
+    "get_one": get_one,
+    "get": get,
+    "create": create,
+    "update": update,
+    "load": load,
+}
+
+
+class PoolWait(QueryHook):
+    """Collects the pool wait of queries per running operation."""
+
+    def __init__(self):
+        self.waits: dict[str, list[float]] = {}
+
+    def query_finished(self, event: QueryEvent):
+        self.waits.setdefault(_current.get("?"), []).append(event.pool_wait)
+
+
+@dataclass
+class Report:
+    operation: str
+    calls: int
+    errors: int
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+    pool_wait_p99: float
+
+
+def percentiles(values: list[float]) -> tuple[float, float, float]:
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return value, value, value
+
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+async def drive(
+    session: Session,
+    workload: Workload,
+    mix: dict[str, int],
+    ops: int,
+    concurrency: int,
+) -> tuple[dict[str, list[float]], dict[str, int]]:
+    """Runs ops operations drawn from mix, concurrency of them at a time."""
+    names = list(mix)
+    plan = workload.rng.choices(names, weights=[mix[name] for name in names], k=ops)
+    latencies: dict[str, list[float]] = {name: [] for name in names}
+    errors: dict[str, int] = dict.fromkeys(names, 0)
+    remaining = iter(plan)
+
+    async def worker():
+        for name in remaining:
+            _current.set(name)
+            started = time.perf_counter()
+            try:
+                await OPERATIONS[name](session, workload)
+            except Exception:
+                errors[name] += 1
+            latencies[name].append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, ops))))
+    return latencies, errors
+
+
+async def connect(options: argparse.Namespace) -> Any:
+    if options.dsn is None:
+        rng = random.Random(options.seed)
+        low = max(0.0, options.latency - options.jitter)
+        high = options.latency + options.jitter
+        return SimulatedPool(options.pool_size, lambda: rng.uniform(low, high))
+
+    pool = await asyncpg.create_pool(
+        options.dsn, min_size=options.pool_size, max_size=options.pool_size
+    )
+    if options.init:
+        with open(SCHEMA) as f:
+            await pool.execute(f.read())
+    return pool
+
+
+async def seed(session: Session, workload: Workload, rows: int, simulated: bool):
+    if simulated:
+        workload.ids.extend(range(1, rows + 1))
+        return
+
+    created = await session.create_many(
+        SearchKey,
+        ({"key": f"load-{uuid.uuid4().hex}"} for _ in range(rows)),
+        returning=True,
+    )
+    workload.ids.extend(obj.id for obj in created)
+
+
+async def main(options: argparse.Namespace) -> list[Report]:
+    mix = {
+        name: int(weight)
+        for name, weight in (part.split("=") for part in options.mix.split(","))
+    }
+    unknown = mix.keys() - OPERATIONS.keys()
+    if unknown:
+        raise SystemExit(f"Unknown operations: {', '.join(sorted(unknown))}")
+
+    pool = await connect(options)
+    session = Session(
+        pool,
+        statement_cache_size=options.statement_cache_size,
+        identity_map_size=options.identity_map_size,
+        load_window=options.load_window,
+    )
+    waits = PoolWait()
+    session.add_hook(waits)
+
+    workload = Workload(random.Random(options.seed))
+    await seed(session, workload, options.seed_rows, options.dsn is None)
+    waits.waits.clear()
+
+    cpu = time.process_time()
+    started = time.perf_counter()
+    latencies, errors = await drive(
+        session, workload, mix, options.ops, options.concurrency
+    )
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+
+    if options.dsn is not None:
+        await pool.close()
+
+    reports = []
+    for name, values in latencies.items():
+        p50, p95, p99 = percentiles(values)
+        reports.append(
+            Report(
+                name,
+                len(values),
+                errors[name],
+                len(values) / elapsed,
+                p50,
+                p95,
+                p99,
+                max(values, default=0.0),
+                percentiles(waits.waits.get(name, []))[2],
+            )
+        )
+
+    print(
+        f"{options.ops} operations in {elapsed:.2f} s, "
+        f"{options.ops / elapsed:.0f}/s, "
+        f"client CPU {format_time(cpu / options.ops)} per operation "
+        f"({cpu / elapsed:.0%} of one core)"
+    )
+    print(
+        f"{'operation':<10} {'calls':>7} {'errors':>6} {'per s':>8} "
+        f"{'p50':>10} {'p95':>10} {'p99':>10} {'max':>10} {'wait p99':>10}"
+    )
+    for report in reports:
+        print(
+            f"{report.operation:<10} {report.calls:>7} {report.errors:>6} "
+            f"{report.throughput:>8.0f} "
+            + " ".join(
+                f"{format_time(value):>10}"
+                for value in (
+                    report.p50,
+                    report.p95,
+                    report.p99,
+                    report.max,
+                    report.pool_wait_p99,
+                )
+            )
+        )
+
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(
+                {
+                    "options": vars(options),
+                    "elapsed": elapsed,
+                    "cpu": cpu,
+                    "operations": [asdict(report) for report in reports],
+                },
+                f,
+                indent=2,
+            )
+
+    return reports
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+    parser.add_argument("--ops", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=1_000)
+    parser.add_argument(
+        "--mix",
+        default="get_one=70,create=20,update=10",
+        help=f"weighted operations among {', '.join(OPERATIONS)}",
+    )
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.001, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0005, help="seconds")
+    parser.add_argument("--dsn", help="a Postgres to run against instead")
+    parser.add_argument("--init", action="store_true", help="create the tables")
+    parser.add_argument("--seed-rows", type=int, default=1_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--statement-cache-size", type=int, default=100)
+    parser.add_argument("--identity-map-size", type=int, default=0)
+    parser.add_argument("--load-window", type=float, default=0)
+    parser.add_argument("--json", metavar="FILE", help="write the report as json")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
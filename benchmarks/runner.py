@@ -0,0 +1,146 @@
+import asyncio
+import inspect
+import json
+import platform
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Optional, Union
+
+Bench = Callable[[], Union[Any, Awaitable[Any]]]
+Setup = Callable[[], Bench]
+
+REGISTRY: dict[str, tuple[str, Setup]] = {}
+
+
+def benchmark(name: str, group: str) -> Callable[[Setup], Setup]:
+    """
+    Registers a benchmark.
+
+    The decorated function prepares its inputs and returns the callable to
+    time, which may be a coroutine function.
+    """
+
+    def register(setup: Setup) -> Setup:
+        REGISTRY[name] = (group, setup)
+        return setup
+
+    return register
+
+
+@dataclass
+class Result:
+    name: str
+    group: str
+    number: int
+    best: float
+    median: float
+    stdev: float
+
+
+async def _time_async(bench: Bench, number: int) -> float:
+    started = time.perf_counter()
+    for _ in range(number):
+        await bench()
+    return time.perf_counter() - started
+
+
+def _time(bench: Bench, number: int) -> float:
+    if inspect.iscoroutinefunction(bench):
+        return asyncio.run(_time_async(bench, number))
+
+    started = time.perf_counter()
+    for _ in range(number):
+        bench()
+    return time.perf_counter() - started
+
+
+def measure(
+    name: str, group: str, setup: Setup, repeat: int = 5, min_time: float = 0.2
+) -> Result:
+    """
+    Times a benchmark, in seconds per call.
+
+    The number of calls per run grows until a run takes min_time, then
+    repeat runs are timed. best is the fastest run, the least disturbed by
+    other processes.
+    """
+    bench = setup()
+
+    number = 1
+    while (elapsed := _time(bench, number)) < min_time:
+        number *= max(2, min(10, int(min_time / max(elapsed, 1e-9))))
+
+    runs = [_time(bench, number) / number for _ in range(repeat)]
+    return Result(
+        name,
+        group,
+        number,
+        min(runs),
+        statistics.median(runs),
+        statistics.stdev(runs) if repeat > 1 else 0.0,
+    )
+
+
+def run(
+    pattern: Optional[str] = None, repeat: int = 5, min_time: float = 0.2
+) -> list[Result]:
+    results = []
+    for name, (group, setup) in REGISTRY.items():
+        if pattern and pattern not in name and pattern != group:
+            continue
+
+        result = measure(name, group, setup, repeat, min_time)
+        print(f"{name:<40} {format_time(result.best):>10} ({result.number} calls)")
+        results.append(result)
+    return results
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def save(results: list[Result], path: str):
+    payload = {
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "results": [asdict(result) for result in results],
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+
+
+def load(path: str) -> dict[str, Result]:
+    with open(path) as f:
+        payload = json.load(f)
+    return {entry["name"]: Result(**entry) for entry in payload["results"]}
+
+
+def compare(
+    results: list[Result], baseline: dict[str, Result], threshold: float = 0.1
+) -> list[str]:
+    """
+    Prints each result against the baseline and returns the names of those
+    slower than it by more than threshold, a fraction of the baseline time.
+    """
+    regressions = []
+    for result in results:
+        before = baseline.get(result.name)
+        if before is None:
+            print(f"{result.name:<40} {'new':>10}")
+            continue
+
+        change = result.best / before.best - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(result.name)
+        print(
+            f"{result.name:<40} {format_time(before.best):>10} -> "
+            f"{format_time(result.best):>10} {change:+7.1%}{flag}"
+        )
+    return regressions
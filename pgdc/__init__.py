@@ -1,27 +1,54 @@
 from .args import Verbatim
 from .clauses import (
     And,
+    Between,
     Cond,
+    ContainedBy,
+    Contains,
+    Eq,
+    Ge,
     GroupBy,
+    Gt,
+    In,
+    Le,
     Limit,
+    Lt,
+    Ne,
+    NotIn,
     Or,
     OrderBy,
+    Overlaps,
     Where,
 )
 from .dcbuilder import DcBuilder
-from .relation import Relation
+from .relation import DEFERRED, Relation
+from .relationships import relationship
 from .render import render
 from .session import Session
 
 __all__ = [
     "And",
+    "Between",
     "Cond",
+    "ContainedBy",
+    "Contains",
     "DcBuilder",
+    "DEFERRED",
+    "Eq",
+    "Ge",
     "GroupBy",
+    "Gt",
+    "In",
+    "Le",
     "Limit",
+    "Lt",
+    "Ne",
+    "NotIn",
     "Or",
     "OrderBy",
+    "Overlaps",
     "Relation",
+    "relationship",
     "render",
     "Session",
     "Verbatim",
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from itertools import count
+from time import monotonic
+from typing import AsyncIterator, Literal, Optional
+
+Priority = Literal["read", "write"]
+
+Holder = tuple["AdmissionController", Optional[asyncio.Task]]
+
+# The controllers a slot is held of, each with the task holding it. Tasks
+# started meanwhile inherit the value, but are not the holder.
+_holding: ContextVar[tuple[Holder, ...]] = ContextVar("holding", default=())
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot start before its deadline."""
+
+
+class AdmissionController:
+    """
+    Bounds the number of requests a session has in flight.
+
+    With a fixed limit, at most that many requests run at once. Without,
+    the limit adapts to the observed latency: it grows by one every limit
+    requests completing within tolerance times the recent minimum latency,
+    and shrinks by backoff, at most once per round trip, otherwise.
+
+    Requests over the limit wait in a queue of at most max_queue entries,
+    those of the preferred priority first. A request fails with Overloaded
+    if it cannot start within timeout seconds, right away if the queue is
+    full or the expected wait is longer than that. A full queue makes room
+    for a preferred request by failing the last waiting one of the other
+    priority.
+
+    A task holding a slot, such as one iterating over a stream, runs its
+    nested requests in that slot rather than waiting for another. The tasks
+    it starts are admitted on their own.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = None,
+        initial_limit: int = 16,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        max_queue: int = 1024,
+        timeout: Optional[float] = 1.0,
+        prefer: Priority = "write",
+        tolerance: float = 2.0,
+        backoff: float = 0.9,
+        window: int = 100,
+    ):
+        self.adaptive = limit is None
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.prefer = prefer
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.window = window
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._limit = float(initial_limit if limit is None else limit)
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._order = count()
+        self._latency: Optional[float] = None
+        self._baseline = float("inf")
+        self._window_min = float("inf")
+        self._samples = 0
+        self._decreased = float("-inf")
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @asynccontextmanager
+    async def admit(
+        self, priority: Priority = "write", measure: bool = True
+    ) -> AsyncIterator[None]:
+        """
+        Holds a slot while the block runs, waiting for one if need be. The
+        latency of the block adapts the limit, if measure is set.
+        """
+        holding = _holding.get()
+        held = (self, asyncio.current_task())
+        if held in holding:
+            yield
+            return
+
+        await self._enter(priority)
+        _holding.set(holding + (held,))
+        started = monotonic()
+        try:
+            yield
+        except BaseException:
+            self._leave()
+            raise
+        finally:
+            _holding.set(holding)
+
+        self._leave(monotonic() - started if measure else None)
+
+    async def _enter(self, priority: Priority):
+        if self.in_flight < self.limit and not self.queued:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        rank = 0 if priority == self.prefer else 1
+        if self._expected_wait() > (self.timeout or float("inf")):
+            self._reject("the expected wait exceeds the timeout")
+        if self.queued >= self.max_queue and not self._shed(rank):
+            self._reject("the admission queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (rank, next(self._order), waiter))
+        self.queued += 1
+
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            if self._granted(waiter):
+                return
+            self._reject(f"no slot within {self.timeout}s")
+        except BaseException:
+            if self._granted(waiter):
+                self._leave()
+            raise
+
+    def _granted(self, waiter: asyncio.Future) -> bool:
+        """Settles a waiter that gave up, telling whether it got a slot."""
+        if not waiter.done():
+            waiter.cancel()
+        if waiter.cancelled():
+            self.queued -= 1
+            return False
+        return waiter.exception() is None
+
+    def _expected_wait(self) -> float:
+        if self._latency is None:
+            return 0.0
+        return (self.queued + 1) * self._latency / max(1, self.limit)
+
+    def _shed(self, rank: int) -> bool:
+        """Fails the last waiter ranked below rank, if any, to make room."""
+        candidates = [
+            entry for entry in self._waiters if entry[0] > rank and not entry[2].done()
+        ]
+        if not candidates:
+            return False
+
+        _, _, waiter = max(candidates)
+        waiter.set_exception(Overloaded("shed for a request of higher priority"))
+        self.queued -= 1
+        self.rejected += 1
+        return True
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        raise Overloaded(reason)
+
+    def _leave(self, latency: Optional[float] = None):
+        self.in_flight -= 1
+        if latency is not None:
+            self._observe(latency)
+
+        while self._waiters and self.in_flight < self.limit:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue
+
+            self.queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            waiter.set_result(None)
+
+    def _observe(self, latency: float):
+        self._latency = (
+            latency if self._latency is None else 0.9 * self._latency + 0.1 * latency
+        )
+
+        # The baseline is the minimum latency of the last window.
+        self._baseline = min(self._baseline, latency)
+        self._window_min = min(self._window_min, latency)
+        self._samples += 1
+        if self._samples >= self.window:
+            self._baseline, self._window_min, self._samples = (
+                self._window_min,
+                float("inf"),
+                0,
+            )
+
+        if not self.adaptive:
+            return
+
+        now = monotonic()
+        if latency > self.tolerance * self._baseline:
+            if now - self._decreased > latency:
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+                self._decreased = now
+        elif self.queued or self.in_flight + 1 >= self.limit:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
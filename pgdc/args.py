@@ -25,18 +25,30 @@ class SqlArgs:
     def args(self) -> list[ValidSqlArg]:
         ...
 
+    def keys(self) -> list[str]:
+        """Returns the argument names in the order of args()."""
+        ...
+
 
 class Psychopg2Args(SqlArgs):
+    def __init__(self, args: Optional[dict[str, ValidSqlArg]] = None):
+        super().__init__(args)
+        self._used_keys: list[str] = []
+
     def __getitem__(self, key: str) -> ValidSqlArg:
         if isinstance(self._args[key], Verbatim):
             return str(self._args[key])
 
         self._used_values.append(self._args[key])
+        self._used_keys.append(key)
         return "%s"
 
     def args(self) -> list[ValidSqlArg]:
         return self._used_values
 
+    def keys(self) -> list[str]:
+        return self._used_keys
+
 
 class AsyncpgArgs(SqlArgs):
     def __init__(self, args: Optional[dict[str, ValidSqlArg]] = None):
@@ -54,3 +66,6 @@ class AsyncpgArgs(SqlArgs):
 
     def args(self) -> list[ValidSqlArg]:
         return self._used_values
+
+    def keys(self) -> list[str]:
+        return list(self._used_args)
@@ -1,7 +1,7 @@
 from typing import Optional, Sequence
 
 from .args import ValidSqlArg
-from .clauses import Where, Limit
+from .clauses import Where, Limit, numbered, required
 
 NoWhere = Where()
 NoLimit = Limit(None)
@@ -32,7 +32,7 @@ class SqlBuilder:
         """
         Returns the raw, unrendered sql select query
         """
-        where = where or NoWhere
+        where = numbered(where or NoWhere)
         limit = limit or NoLimit
         select_string = self.attrs_string
 
@@ -57,7 +57,7 @@ class SqlBuilder:
         """
         assert len(kwargs) > 0
 
-        where = where or NoWhere
+        where = numbered(required(where, "UPDATE"))
         update_string = ", ".join([key + " = {" + key + "}" for key in kwargs.keys()])
         select_string = self.attrs_string
 
@@ -94,8 +94,7 @@ class SqlBuilder:
         self,
         where: Optional[Where] = None,
     ) -> tuple[str, dict[str, ValidSqlArg]]:
-        assert where is not None
-        where = where or NoWhere
+        where = numbered(required(where, "DELETE"))
 
         return (
             f"""
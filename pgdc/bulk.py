@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Iterable, Iterator, Mapping, Optional, Sequence, Union
+
+from .args import ValidSqlArg, Verbatim
+from .relation import Relation
+
+Row = Union[Relation, Mapping[str, ValidSqlArg]]
+
+
+@dataclass(frozen=True)
+class UpsertResult:
+    inserted: int
+    updated: int
+    unchanged: int
+
+
+def chunked(rows: Iterable[Row], size: int) -> Iterator[list[Row]]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+class RowReader:
+    """
+    Turns dataclass instances or dicts into value tuples for bulk writes.
+
+    The columns are taken from the first row unless given: the keys of a
+    dict, or the fields of a dataclass instance that are not None, so that
+    identity columns and other database defaults apply. Later rows may not
+    carry values for columns left out that way. Columns holding a
+    Verbatim are rendered into the sql and must be equal in every row.
+    """
+
+    def __init__(
+        self,
+        attrs: Sequence[str],
+        first: Row,
+        columns: Optional[Sequence[str]] = None,
+    ):
+        self._mapping = isinstance(first, Mapping)
+        self._strict = columns is None
+        self.omitted: list[str] = []
+
+        if columns is None:
+            columns = (
+                list(first)
+                if self._mapping
+                else [attr for attr in attrs if getattr(first, attr) is not None]
+            )
+            self.omitted = [attr for attr in attrs if attr not in columns]
+
+        self.columns = list(columns)
+        self._known = set(self.columns)
+        self.verbatims: dict[str, Verbatim] = {
+            column: value
+            for column in self.columns
+            if isinstance(value := self._value(first, column), Verbatim)
+        }
+        self.params = [c for c in self.columns if c not in self.verbatims]
+
+    def _value(self, row: Row, column: str) -> Any:
+        return row.get(column) if self._mapping else getattr(row, column)
+
+    def __call__(self, row: Row) -> tuple:
+        """Returns the values of the parameter columns of row."""
+        if self._strict:
+            unknown = (
+                row.keys() - self._known
+                if self._mapping
+                else [a for a in self.omitted if getattr(row, a) is not None]
+            )
+            if unknown:
+                raise ValueError(f"Values for unexpected columns {sorted(unknown)}")
+
+        for column, verbatim in self.verbatims.items():
+            if str(self._value(row, column)) != str(verbatim):
+                raise ValueError(f"Column {column} must be {verbatim} in every row")
+
+        return tuple(self._value(row, column) for column in self.params)
+
+    def transpose(self, rows: Iterable[Row]) -> dict[str, Any]:
+        """Returns one list of values per column, verbatims as is."""
+        values = list(zip(*map(self, rows)))
+        return self.verbatims | {
+            column: list(values[i]) if values else []
+            for i, column in enumerate(self.params)
+        }
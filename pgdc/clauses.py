@@ -1,6 +1,18 @@
-from typing import Optional, Union
+import re
+from copy import copy
+from typing import Hashable, Optional, Union, cast
 
-from .args import ValidSqlArg
+from .args import ValidSqlArg, Verbatim
+
+
+def value_shape(value: ValidSqlArg) -> Optional[str]:
+    """The part of a value that ends up in the sql text."""
+    return str(value) if isinstance(value, Verbatim) else None
+
+
+def kwargs_shape(kwargs: dict[str, ValidSqlArg]) -> tuple:
+    """Canonical, order independent shape of keyword arguments."""
+    return tuple((key, value_shape(kwargs[key])) for key in sorted(kwargs))
 
 
 class SqlOp:
@@ -13,15 +25,52 @@ class SqlOp:
     def args(self):
         raise NotImplementedError()
 
+    def shape(self) -> Hashable:
+        """
+        Returns a hashable description of the sql this op builds.
+
+        Two ops with equal shapes build identical sql and differ only in
+        their argument values.
+        """
+        raise NotImplementedError()
+
+    def numbered(self, seen: dict[str, int]) -> "SqlOp":
+        """
+        Returns this op with its parameters renamed after those in seen,
+        which it adds its own to.
+        """
+        return self
+
 
 class SqlClause(SqlOp):
     def __init__(self, *conds: Union[str, "SqlOp"], **kwargs: ValidSqlArg):
         self._conds = conds
         self._kwargs = kwargs
 
+    @staticmethod
+    def _numbered(
+        conds: tuple[Union[str, "SqlOp"], ...], seen: dict[str, int]
+    ) -> tuple[Union[str, "SqlOp"], ...]:
+        # Numbered in order, so that clauses of one shape bind the same names.
+        return tuple(
+            cond.numbered(seen) if isinstance(cond, SqlOp) else cond for cond in conds
+        )
+
+    def numbered(self, seen: dict[str, int]) -> "SqlOp":
+        conds = self._numbered(self._conds, seen)
+        if all(new is old for new, old in zip(conds, self._conds)):
+            return self
+
+        clause = copy(self)
+        clause._conds = conds
+        return clause
+
     def build(self) -> str:
         return "" if not self._conds else ", ".join(map(str, self._conds))
 
+    def terms(self) -> tuple[Union[str, "SqlOp"], ...]:
+        return self._conds
+
     def args(self) -> dict[str, ValidSqlArg]:
         args = self._kwargs.copy()
         list(
@@ -29,6 +78,16 @@ class SqlClause(SqlOp):
         )
         return args
 
+    def shape(self) -> Hashable:
+        return (
+            type(self),
+            tuple(
+                cond.shape() if isinstance(cond, SqlOp) else cond
+                for cond in self._conds
+            ),
+            kwargs_shape(self._kwargs),
+        )
+
 
 class Select(SqlClause):
     def build(self) -> str:
@@ -55,16 +114,26 @@ class Limit(SqlOp):
     def build(self) -> str:
         return "LIMIT {__LIMIT__}" if self._limit is not None else ""
 
+    def shape(self) -> Hashable:
+        return (Limit, self._limit is None)
+
 
 class And(SqlClause):
     def build(self) -> str:
         conds = (
             self._conds
             if self._conds
-            else [f"{key} = {{{key}}}" for key in self._kwargs]
+            else [f"{key} = {{{key}}}" for key in sorted(self._kwargs)]
         )
         return "(" + " AND ".join(map(str, conds)) + ")"
 
+    def equalities(self) -> Optional[dict[str, ValidSqlArg]]:
+        """The compared values if this is nothing but column = value terms."""
+        if self._conds or any(map(value_shape, self._kwargs.values())):
+            return None
+
+        return self._kwargs
+
 
 class Cond(And):
     ...
@@ -72,14 +141,189 @@ class Cond(And):
 
 class Where(And):
     def build(self) -> str:
+        if self.empty():
+            return ""
+
         return "WHERE " + super().build()
 
+    def empty(self) -> bool:
+        """Whether this Where has no condition, matching every row."""
+        return not self._conds and not self._kwargs
+
+    def extend(self, *conds: Union[str, SqlOp]) -> "Where":
+        """Returns a Where requiring both this one and conds."""
+        if self.empty():
+            return Where(*conds)
+
+        return Where(And(*self._conds, **self._kwargs), *conds)
+
+
+def numbered(where: Where) -> Where:
+    """
+    Returns where with the parameters of its repeated operators numbered,
+    once per statement, copying only the clauses that change.
+    """
+    return cast(Where, where.numbered({}))
+
+
+def required(where: Optional[Where], statement: str) -> Where:
+    """Refuses to build an update or delete of every row."""
+    if where is None or where.empty():
+        raise ValueError(f"{statement} needs a non empty Where")
+    return where
+
 
 class Or(And):
     def build(self) -> str:
         conds = (
             self._conds
             if self._conds
-            else [f"{key} = {{{key}}}" for key in self._kwargs]
+            else [f"{key} = {{{key}}}" for key in sorted(self._kwargs)]
         )
         return "(" + " OR ".join(str(cond) for cond in conds) + ")"
+
+    def equalities(self) -> Optional[dict[str, ValidSqlArg]]:
+        return super().equalities() if len(self._kwargs) == 1 else None
+
+
+class Compare(SqlOp):
+    """
+    Compares a column with a value bound as one parameter, as in
+
+        Where(Gt("value", 10), Contains("value", [1, 2]))
+
+    Every operator binds its value under a name made of the column and
+    the operator, numbered from its second appearance in a statement. cast,
+    if given, is added to the parameter, as the element type for the array
+    operators.
+    """
+
+    operator = "="
+    suffix = "eq"
+
+    def __init__(self, column: str, value: ValidSqlArg, cast: Optional[str] = None):
+        self.column = column
+        self.value = value
+        self.cast = cast
+        self._base = self._name = re.sub(r"\W", "_", column) + "__" + self.suffix
+
+    def _param(self, name: str) -> str:
+        return "{" + name + "}" + (f"::{self.cast}" if self.cast else "")
+
+    def build(self) -> str:
+        return f"{self.column} {self.operator} {self._param(self._name)}"
+
+    def args(self) -> dict[str, ValidSqlArg]:
+        return {self._name: self.value}
+
+    def numbered(self, seen: dict[str, int]) -> "SqlOp":
+        n = seen[self._base] = seen.get(self._base, -1) + 1
+        name = f"{self._base}_{n}" if n else self._base
+        if name == self._name:
+            return self
+
+        op = copy(self)
+        op._name = name
+        return op
+
+    def shape(self) -> Hashable:
+        return (type(self), self.column, self.cast, value_shape(self.value))
+
+
+class Eq(Compare):
+    pass
+
+
+class Ne(Compare):
+    operator = "<>"
+    suffix = "ne"
+
+
+class Lt(Compare):
+    operator = "<"
+    suffix = "lt"
+
+
+class Le(Compare):
+    operator = "<="
+    suffix = "le"
+
+
+class Gt(Compare):
+    operator = ">"
+    suffix = "gt"
+
+
+class Ge(Compare):
+    operator = ">="
+    suffix = "ge"
+
+
+class ArrayCompare(Compare):
+    """Compares with a list of values, bound as one array parameter."""
+
+    def _param(self, name: str) -> str:
+        return "{" + name + "}" + (f"::{self.cast}[]" if self.cast else "")
+
+
+class In(ArrayCompare):
+    """column = ANY(values), the same sql for any number of values."""
+
+    suffix = "in"
+
+    def build(self) -> str:
+        return f"{self.column} = ANY({self._param(self._name)})"
+
+
+class NotIn(ArrayCompare):
+    suffix = "not_in"
+
+    def build(self) -> str:
+        return f"{self.column} <> ALL({self._param(self._name)})"
+
+
+class Contains(ArrayCompare):
+    """An array column holding every one of values, served by a GIN index."""
+
+    operator = "@>"
+    suffix = "contains"
+
+
+class ContainedBy(ArrayCompare):
+    operator = "<@"
+    suffix = "contained_by"
+
+
+class Overlaps(ArrayCompare):
+    """An array column holding any of values, served by a GIN index."""
+
+    operator = "&&"
+    suffix = "overlaps"
+
+
+class Between(Compare):
+    """low <= column <= high."""
+
+    suffix = "between"
+
+    def __init__(
+        self,
+        column: str,
+        low: ValidSqlArg,
+        high: ValidSqlArg,
+        cast: Optional[str] = None,
+    ):
+        super().__init__(column, (low, high), cast)
+
+    def build(self) -> str:
+        return (
+            f"{self.column} BETWEEN {self._param(self._name + '_low')}"
+            f" AND {self._param(self._name + '_high')}"
+        )
+
+    def args(self) -> dict[str, ValidSqlArg]:
+        low, high = self.value
+        return {self._name + "_low": low, self._name + "_high": high}
+
+    def shape(self) -> Hashable:
+        return (Between, self.column, self.cast, tuple(map(value_shape, self.value)))
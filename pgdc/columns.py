@@ -0,0 +1,239 @@
+import dataclasses
+import struct
+from typing import Any, Optional, Sequence, Type
+
+from .relation import Relation
+from .types import field_types, sql_type, unwrap_optional
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+Columns = dict[str, Any]
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+# Microseconds and days between the unix and the postgres epoch.
+_EPOCH_US = 946_684_800_000_000
+_EPOCH_DAYS = 10_957
+
+# Types of a constant size in binary COPY output: the wire format, the
+# array dtype and the value standing in for NULL.
+FIXED_TYPES: dict[str, tuple[str, str, str]] = {
+    "smallint": (">i2", "int16", "0"),
+    "integer": (">i4", "int32", "0"),
+    "bigint": (">i8", "int64", "0"),
+    "real": (">f4", "float32", "0"),
+    "double precision": (">f8", "float64", "0"),
+    "boolean": ("?", "bool", "false"),
+    "timestamp": (">i8", "datetime64[us]", "'2000-01-01'"),
+    "timestamptz": (">i8", "datetime64[us]", "'2000-01-01 00:00:00+00'"),
+    "date": (">i4", "datetime64[D]", "'2000-01-01'"),
+}
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("Columnar reads need numpy, pip install numpy")
+
+
+@dataclasses.dataclass(frozen=True)
+class ColumnSpec:
+    name: str
+    sql_type: str
+    optional: bool
+
+    @property
+    def fixed(self) -> bool:
+        return self.sql_type in FIXED_TYPES
+
+    @property
+    def dtype(self) -> str:
+        return FIXED_TYPES[self.sql_type][1] if self.fixed else "object"
+
+
+class ColumnPlan:
+    """
+    How to read columns of a relation into arrays.
+
+    Columns of fixed size types are typed from the dataclass annotations:
+    int is read as int64, float as float64, datetime as datetime64[us] and
+    so on, Optional columns as masked arrays. Other columns are object
+    arrays. If every column has a fixed size type, the rows can be read
+    from binary COPY output as one structured array, without decoding
+    each value in Python.
+    """
+
+    def __init__(self, cls: Type[Relation], columns: Sequence[str]):
+        require_numpy()
+        types = field_types(cls)
+        self.specs = [
+            ColumnSpec(name, sql_type(cls, name), unwrap_optional(types[name])[1])
+            for name in columns
+        ]
+        self.copyable = all(spec.fixed for spec in self.specs)
+
+    def expressions(self, copy: bool) -> list[str]:
+        """
+        The select expressions of the columns.
+
+        For COPY, every column is cast to its type and NULLs are replaced by
+        a constant next to a flag, so that all rows have the same size.
+        Records carry timestamps and dates as integers from the unix epoch.
+        """
+        expressions = []
+        for spec in self.specs:
+            if copy:
+                cast = f"{spec.name}::{spec.sql_type}"
+                if spec.optional:
+                    null = FIXED_TYPES[spec.sql_type][2]
+                    expressions.append(f"coalesce({cast}, {null})")
+                    expressions.append(f"{spec.name} IS NULL")
+                else:
+                    expressions.append(cast)
+            elif spec.sql_type in ("timestamp", "timestamptz"):
+                expressions.append(
+                    f"(EXTRACT(EPOCH FROM {spec.name}) * 1000000)::bigint"
+                )
+            elif spec.sql_type == "date":
+                expressions.append(f"({spec.name} - DATE '1970-01-01')")
+            else:
+                expressions.append(spec.name)
+        return expressions
+
+    def copy_dtype(self) -> Any:
+        """The structured dtype of one binary COPY row."""
+        fields = [("count", ">i2")]
+        for i, spec in enumerate(self.specs):
+            wire = FIXED_TYPES[spec.sql_type][0]
+            fields += [(f"length_{i}", ">i4"), (f"value_{i}", wire)]
+            if spec.optional:
+                fields += [(f"null_length_{i}", ">i4"), (f"null_{i}", "?")]
+        return np.dtype(fields)
+
+    def _column(self, spec: ColumnSpec, values: Any, nulls: Optional[Any]) -> Any:
+        if spec.sql_type in ("timestamp", "timestamptz"):
+            values = values.astype("int64").view("datetime64[us]")
+        elif spec.sql_type == "date":
+            values = values.astype("int64").view("datetime64[D]")
+        else:
+            values = values.astype(spec.dtype)
+
+        if nulls is None:
+            return values
+        return np.ma.MaskedArray(values, mask=nulls)
+
+    def from_copy(self, rows: Any) -> Columns:
+        """Turns a structured array of COPY rows into columns."""
+        columns = {}
+        for i, spec in enumerate(self.specs):
+            values = rows[f"value_{i}"]
+            if spec.sql_type in ("timestamp", "timestamptz"):
+                values = values.astype("int64") + _EPOCH_US
+            elif spec.sql_type == "date":
+                values = values.astype("int64") + _EPOCH_DAYS
+
+            nulls = rows[f"null_{i}"].copy() if spec.optional else None
+            columns[spec.name] = self._column(spec, values, nulls)
+        return columns
+
+    def from_records(self, records: Sequence[Any]) -> Columns:
+        """Turns fetched records of expressions(copy=False) into columns."""
+        columns = {}
+        for i, spec in enumerate(self.specs):
+            values = [record[i] for record in records]
+            nulls = None
+
+            if spec.optional:
+                nulls = np.fromiter(
+                    (value is None for value in values), "bool", len(values)
+                )
+
+            if spec.fixed:
+                if nulls is not None and nulls.any():
+                    values = [0 if value is None else value for value in values]
+                wire = "int64" if spec.dtype.startswith("datetime") else spec.dtype
+                array = np.array(values, dtype=wire)
+            else:
+                array = np.empty(len(values), dtype="object")
+                array[:] = values
+
+            columns[spec.name] = self._column(spec, array, nulls)
+        return columns
+
+    def empty(self) -> Columns:
+        return self.from_records([])
+
+
+class CopyDecoder:
+    """
+    Splits binary COPY output of a ColumnPlan into batches of columns.
+
+    feed() takes the output as it arrives and returns the columns of every
+    complete batch of batch_size rows, finish() those of the remaining rows.
+    """
+
+    def __init__(self, plan: ColumnPlan, batch_size: Optional[int] = None):
+        self.plan = plan
+        self.dtype = plan.copy_dtype()
+        self.batch_size = batch_size
+        self._buffer = bytearray()
+        self._header = False
+
+    def _skip_header(self) -> bool:
+        if len(self._buffer) < len(COPY_SIGNATURE) + 8:
+            return False
+
+        if not self._buffer.startswith(COPY_SIGNATURE):
+            raise ValueError("Not binary COPY output")
+
+        offset = len(COPY_SIGNATURE) + 4
+        (extension,) = struct.unpack_from(">i", self._buffer, offset)
+        if len(self._buffer) < offset + 4 + extension:
+            return False
+
+        del self._buffer[: offset + 4 + extension]
+        self._header = True
+        return True
+
+    def _take(self, rows: int) -> Columns:
+        size = rows * self.dtype.itemsize
+        array = np.frombuffer(bytes(self._buffer[:size]), self.dtype, rows)
+        del self._buffer[:size]
+        return self.plan.from_copy(array)
+
+    def feed(self, data: bytes) -> list[Columns]:
+        self._buffer += data
+        if not self._header and not self._skip_header():
+            return []
+
+        rows = len(self._buffer) // self.dtype.itemsize
+        batch_size = self.batch_size or rows
+        batches = []
+        while batch_size and rows >= batch_size:
+            batches.append(self._take(batch_size))
+            rows -= batch_size
+        return batches
+
+    def finish(self) -> Optional[Columns]:
+        """The columns of the rows left over, before the COPY trailer."""
+        rows = len(self._buffer) // self.dtype.itemsize
+        if self._buffer[rows * self.dtype.itemsize :] != b"\xff\xff":
+            raise ValueError("Truncated binary COPY output")
+
+        return self._take(rows) if rows else None
+
+
+def concatenate(plan: ColumnPlan, batches: list[Columns]) -> Columns:
+    if not batches:
+        return plan.empty()
+    if len(batches) == 1:
+        return batches[0]
+
+    return {
+        spec.name: (np.ma.concatenate if spec.optional else np.concatenate)(
+            [batch[spec.name] for batch in batches]
+        )
+        for spec in plan.specs
+    }
@@ -1,9 +1,22 @@
 import dataclasses
-from typing import Optional, Sequence, Type
+from typing import Callable, Hashable, Optional, Sequence, Type
 
-from .args import ValidSqlArg
-from .clauses import Limit, OrderBy, Where
+from .args import ValidSqlArg, Verbatim
+from .cache import LRUCache
+from .clauses import (
+    GroupBy,
+    In,
+    Limit,
+    OrderBy,
+    Where,
+    kwargs_shape,
+    numbered,
+    required,
+)
+from .hydrators import compile_hydrators
 from .relation import Relation
+from .render import CompiledQuery, Flavor, compile_query
+from .types import sql_type
 
 NoWhere = Where()
 NoLimit = Limit(None)
@@ -20,37 +33,106 @@ class DcBuilder:
         cls: Type[Relation],
         table_name: Optional[str] = None,
         pkeys: Sequence[str] = tuple(),
+        cache_size: int = 256,
     ):
         self._cls = cls
+        self._compiled: LRUCache[Hashable, CompiledQuery] = LRUCache(cache_size)
         self.table_name = table_name or cls.__table_name__ or None
         self.pkeys = pkeys or cls.__table_pkeys__
 
         self.fields = tuple(
-            f for f in dataclasses.fields(cls) if not f.name.startswith("_")
+            f
+            for f in dataclasses.fields(cls)
+            if not f.name.startswith("_") and "relationship" not in f.metadata
         )
         self.attrs = [f.name for f in self.fields]
         self.pkeys_string = ", ".join(self.pkeys)
-        self.select_string = ", ".join(
-            f.metadata.get("select") or f.name for f in self.fields
+        self._expressions = {
+            f.name: f.metadata.get("select") or f.name for f in self.fields
+        }
+        self.select_string = ", ".join(self._expressions.values())
+        # Rows are read by position, in the order of select_string.
+        self.hydrate, self.hydrate_many = compile_hydrators(cls, self.attrs)
+        self._hydrators: LRUCache[tuple[str, ...], tuple] = LRUCache(cache_size)
+
+        # Fields with metadata={"deferred": True} are not selected by default.
+        self.deferred = tuple(f.name for f in self.fields if f.metadata.get("deferred"))
+        self.default_columns = tuple(
+            name for name in self.attrs if name not in self.deferred
         )
 
+    def columns(
+        self,
+        only: Optional[Sequence[str]] = None,
+        defer: Optional[Sequence[str]] = None,
+    ) -> tuple[str, ...]:
+        """
+        Returns the columns a select loads, in field order
+
+        only restricts them to the given fields and the primary keys, defer
+        leaves the given fields out of the default ones.
+        """
+        unknown = set(only or ()).union(defer or ()).difference(self.attrs)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        if only is None:
+            columns = self.default_columns
+        else:
+            wanted = set(only).union(self.pkeys)
+            columns = tuple(name for name in self.attrs if name in wanted)
+
+        if defer:
+            if set(defer).intersection(self.pkeys):
+                raise ValueError("Primary keys cannot be deferred")
+            columns = tuple(name for name in columns if name not in defer)
+
+        return columns
+
+    def hydrators(self, columns: Sequence[str]) -> tuple[Callable, Callable]:
+        """
+        Returns the functions building instances from rows of columns
+
+        Fields left out of columns are set to DEFERRED.
+        """
+        columns = tuple(columns)
+        if columns == tuple(self.attrs):
+            return self.hydrate, self.hydrate_many
+
+        hydrators = self._hydrators.get(columns)
+        if hydrators is None:
+            unloaded = [name for name in self.attrs if name not in columns]
+            hydrators = self._hydrators.put(
+                columns, compile_hydrators(self._cls, columns, unloaded)
+            )
+        return hydrators
+
+    def _returning_string(self, returning: bool) -> str:
+        return f"RETURNING {self.select_string}" if returning else ""
+
     def select(
         self,
         where: Optional[Where] = None,
         order_by: Optional[OrderBy] = None,
         limit: Optional[Limit] = None,
+        columns: Optional[Sequence[str]] = None,
     ) -> tuple[str, dict[str, ValidSqlArg]]:
         """
         Returns the raw, unrendered sql select query
+
+        columns defaults to the fields that are not deferred.
         """
-        where = where or NoWhere
+        where = numbered(where or NoWhere)
         order_by = order_by or NoOrder
         limit = limit or NoLimit
+        select_string = ", ".join(
+            self._expressions[name] for name in columns or self.default_columns
+        )
         return (  # nosec
             f"""
             -- Fetching {self._cls}.
             SELECT
-                {self.select_string}
+                {select_string}
             FROM
                 {self.table_name}
             {where}
@@ -59,9 +141,115 @@ class DcBuilder:
             where.args() | order_by.args() | limit.args(),
         )
 
+    def count(
+        self, where: Optional[Where] = None
+    ) -> tuple[str, dict[str, ValidSqlArg]]:
+        """
+        Returns the raw, unrendered sql counting the matching rows
+        """
+        where = numbered(where or NoWhere)
+        return (  # nosec
+            f"""
+            -- Counting {self._cls}.
+            SELECT
+                count(*)
+            FROM
+                {self.table_name}
+            {where};""",
+            where.args(),
+        )
+
+    def exists(
+        self, where: Optional[Where] = None
+    ) -> tuple[str, dict[str, ValidSqlArg]]:
+        """
+        Returns the raw, unrendered sql telling whether a row matches
+        """
+        where = numbered(where or NoWhere)
+        return (  # nosec
+            f"""
+            -- Checking for {self._cls}.
+            SELECT EXISTS (
+                SELECT
+                    1
+                FROM
+                    {self.table_name}
+                {where}
+                LIMIT 1
+            );""",
+            where.args(),
+        )
+
+    def aggregate(
+        self,
+        aggregates: Sequence[tuple[str, str]],
+        where: Optional[Where] = None,
+        group_by: Sequence[str] = (),
+        order_by: Optional[OrderBy] = None,
+    ) -> tuple[str, dict[str, ValidSqlArg]]:
+        """
+        Returns the raw, unrendered sql computing aggregates per group
+
+        aggregates are (function, column) pairs, selected after the group_by
+        columns and named function_column, or count for count(*).
+        """
+        where = numbered(where or NoWhere)
+        order_by = order_by or NoOrder
+        expressions = [*group_by] + [
+            (
+                f"{function}(*) AS {function}"
+                if column == "*"
+                else f"{function}({column}) AS {function}_{column}"
+            )
+            for function, column in aggregates
+        ]
+        return (  # nosec
+            f"""
+            -- Aggregating {self._cls}.
+            SELECT
+                {", ".join(expressions)}
+            FROM
+                {self.table_name}
+            {where}
+            {GroupBy(*group_by)}
+            {order_by};""",
+            where.args() | order_by.args(),
+        )
+
+    def select_columns(
+        self,
+        expressions: Sequence[str],
+        where: Optional[Where] = None,
+        order_by: Optional[OrderBy] = None,
+        limit: Optional[Limit] = None,
+    ) -> tuple[str, dict[str, ValidSqlArg]]:
+        """
+        Returns the raw, unrendered sql selecting expressions
+
+        The query has no terminating semicolon, so it can be wrapped in a
+        COPY statement.
+        """
+        where = numbered(where or NoWhere)
+        order_by = order_by or NoOrder
+        limit = limit or NoLimit
+        return (  # nosec
+            f"""
+            -- Fetching columns of {self._cls}.
+            SELECT
+                {", ".join(expressions)}
+            FROM
+                {self.table_name}
+            {where}
+            {order_by}
+            {limit}
+            """,
+            where.args() | order_by.args() | limit.args(),
+        )
+
     def update(
         self,
         where: Optional[Where] = None,
+        returning: bool = True,
         **kwargs: ValidSqlArg,
     ) -> tuple[str, dict[str, ValidSqlArg]]:
         """
@@ -69,8 +257,8 @@ class DcBuilder:
         """
         assert len(kwargs) > 0
 
-        where = where or NoWhere
-        update_string = ", ".join([key + " = {" + key + "}" for key in kwargs.keys()])
+        where = numbered(required(where, "UPDATE"))
+        update_string = ", ".join([key + " = {" + key + "}" for key in sorted(kwargs)])
 
         return (  # nosec
             f"""
@@ -80,24 +268,26 @@ class DcBuilder:
             SET
                 {update_string}
             {where}
-            RETURNING
-                {self.select_string};""",
+            {self._returning_string(returning)};""",
             where.args() | kwargs,
         )
 
     def insert(
-        self, update_on_collision: bool = False, **kwargs: ValidSqlArg
+        self,
+        update_on_collision: bool = False,
+        returning: bool = True,
+        **kwargs: ValidSqlArg,
     ) -> tuple[str, dict[str, ValidSqlArg]]:
 
-        attrs_string = ", ".join(kwargs.keys())
-        values_string = ", ".join(["{" + key + "}" for key in kwargs.keys()])
+        attrs_string = ", ".join(sorted(kwargs))
+        values_string = ", ".join(["{" + key + "}" for key in sorted(kwargs)])
         upsert_string = "-- No conflict clause"
 
         if update_on_collision:
             upsert_attrs = ", ".join(
                 [
                     f"{key} = EXCLUDED.{key}"
-                    for key in kwargs.keys()
+                    for key in sorted(kwargs)
                     if key not in self.pkeys
                 ]
             )
@@ -117,22 +307,424 @@ class DcBuilder:
             VALUES
                 ({values_string})
             {upsert_string}
-            RETURNING
-                {self.select_string};""",
+            {self._returning_string(returning)};""",
             kwargs,
         )
 
     def delete(
         self,
         where: Optional[Where] = None,
+        returning_pkeys: bool = False,
     ) -> tuple[str, dict[str, ValidSqlArg]]:
-        assert where is not None
-        where = where or NoWhere
+        where = numbered(required(where, "DELETE"))
+        returning_string = f"RETURNING {self.pkeys_string}" if returning_pkeys else ""
 
         return (  # nosec
             f"""
             -- Deleting {self._cls}.
             DELETE FROM {self.table_name}
-            {where};""",
+            {where}
+            {returning_string};""",
+            where.args(),
+        )
+
+    def insert_many(
+        self, returning: bool = False, **columns: ValidSqlArg
+    ) -> tuple[str, dict[str, ValidSqlArg]]:
+        """
+        Returns the raw, unrendered sql inserting one row per array element
+
+        Every column takes a list of values, bound as one array parameter
+        each, or a Verbatim rendered into every row.
+        """
+        params = [
+            key for key in sorted(columns) if not isinstance(columns[key], Verbatim)
+        ]
+        assert len(params) > 0
+
+        attrs_string = ", ".join(sorted(columns))
+        values_string = ", ".join(
+            key if key in params else "{" + key + "}" for key in sorted(columns)
+        )
+        types = [sql_type(self._cls, key) for key in params]
+        if any(type_.endswith("]") for type_ in types):
+            raise TypeError("unnest() flattens array columns, insert them by COPY")
+
+        unnest_string = ", ".join(
+            "{" + key + "}::" + type_ + "[]" for key, type_ in zip(params, types)
+        )
+        returning_string = self._returning_string(returning)
+
+        return (  # nosec
+            f"""
+            -- Bulk insert {self._cls}.
+            INSERT INTO
+                {self.table_name} ({attrs_string})
+            SELECT
+                {values_string}
+            FROM
+                unnest({unnest_string}) AS rows ({", ".join(params)})
+            {returning_string};""",
+            columns,
+        )
+
+    def where_in(self, columns: Sequence[str], keys: Sequence[tuple]) -> Where:
+        """
+        Returns a Where matching rows whose columns equal any of the keys
+
+        The keys are bound as one array per column, so the query text does
+        not depend on the number of keys.
+        """
+        if len(columns) == 1:
+            return Where(In(columns[0], [key for key, in keys]))
+
+        values = {key: [row[i] for row in keys] for i, key in enumerate(columns)}
+
+        unnest_string = ", ".join(
+            "{" + key + "}::" + sql_type(self._cls, key) + "[]" for key in columns
+        )
+        return Where(
+            f"({', '.join(columns)}) IN (SELECT * FROM unnest({unnest_string}))",
+            **values,
+        )
+
+    def where_pkeys(self, pkeys: Sequence[tuple]) -> Where:
+        """
+        Returns a Where matching any of the given primary key tuples
+        """
+        return self.where_in(self.pkeys, pkeys)
+
+    @property
+    def staging_name(self) -> str:
+        return "pgdc_staging_" + self.table_name.replace(".", "_")
+
+    def create_staging(self, *columns: str) -> str:
+        """
+        Returns sql creating an empty temporary table holding columns
+
+        The table is dropped at the end of the transaction.
+        """
+        return f"""
+            -- Staging {self._cls}.
+            CREATE TEMPORARY TABLE {self.staging_name}
+            ON COMMIT DROP AS
+                SELECT {", ".join(columns)} FROM {self.table_name}
+            WITH NO DATA;"""  # nosec
+
+    def merge_staging(
+        self,
+        columns: Sequence[str],
+        conflict: Sequence[str],
+        update: Sequence[str],
+        skip_unchanged: bool = True,
+        **verbatims: ValidSqlArg,
+    ) -> tuple[str, dict[str, ValidSqlArg]]:
+        """
+        Returns the raw, unrendered sql upserting the staged rows
+
+        The query counts the inserted and the updated rows. Verbatims are
+        rendered into every row instead of being read from the staging table.
+        """
+        attrs = sorted(set(columns) | set(verbatims))
+        attrs_string = ", ".join(attrs)
+        values_string = ", ".join(
+            "{" + key + "}" if key in verbatims else key for key in attrs
+        )
+        upsert_string = "DO NOTHING"
+
+        if update:
+            compared = [key for key in update if key not in verbatims]
+            upsert_string = "DO UPDATE SET " + ", ".join(
+                f"{key} = EXCLUDED.{key}" for key in update
+            )
+            if skip_unchanged and compared:
+                upsert_string += f"""
+                    WHERE ({", ".join(f"{self.table_name}.{key}" for key in compared)})
+                    IS DISTINCT FROM ({", ".join(f"EXCLUDED.{key}" for key in compared)})"""
+
+        return (  # nosec
+            f"""
+            -- Merging staged {self._cls}.
+            WITH merged AS (
+                INSERT INTO
+                    {self.table_name} ({attrs_string})
+                SELECT
+                    {values_string}
+                FROM
+                    {self.staging_name}
+                ON CONFLICT ({", ".join(conflict)}) {upsert_string}
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT
+                count(*) FILTER (WHERE inserted) AS inserted,
+                count(*) FILTER (WHERE NOT inserted) AS updated
+            FROM
+                merged;""",
+            dict(verbatims),
+        )
+
+    def resolve(
+        self, column: str, values: Sequence[ValidSqlArg]
+    ) -> tuple[str, dict[str, ValidSqlArg]]:
+        """
+        Returns the raw, unrendered sql mapping values of a unique column to
+        the primary key, inserting the values missing
+
+        Rows inserted by a concurrent transaction after the query started
+        are neither inserted nor selected, their values are left out.
+        """
+        assert len(self.pkeys) == 1
+        (pkey,) = self.pkeys
+
+        return (  # nosec
+            f"""
+            -- Resolving {self._cls} by {column}.
+            WITH wanted AS (
+                SELECT DISTINCT {column}
+                FROM unnest({{{column}}}::{sql_type(self._cls, column)}[])
+                    AS wanted ({column})
+            ), inserted AS (
+                INSERT INTO
+                    {self.table_name} ({column})
+                SELECT
+                    {column}
+                FROM
+                    wanted
+                ON CONFLICT ({column}) DO NOTHING
+                RETURNING {column}, {pkey}
+            )
+            SELECT {column}, {pkey} FROM inserted
+            UNION ALL
+            SELECT {column}, {pkey} FROM {self.table_name}
+            WHERE {column} IN (SELECT {column} FROM wanted);""",
+            {column: values},
+        )
+
+    def _render(
+        self,
+        shape: Hashable,
+        build: Callable[[], tuple[str, dict[str, ValidSqlArg]]],
+        raw_args: dict[str, ValidSqlArg],
+        flavor: Flavor,
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """Renders a query, building and compiling its template only once."""
+        key = (shape, flavor)
+        compiled = self._compiled.get(key)
+
+        if compiled is None:
+            compiled = self._compiled.put(key, compile_query(*build(), flavor))
+
+        return compiled.query, compiled.bind(raw_args)
+
+    def render_select(
+        self,
+        where: Optional[Where] = None,
+        order_by: Optional[OrderBy] = None,
+        limit: Optional[Limit] = None,
+        flavor: Flavor = "asyncpg",
+        columns: Optional[Sequence[str]] = None,
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql select query and its positional arguments
+        """
+        where = numbered(where or NoWhere)
+        order_by = order_by or NoOrder
+        limit = limit or NoLimit
+        columns = tuple(columns or self.default_columns)
+
+        return self._render(
+            ("select", where.shape(), order_by.shape(), limit.shape(), columns),
+            lambda: self.select(where, order_by, limit, columns),
+            where.args() | order_by.args() | limit.args(),
+            flavor,
+        )
+
+    def render_count(
+        self, where: Optional[Where] = None, flavor: Flavor = "asyncpg"
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql count query and its positional arguments
+        """
+        where = numbered(where or NoWhere)
+        return self._render(
+            ("count", where.shape()), lambda: self.count(where), where.args(), flavor
+        )
+
+    def render_exists(
+        self, where: Optional[Where] = None, flavor: Flavor = "asyncpg"
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql exists query and its positional arguments
+        """
+        where = numbered(where or NoWhere)
+        return self._render(
+            ("exists", where.shape()), lambda: self.exists(where), where.args(), flavor
+        )
+
+    def render_aggregate(
+        self,
+        aggregates: Sequence[tuple[str, str]],
+        where: Optional[Where] = None,
+        group_by: Sequence[str] = (),
+        order_by: Optional[OrderBy] = None,
+        flavor: Flavor = "asyncpg",
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql aggregate query and its positional arguments
+        """
+        where = numbered(where or NoWhere)
+        order_by = order_by or NoOrder
+        return self._render(
+            (
+                "aggregate",
+                tuple(aggregates),
+                where.shape(),
+                tuple(group_by),
+                order_by.shape(),
+            ),
+            lambda: self.aggregate(aggregates, where, group_by, order_by),
+            where.args() | order_by.args(),
+            flavor,
+        )
+
+    def render_select_columns(
+        self,
+        expressions: Sequence[str],
+        where: Optional[Where] = None,
+        order_by: Optional[OrderBy] = None,
+        limit: Optional[Limit] = None,
+        flavor: Flavor = "asyncpg",
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql selecting expressions and its positional arguments
+        """
+        where = numbered(where or NoWhere)
+        order_by = order_by or NoOrder
+        limit = limit or NoLimit
+
+        return self._render(
+            (
+                "select_columns",
+                tuple(expressions),
+                where.shape(),
+                order_by.shape(),
+                limit.shape(),
+            ),
+            lambda: self.select_columns(expressions, where, order_by, limit),
+            where.args() | order_by.args() | limit.args(),
+            flavor,
+        )
+
+    def render_update(
+        self,
+        where: Optional[Where] = None,
+        returning: bool = True,
+        flavor: Flavor = "asyncpg",
+        **kwargs: ValidSqlArg,
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql update query and its positional arguments
+        """
+        where = numbered(required(where, "UPDATE"))
+
+        return self._render(
+            ("update", where.shape(), returning, kwargs_shape(kwargs)),
+            lambda: self.update(where, returning, **kwargs),
+            where.args() | kwargs,
+            flavor,
+        )
+
+    def render_insert(
+        self,
+        update_on_collision: bool = False,
+        returning: bool = True,
+        flavor: Flavor = "asyncpg",
+        **kwargs: ValidSqlArg,
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql insert query and its positional arguments
+        """
+        return self._render(
+            ("insert", update_on_collision, returning, kwargs_shape(kwargs)),
+            lambda: self.insert(update_on_collision, returning, **kwargs),
+            kwargs,
+            flavor,
+        )
+
+    def render_insert_many(
+        self,
+        returning: bool = False,
+        flavor: Flavor = "asyncpg",
+        **columns: ValidSqlArg,
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql bulk insert query and its positional arguments
+        """
+        return self._render(
+            ("insert_many", returning, kwargs_shape(columns)),
+            lambda: self.insert_many(returning, **columns),
+            columns,
+            flavor,
+        )
+
+    def render_merge_staging(
+        self,
+        columns: Sequence[str],
+        conflict: Sequence[str],
+        update: Sequence[str],
+        skip_unchanged: bool = True,
+        flavor: Flavor = "asyncpg",
+        **verbatims: ValidSqlArg,
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql merging the staging table
+        """
+        return self._render(
+            (
+                "merge_staging",
+                tuple(sorted(columns)),
+                tuple(conflict),
+                tuple(update),
+                skip_unchanged,
+                kwargs_shape(verbatims),
+            ),
+            lambda: self.merge_staging(
+                columns, conflict, update, skip_unchanged, **verbatims
+            ),
+            verbatims,
+            flavor,
+        )
+
+    def render_resolve(
+        self,
+        column: str,
+        values: Sequence[ValidSqlArg],
+        flavor: Flavor = "asyncpg",
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql resolving values of a unique column
+        """
+        return self._render(
+            ("resolve", column),
+            lambda: self.resolve(column, values),
+            {column: values},
+            flavor,
+        )
+
+    def render_delete(
+        self,
+        where: Optional[Where] = None,
+        returning_pkeys: bool = False,
+        flavor: Flavor = "asyncpg",
+    ) -> tuple[str, list[ValidSqlArg]]:
+        """
+        Returns the rendered sql delete query and its positional arguments
+        """
+        where = numbered(required(where, "DELETE"))
+
+        return self._render(
+            ("delete", where.shape(), returning_pkeys),
+            lambda: self.delete(where, returning_pkeys),
             where.args(),
+            flavor,
         )
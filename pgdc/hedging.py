@@ -0,0 +1,95 @@
+import math
+from collections import deque
+from typing import Optional
+
+from .cache import LRUCache
+
+
+class HedgePolicy:
+    """
+    When to send a second attempt of a read that is slow to answer.
+
+    A read is hedged once it has not answered within delay seconds or, if
+    delay is None, within the given percentile of the recent latencies of
+    its query shape. Shapes with fewer than min_samples recent latencies
+    are not hedged.
+
+    Hedges are paid from a budget earning budget tokens per read, a hedge
+    costing one, so that at most that fraction of reads is hedged over
+    time, with bursts of up to burst hedges. This keeps hedging from
+    doubling the load of a database that is slow because it is overloaded.
+    """
+
+    def __init__(
+        self,
+        delay: Optional[float] = None,
+        percentile: float = 0.95,
+        budget: float = 0.05,
+        burst: float = 10.0,
+        window: int = 200,
+        min_samples: int = 20,
+        max_shapes: int = 1024,
+    ):
+        self.delay = delay
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.window = window
+        self.min_samples = min_samples
+        self.reads = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._tokens = burst
+        self._latencies: LRUCache[str, deque] = LRUCache(max_shapes)
+        self._samples: LRUCache[str, int] = LRUCache(max_shapes)
+        self._delays: LRUCache[str, float] = LRUCache(max_shapes)
+
+    def record(self, fingerprint: str, latency: float):
+        """Adds the latency of an attempt of a query shape."""
+        latencies = self._latencies.get(fingerprint)
+        if latencies is None:
+            latencies = self._latencies.put(fingerprint, deque(maxlen=self.window))
+
+        latencies.append(latency)
+        # The percentile is recomputed every tenth of a window.
+        samples = self._samples.put(fingerprint, self._samples.get(fingerprint, 0) + 1)
+        if samples % max(1, self.window // 10) == 0:
+            self._delays.pop(fingerprint)
+
+    def delay_for(self, fingerprint: str) -> Optional[float]:
+        """How long to wait for the first attempt, None to not hedge."""
+        if self.delay is not None:
+            return self.delay
+
+        delay = self._delays.get(fingerprint)
+        if delay is None:
+            latencies = self._latencies.get(fingerprint)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+
+            ordered = sorted(latencies)
+            rank = math.ceil(self.percentile * len(ordered))
+            index = min(len(ordered), max(1, rank)) - 1
+            delay = self._delays.put(fingerprint, ordered[index])
+        return delay
+
+    def admit(self):
+        """Counts a read, earning budget."""
+        self.reads += 1
+        self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def spend(self) -> bool:
+        """Takes a hedge from the budget, if there is one left."""
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+        self.hedged += 1
+        return True
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "reads": self.reads,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
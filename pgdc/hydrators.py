@@ -0,0 +1,78 @@
+import dataclasses
+from typing import Any, Callable, Sequence, Type
+
+from .relation import DEFERRED, Relation
+
+Hydrator = Callable[[Any], Any]
+BatchHydrator = Callable[[Sequence[Any]], list[Any]]
+
+_MISSING = dataclasses.MISSING
+
+
+def compile_hydrators(
+    cls: Type[Relation], columns: Sequence[str], unloaded: Sequence[str] = ()
+) -> tuple[Hydrator, BatchHydrator]:
+    """
+    Generates functions building cls instances from rows of columns.
+
+    Row values are read by position and stored on the instance directly,
+    bypassing the dataclass __init__ and, for frozen dataclasses, the
+    __setattr__ guard. Fields not in columns get their defaults, those in
+    unloaded are set to DEFERRED.
+    __post_init__ only runs if cls opted in with post_init=True.
+    """
+    fields = {f.name: f for f in dataclasses.fields(cls)}
+    slotted = "__slots__" in cls.__dict__
+    namespace: dict[str, Any] = {
+        "__new": object.__new__,
+        "__set": object.__setattr__,
+        "__cls": cls,
+        "__deferred": DEFERRED,
+    }
+    body: list[str] = ["obj = __new(__cls)"]
+
+    if not slotted:
+        body.append("d = obj.__dict__")
+
+    def assign(name: str, value: str):
+        body.append(
+            f"__set(obj, {name!r}, {value})" if slotted else f"d[{name!r}] = {value}"
+        )
+
+    for i, name in enumerate(columns):
+        assign(name, f"row[{i}]")
+
+    for name, field in fields.items():
+        if name in columns:
+            continue
+        if name in unloaded:
+            assign(name, "__deferred")
+        elif field.default is not _MISSING:
+            namespace[f"__default_{name}"] = field.default
+            assign(name, f"__default_{name}")
+        elif field.default_factory is not _MISSING:
+            namespace[f"__factory_{name}"] = field.default_factory
+            assign(name, f"__factory_{name}()")
+
+    if getattr(cls, "__table_post_init__", False) and hasattr(cls, "__post_init__"):
+        body.append("obj.__post_init__()")
+
+    one = "\n    ".join(body)
+    many = "\n        ".join(body)
+    source = (
+        f"def hydrate(row):\n"
+        f"    {one}\n"
+        f"    return obj\n"
+        f"\n"
+        f"def hydrate_many(rows):\n"
+        f"    result = []\n"
+        f"    append = result.append\n"
+        f"    for row in rows:\n"
+        f"        {many}\n"
+        f"        append(obj)\n"
+        f"    return result\n"
+    )
+    code = compile(source, f"<pgdc hydrators for {cls.__qualname__}>", "exec")
+    exec(code, namespace)  # nosec
+
+    return namespace["hydrate"], namespace["hydrate_many"]
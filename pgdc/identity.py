@@ -0,0 +1,69 @@
+from typing import Any, Hashable, Iterable, Optional, Type
+
+from .cache import LRUCache
+from .clauses import And
+from .relation import Relation
+
+PKey = tuple[Hashable, ...]
+
+
+def pkey_of(obj: Relation) -> PKey:
+    return tuple(getattr(obj, pkey) for pkey in obj.__table_pkeys__)
+
+
+class IdentityMap:
+    """
+    Known Relation instances by class and primary key.
+
+    Holds at most maxsize instances, evicting the least recently used.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._objects: LRUCache[tuple[type, PKey], Any] = LRUCache(maxsize)
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    @property
+    def hits(self) -> int:
+        return self._objects.hits
+
+    @property
+    def misses(self) -> int:
+        return self._objects.misses
+
+    def lookup_key(self, cls: Type[Relation], where: Optional[And]) -> Optional[PKey]:
+        """Returns the primary key where selects, if it selects by one."""
+        if where is None or not cls.__table_pkeys__:
+            return None
+
+        values = where.equalities()
+        if values is None or values.keys() != set(cls.__table_pkeys__):
+            return None
+
+        return tuple(values[pkey] for pkey in cls.__table_pkeys__)
+
+    def get(self, cls: Type[Relation], pkey: PKey) -> Optional[Any]:
+        return self._objects.get((cls, pkey))
+
+    def add(self, obj: Optional[Relation]) -> Optional[Relation]:
+        """Stores obj, replacing any instance known under its primary key."""
+        if obj is not None and obj.__table_pkeys__:
+            self._objects.put((type(obj), pkey_of(obj)), obj)
+        return obj
+
+    def add_many(self, objs: Iterable[Relation]):
+        for obj in objs:
+            self.add(obj)
+
+    def discard(self, cls: Type[Relation], pkey: PKey):
+        self._objects.pop((cls, pkey))
+
+    def discard_class(self, cls: Type[Relation]):
+        for key in self._objects:
+            if key[0] is cls:
+                self._objects.pop(key)
+
+    def clear(self):
+        self._objects.clear()
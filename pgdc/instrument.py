@@ -0,0 +1,180 @@
+import hashlib
+import math
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Optional
+
+from .statements import normalize_query
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query: str) -> str:
+    """A short, stable identifier of a query shape."""
+    return hashlib.blake2b(normalize_query(query).encode(), digest_size=8).hexdigest()
+
+
+@dataclass
+class QueryEvent:
+    """
+    What is known about a query at the time a hook is called.
+
+    Times are in seconds. rows, size and duration are set once the query
+    has finished, size being an estimate of the decoded result in memory.
+    """
+
+    fingerprint: str
+    query: str
+    args: Any
+    relation: Optional[str]
+    operation: str
+    pool_wait: float = 0.0
+    started: float = 0.0
+    first_row: Optional[float] = None
+    duration: Optional[float] = None
+    rows: int = 0
+    size: int = 0
+    error: Optional[BaseException] = None
+
+
+class QueryHook:
+    """
+    Receives query events from a Session. Override the events of interest.
+    """
+
+    def query_compiled(self, event: QueryEvent):
+        """A query shape is sent by the session for the first time."""
+
+    def query_sent(self, event: QueryEvent):
+        """A query is about to be sent."""
+
+    def query_first_row(self, event: QueryEvent):
+        """The first rows of a query have arrived."""
+
+    def query_finished(self, event: QueryEvent):
+        """A query has completed, successfully or with event.error."""
+
+    def query_deduplicated(self, event: QueryEvent):
+        """A query is answered by an identical one already in flight."""
+
+
+class PrintHook(QueryHook):
+    """Prints every query and its arguments, as Session(debug=True) does."""
+
+    def query_sent(self, event: QueryEvent):
+        print(event.query, event.args)
+
+
+class Histogram:
+    """
+    Counts values in logarithmic buckets growing by a factor of growth.
+
+    Quantiles are accurate to within one bucket.
+    """
+
+    def __init__(self, smallest: float = 1e-5, growth: float = 1.1):
+        self.smallest = smallest
+        self.growth = growth
+        self.count = 0
+        self.total = 0.0
+        self.buckets: dict[int, int] = {}
+
+    def add(self, value: float):
+        index = (
+            0
+            if value <= self.smallest
+            else math.ceil(math.log(value / self.smallest, self.growth))
+        )
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding quantile q."""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        return self.smallest * self.growth**index
+
+
+@dataclass
+class ShapeStats:
+    fingerprint: str
+    query: str
+    relation: Optional[str]
+    operation: str
+    calls: int = 0
+    errors: int = 0
+    rows: int = 0
+    deduplicated: int = 0
+    latency: Histogram = field(default_factory=Histogram)
+    pool_wait: Histogram = field(default_factory=Histogram)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "relation": self.relation,
+            "operation": self.operation,
+            "calls": self.calls,
+            "errors": self.errors,
+            "rows": self.rows,
+            "deduplicated": self.deduplicated,
+            "mean": self.latency.total / self.latency.count if self.calls else 0.0,
+            "p50": self.latency.quantile(0.5),
+            "p95": self.latency.quantile(0.95),
+            "p99": self.latency.quantile(0.99),
+            "pool_wait_p99": self.pool_wait.quantile(0.99),
+        }
+
+
+class QueryStats(QueryHook):
+    """
+    Aggregates latency per query shape and keeps a log of slow queries.
+
+    Queries taking at least slow_threshold seconds are kept in slow_log,
+    which holds the slow_log_size most recent ones.
+    """
+
+    def __init__(self, slow_threshold: float = 1.0, slow_log_size: int = 100):
+        self.slow_threshold = slow_threshold
+        self.shapes: dict[str, ShapeStats] = {}
+        self.slow_log: deque[QueryEvent] = deque(maxlen=slow_log_size)
+
+    def _stats(self, event: QueryEvent) -> ShapeStats:
+        stats = self.shapes.get(event.fingerprint)
+        if stats is None:
+            stats = self.shapes[event.fingerprint] = ShapeStats(
+                event.fingerprint,
+                normalize_query(event.query),
+                event.relation,
+                event.operation,
+            )
+        return stats
+
+    def query_finished(self, event: QueryEvent):
+        stats = self._stats(event)
+        stats.calls += 1
+        stats.rows += event.rows
+        stats.errors += event.error is not None
+        stats.latency.add(event.duration or 0.0)
+        stats.pool_wait.add(event.pool_wait)
+
+        if (event.duration or 0.0) >= self.slow_threshold:
+            self.slow_log.append(event)
+
+    def query_deduplicated(self, event: QueryEvent):
+        self._stats(event).deduplicated += 1
+
+    def summary(self) -> list[dict[str, Any]]:
+        """Per shape statistics, the most time consuming first."""
+        return sorted(
+            (stats.summary() for stats in self.shapes.values()),
+            key=lambda summary: summary["mean"] * summary["calls"],
+            reverse=True,
+        )
@@ -0,0 +1,67 @@
+import asyncio
+from typing import TYPE_CHECKING, Any, Type
+
+from .identity import PKey, pkey_of
+from .relation import Relation
+
+if TYPE_CHECKING:
+    from .session import Session
+
+
+class Loader:
+    """
+    Batches the primary key lookups of one relation.
+
+    Keys requested within the same event loop iteration, or within window
+    seconds of the first one, are loaded with a single query and the
+    instances are handed back to each caller. Unknown keys resolve to None.
+    Cancelling one caller does not cancel the lookup of the others.
+    """
+
+    def __init__(self, session: "Session", cls: Type[Relation], window: float = 0):
+        self.session = session
+        self.cls = cls
+        self.window = window
+        self.batches = 0
+        self._pending: dict[PKey, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def load(self, pkey: PKey) -> asyncio.Future:
+        future = self._pending.get(pkey)
+
+        if future is None:
+            loop = asyncio.get_running_loop()
+
+            if not self._pending:
+                if self.window:
+                    loop.call_later(self.window, self._dispatch)
+                else:
+                    loop.call_soon(self._dispatch)
+
+            future = self._pending[pkey] = loop.create_future()
+
+        return asyncio.shield(future)
+
+    def _dispatch(self):
+        batch, self._pending = self._pending, {}
+        self.batches += 1
+        task = asyncio.ensure_future(self._fetch(batch))
+        # The loop only keeps a weak reference to running tasks.
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: dict[PKey, asyncio.Future]):
+        try:
+            objs = await self.session.get(
+                self.cls, self.session.sql_builder(self.cls).where_pkeys(list(batch))
+            )
+        except Exception as exc:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        found: dict[PKey, Any] = {pkey_of(obj): obj for obj in objs}
+        for pkey, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(pkey))
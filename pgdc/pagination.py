@@ -0,0 +1,118 @@
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Generic, Optional, Sequence, TypeVar
+from uuid import UUID
+
+from .clauses import Cond, OrderBy
+
+T = TypeVar("T")
+
+# datetime precedes date, which it subclasses.
+_TYPES: dict[str, Any] = {
+    "datetime": datetime,
+    "date": date,
+    "time": time,
+    "decimal": Decimal,
+    "uuid": UUID,
+}
+_PARSERS: dict[str, Any] = {
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": time.fromisoformat,
+    "decimal": Decimal,
+    "uuid": UUID,
+}
+
+
+@dataclass(frozen=True)
+class Page(Generic[T]):
+    """
+    A page of results.
+
+    next is the continuation token of the following page, or None if this
+    is the last one.
+    """
+
+    items: list[T]
+    next: Optional[str]
+
+
+def _encode(value: Any) -> Any:
+    """Tags values json cannot represent with their type."""
+    for tag, type_ in _TYPES.items():
+        if isinstance(value, type_):
+            return {
+                tag: str(value) if tag in ("decimal", "uuid") else value.isoformat()
+            }
+    return value
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, dict):
+        ((tag, text),) = value.items()
+        return _PARSERS[tag](text)
+    return value
+
+
+class Keyset:
+    """
+    A keyset (seek) ordering over columns, ascending or descending.
+
+    Pages continue after the last row with a row value comparison such as
+    (a, b) > ($1, $2), which an index on the columns can answer directly.
+    """
+
+    def __init__(self, columns: Sequence[str], pkeys: Sequence[str]):
+        terms = [column.split() for column in columns]
+        directions = {term[1].upper() if len(term) > 1 else "ASC" for term in terms}
+
+        if len(directions) > 1:
+            raise ValueError("Keyset pagination needs one direction for all columns")
+
+        self.descending = directions == {"DESC"}
+        self.columns = [term[0] for term in terms]
+        # Ties are broken by the primary key, so that every row has a place.
+        self.columns += [pkey for pkey in pkeys if pkey not in self.columns]
+
+    def order_by(self) -> OrderBy:
+        direction = "DESC" if self.descending else "ASC"
+        return OrderBy(*(f"{column} {direction}" for column in self.columns))
+
+    def after(self, token: str) -> Cond:
+        """Returns the condition selecting the rows after token."""
+        values = self.decode(token)
+        names = [f"__after_{i}__" for i in range(len(values))]
+
+        return Cond(
+            f"({', '.join(self.columns)}) {'<' if self.descending else '>'} "
+            f"({', '.join('{' + name + '}' for name in names)})",
+            **dict(zip(names, values)),
+        )
+
+    def encode(self, obj: Any) -> str:
+        """Returns the continuation token of the rows after obj."""
+        values = [getattr(obj, column) for column in self.columns]
+
+        # A row comparison with NULL is never true, the rows after obj
+        # would be lost.
+        if None in values:
+            raise ValueError("Keyset pagination needs non null ordering columns")
+
+        payload = {"columns": self.columns, "values": list(map(_encode, values))}
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def decode(self, token: str) -> list[Any]:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            columns = payload["columns"]
+            values = [_decode(value) for value in payload["values"]]
+        except (LookupError, TypeError, ValueError, ArithmeticError):
+            raise ValueError("Malformed continuation token")
+
+        if columns != self.columns or len(values) != len(self.columns):
+            raise ValueError("Continuation token of a different ordering")
+
+        return values
@@ -1,15 +1,29 @@
 from typing import Optional, Sequence
 
 
+class Deferred:
+    """The value of fields a select did not load, see Session.undefer."""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "DEFERRED"
+
+
+DEFERRED = Deferred()
+
+
 class Relation:
     __table_name__: str
     __table_pkeys__: list[str]
+    __table_post_init__: bool
 
     def __init_subclass__(
         cls,
         table_name: Optional[str] = None,
         pkey: Optional[str] = None,
         pkeys: Optional[Sequence[str]] = None,
+        post_init: bool = False,
         **kwargs,
     ):
         super().__init_subclass__(**kwargs)
@@ -18,6 +32,7 @@ class Relation:
             cls.__table_name__ = table_name
 
         cls.__table_pkeys__ = [] if pkeys is None else list(pkeys)
+        cls.__table_post_init__ = post_init
 
         if pkey is not None:
             cls.__table_pkeys__.append(pkey)
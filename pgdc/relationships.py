@@ -0,0 +1,93 @@
+import collections.abc
+import dataclasses
+import typing
+from functools import lru_cache
+from typing import Any, Sequence, Type, Union
+
+from .relation import Relation
+from .types import field_types, unwrap_optional
+
+
+@dataclasses.dataclass(frozen=True)
+class Relationship:
+    """
+    How the instances of a relationship field are found.
+
+    local names the columns of the declaring relation referencing the
+    primary keys of the target. remote names the columns of the target
+    referencing the primary keys of the declaring relation.
+    """
+
+    local: tuple[str, ...] = ()
+    remote: tuple[str, ...] = ()
+
+
+@dataclasses.dataclass(frozen=True)
+class Related:
+    """A Relationship resolved against the annotation of its field."""
+
+    name: str
+    target: Type[Relation]
+    many: bool
+    local: tuple[str, ...]
+    remote: tuple[str, ...]
+
+
+def relationship(
+    local: Union[str, Sequence[str]] = (), remote: Union[str, Sequence[str]] = ()
+) -> Any:
+    """
+    Declares a field holding related instances rather than a column.
+
+    The annotation of the field names the target relation, a list of it for
+    one-to-many. Give local for many-to-one, as in
+
+        key: Optional[SearchKey] = relationship(local="key_id")
+
+    and remote for one-to-many, as in
+
+        indexes: Optional[list[SearchIndexInt]] = relationship(remote="key_id")
+
+    The field is None until loaded with prefetch.
+    """
+    local = (local,) if isinstance(local, str) else tuple(local)
+    remote = (remote,) if isinstance(remote, str) else tuple(remote)
+
+    if bool(local) == bool(remote):
+        raise ValueError("A relationship needs either local or remote columns")
+
+    return dataclasses.field(
+        default=None,
+        compare=False,
+        repr=False,
+        metadata={"relationship": Relationship(local, remote)},
+    )
+
+
+@lru_cache(maxsize=None)
+def relationships(cls: Type[Relation]) -> dict[str, Related]:
+    """The relationship fields of cls by name."""
+    types = field_types(cls)
+    related = {}
+
+    for field in dataclasses.fields(cls):
+        declared = field.metadata.get("relationship")
+        if declared is None:
+            continue
+
+        annotation, _ = unwrap_optional(types[field.name])
+        many = typing.get_origin(annotation) in (list, collections.abc.Sequence)
+        target = typing.get_args(annotation)[0] if many else annotation
+
+        if declared.local and many:
+            raise TypeError(f"{cls.__name__}.{field.name} refers to one instance")
+        if declared.local and len(declared.local) != len(target.__table_pkeys__):
+            raise TypeError(f"{cls.__name__}.{field.name} does not match the keys")
+        if declared.remote and len(declared.remote) != len(cls.__table_pkeys__):
+            raise TypeError(f"{cls.__name__}.{field.name} does not match the keys")
+
+        related[field.name] = Related(
+            field.name, target, many, declared.local, declared.remote
+        )
+
+    return related
@@ -5,15 +5,48 @@ from .args import (
     Psychopg2Args,
     SqlArgs,
     ValidSqlArg,
+    Verbatim,
 )
+from .cache import LRUCache
 
+Flavor = Literal["asyncpg", "psycopg2"]
 
-def render(
+
+class CompiledQuery:
+    """
+    A template query rendered once into its final sql.
+
+    Binding only pulls the positional arguments out of a raw argument dict.
+    """
+
+    __slots__ = ("query", "keys")
+
+    def __init__(self, query: str, keys: tuple[str, ...]):
+        self.query = query
+        self.keys = keys
+
+    def bind(self, raw_args: dict[str, ValidSqlArg]) -> list[ValidSqlArg]:
+        return [raw_args[key] for key in self.keys]
+
+
+_compiled_templates: LRUCache[tuple, CompiledQuery] = LRUCache(maxsize=1024)
+
+
+def verbatim_signature(raw_args: dict[str, ValidSqlArg]) -> tuple:
+    """The part of the arguments that is rendered into the sql text."""
+    return tuple(
+        (key, str(value))
+        for key, value in raw_args.items()
+        if isinstance(value, Verbatim)
+    )
+
+
+def compile_query(
     template_query: str,
     raw_args: dict[str, ValidSqlArg],
-    flavor: Literal["asyncpg", "psycopg2"] = "asyncpg",
-):
-
+    flavor: Flavor = "asyncpg",
+) -> CompiledQuery:
+    """Renders a template query without caching the result."""
     args: SqlArgs = (
         AsyncpgArgs(raw_args) if flavor == "asyncpg" else Psychopg2Args(raw_args)
     )
@@ -24,6 +57,20 @@ def render(
         print(template_query, args.args())
         raise
 
-    arguments = args.args()
+    return CompiledQuery(query, tuple(args.keys()))
+
+
+def render(
+    template_query: str,
+    raw_args: dict[str, ValidSqlArg],
+    flavor: Flavor = "asyncpg",
+):
+    key = (template_query, flavor, verbatim_signature(raw_args))
+    compiled = _compiled_templates.get(key)
+
+    if compiled is None:
+        compiled = _compiled_templates.put(
+            key, compile_query(template_query, raw_args, flavor)
+        )
 
-    return (query, arguments)
+    return (compiled.query, compiled.bind(raw_args))
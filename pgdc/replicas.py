@@ -0,0 +1,143 @@
+import asyncio
+import random
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Optional, Sequence
+
+import asyncpg
+
+LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    ELSE coalesce(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END AS lag;"""
+
+# Errors telling that a replica, rather than a query, has a problem.
+UNAVAILABLE_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.CannotConnectNowError,
+    asyncpg.exceptions.InterfaceError,
+)
+
+
+class Replica:
+    def __init__(self, pool: Any):
+        self.pool = pool
+        self.outstanding = 0
+        self.healthy = True
+        self.lag = 0.0
+        self.checked = 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"Replica(outstanding={self.outstanding}, "
+            f"healthy={self.healthy}, lag={self.lag:.3f})"
+        )
+
+
+class ReplicaSet:
+    """
+    Read replica pools, balanced by least outstanding requests.
+
+    A background check measures the replay lag of every replica each
+    check_interval seconds. Replicas failing the check, or failing to
+    serve a connection, are left out until a later check succeeds, as are
+    those lagging more than max_lag seconds. With no replica available,
+    reads go to the primary.
+
+    The lag is the age of the last replayed transaction, which overstates
+    it while the primary is idle.
+    """
+
+    def __init__(
+        self,
+        pools: Sequence[Any],
+        max_lag: Optional[float] = None,
+        check_interval: float = 5.0,
+    ):
+        self.replicas = [Replica(pool) for pool in pools]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._monitor: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def available(self) -> list[Replica]:
+        max_lag = float("inf") if self.max_lag is None else self.max_lag
+        return [
+            replica
+            for replica in self.replicas
+            if replica.healthy and replica.lag <= max_lag
+        ]
+
+    def choose(self) -> Optional[Replica]:
+        """The available replica with the fewest requests in flight."""
+        self._start()
+        candidates = self.available()
+        if not candidates:
+            return None
+
+        fewest = min(replica.outstanding for replica in candidates)
+        return random.choice(
+            [replica for replica in candidates if replica.outstanding == fewest]
+        )
+
+    async def check(self, replica: Replica):
+        try:
+            row = await replica.pool.fetchrow(LAG_QUERY)
+        except Exception:
+            replica.healthy = False
+        else:
+            replica.healthy = True
+            replica.lag = float(row["lag"])
+        replica.checked = time.monotonic()
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    def _start(self):
+        if self._monitor is None and self.check_interval:
+            self._monitor = asyncio.ensure_future(self._watch())
+
+    async def _watch(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.check_interval)
+
+    async def close(self):
+        """Stops the background check."""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Optional[Any]]:
+        """
+        Yields a connection of the chosen replica, or None if there is none
+        available. The replica is marked unhealthy if it fails to connect.
+        """
+        replica = self.choose()
+        if replica is None:
+            yield None
+            return
+
+        replica.outstanding += 1
+        try:
+            async with AsyncExitStack() as stack:
+                try:
+                    conn = await stack.enter_async_context(replica.pool.acquire())
+                except UNAVAILABLE_ERRORS:
+                    replica.healthy = False
+                    conn = None
+
+                try:
+                    yield conn
+                except UNAVAILABLE_ERRORS:
+                    replica.healthy = False
+                    raise
+        finally:
+            replica.outstanding -= 1
@@ -0,0 +1,167 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Type
+
+from .args import ValidSqlArg
+from .relation import Relation
+
+Rows = list[tuple]
+
+
+def freeze(value: Any) -> Hashable:
+    """Turns list arguments into tuples so they can be part of a key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(map(freeze, value))
+    return value
+
+
+def rows_size(rows: Rows) -> int:
+    """A rough estimate of the memory held by rows."""
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(row) + sum(map(sys.getsizeof, row)) for row in rows
+    )
+
+
+class CacheBackend:
+    """
+    The store behind a ResultCache.
+
+    Keys are tuples starting with the namespace of the relation they were
+    read from. invalidate() must drop, or stop returning, every entry of a
+    namespace; a shared store would typically keep a version per namespace.
+    """
+
+    evictions: int = 0
+
+    async def get(self, key: tuple) -> Optional[Rows]:
+        raise NotImplementedError()
+
+    async def set(self, key: tuple, rows: Rows, ttl: float):
+        raise NotImplementedError()
+
+    async def invalidate(self, namespace: str):
+        raise NotImplementedError()
+
+
+class MemoryBackend(CacheBackend):
+    """
+    An in-process store bounded by entries and, optionally, bytes.
+
+    The least recently used entries are evicted first.
+    """
+
+    def __init__(self, max_entries: int = 10_000, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries: OrderedDict[tuple, tuple[float, Rows, int]] = OrderedDict()
+        self._namespaces: dict[str, set[tuple]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: tuple):
+        _, _, size = self._entries.pop(key)
+        self._namespaces[key[0]].discard(key)
+        self.size -= size
+
+    async def get(self, key: tuple) -> Optional[Rows]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, rows, _ = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return rows
+
+    async def set(self, key: tuple, rows: Rows, ttl: float):
+        if key in self._entries:
+            self._remove(key)
+
+        size = rows_size(rows) if self.max_bytes is not None else 0
+        self._entries[key] = (time.monotonic() + ttl, rows, size)
+        self._namespaces.setdefault(key[0], set()).add(key)
+        self.size += size
+
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.size > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def invalidate(self, namespace: str):
+        for key in list(self._namespaces.get(namespace, ())):
+            self._remove(key)
+
+
+class ResultCache:
+    """
+    Caches the rows of selects per relation, query and arguments.
+
+    Only relations with a ttl are cached: ttls maps Relation classes to
+    seconds, ttl applies to all others. Writes through the session
+    invalidate every cached result of the relation written to.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        ttl: Optional[float] = None,
+        ttls: Optional[dict[Type[Relation], float]] = None,
+    ):
+        self.backend = MemoryBackend() if backend is None else backend
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self._generations: dict[str, int] = {}
+
+    def ttl_for(self, cls: Type[Relation]) -> Optional[float]:
+        return self.ttls.get(cls, self.ttl)
+
+    def key(
+        self, cls: Type[Relation], query: str, args: list[ValidSqlArg]
+    ) -> Optional[tuple]:
+        """
+        Returns the cache key of a query, or None if its arguments are not
+        hashable. The key changes with every invalidation of the relation,
+        so results of reads racing a write are never served.
+        """
+        namespace = cls.__table_name__
+        key = (namespace, self._generations.get(namespace, 0), query, freeze(args))
+
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    async def get(self, key: tuple) -> Optional[Rows]:
+        rows = await self.backend.get(key)
+
+        if rows is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return rows
+
+    async def set(self, key: tuple, rows: Rows, ttl: float):
+        await self.backend.set(key, rows, ttl)
+
+    async def invalidate(self, cls: Type[Relation]):
+        namespace = cls.__table_name__
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        await self.backend.invalidate(namespace)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+        }
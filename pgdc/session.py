@@ -1,50 +1,444 @@
-from typing import Optional, Type, TypeVar, Union
+import asyncio
+from contextlib import aclosing, asynccontextmanager
+from functools import partial
+from itertools import chain, groupby
+from operator import itemgetter
+from time import monotonic, perf_counter
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Mapping,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+)
 
 import asyncpg
 
 from .args import ValidSqlArg
-from .clauses import Limit, OrderBy, Where
+from .bulk import Row, RowReader, UpsertResult, chunked
+from .cache import LRUCache
+from .clauses import GroupBy, Limit, OrderBy, Where
+from .columns import ColumnPlan, Columns, CopyDecoder, concatenate
+from .admission import AdmissionController, Priority
 from .dcbuilder import DcBuilder
-from .relation import Relation
-from .render import render
+from .hedging import HedgePolicy
+from .identity import IdentityMap, PKey, pkey_of
+from .instrument import PrintHook, QueryEvent, QueryHook, fingerprint
+from .loader import Loader
+from .pagination import Keyset, Page
+from .relation import DEFERRED, Relation
+from .relationships import Related, relationships
+from .replicas import ReplicaSet
+from .results import ResultCache, freeze, rows_size
+from .statements import Method, StatementCache, normalize_query
+from .writer import OnConflict, Writer
 
-PKeyType = tuple[Union[str, int]]
 R = TypeVar("R", bound=Relation)
 
+AGGREGATES = ("count", "sum", "min", "max", "avg")
+
 
 class Session:
-    __object_registry__: dict[PKeyType, list[Relation]] = {}
+    __object_registry__: Optional[IdentityMap]
     __sql_builder_cache__: dict[Type[Relation], DcBuilder] = {}
 
     def __init__(
         self,
         conn: Union[asyncpg.Pool, asyncpg.Connection, asyncpg.pool.PoolConnectionProxy],
         debug: bool = False,
+        statement_cache_size: int = 100,
+        identity_map_size: int = 0,
+        result_cache: Optional[ResultCache] = None,
+        load_window: float = 0,
+        replicas: Optional[ReplicaSet] = None,
+        read_your_writes: float = 0,
+        hedging: Optional[HedgePolicy] = None,
+        admission: Optional[AdmissionController] = None,
+        single_flight: bool = False,
+        key_cache_size: int = 10_000,
     ):
+        """
+        statement_cache_size bounds the number of prepared statements kept
+        per pooled connection. Set it to 0 to send plain query text instead.
+
+        identity_map_size, if set, bounds the number of instances this
+        session keeps by primary key. get_one by primary key is then answered
+        from there, without seeing changes made by other clients. With the
+        default of 0 the database is always queried.
+
+        result_cache, if given, serves repeated get and get_one calls for the
+        relations it has a ttl for. Writes through this session invalidate
+        the cached results of the relation written to.
+
+        Query events are reported to the hooks added with add_hook. debug
+        adds a hook printing every query.
+
+        load_window is how long, in seconds, load() collects primary keys
+        before querying them. With 0 it collects the keys requested within
+        one event loop iteration.
+
+        replicas, if given, serve get, get_one, stream and the other reads
+        unless they are called with primary=True. Writes and transactions
+        use conn. For read_your_writes seconds after a write, the reads of
+        this session go to conn as well.
+
+        hedging, if given, sends a read again on another connection when the
+        first attempt is slow to answer, as told by the policy. The first
+        answer is used and the other attempt cancelled. Reads are only
+        hedged when conn is a pool or replicas are used.
+
+        admission, if given, bounds the queries and transactions this
+        session has in flight. Those over its limit wait in its queue, and
+        fail with Overloaded when they cannot start in time.
+
+        With single_flight, a read identical to one in flight, bound
+        arguments included, awaits the records of that one instead of being
+        sent. Each caller hydrates instances of its own, unless the identity
+        map hands out the same ones. Nothing is kept once the read is done.
+
+        key_cache_size bounds the number of mappings resolve_keys keeps per
+        relation and column.
+        """
         self.conn = conn
         self.debug = debug
+        self.hooks: list[QueryHook] = [PrintHook()] if debug else []
+        self._shapes: LRUCache[str, bool] = LRUCache(1024)
+        self.statements = (
+            StatementCache(statement_cache_size) if statement_cache_size else None
+        )
+        self.__object_registry__ = (
+            IdentityMap(identity_map_size) if identity_map_size else None
+        )
+        self.result_cache = result_cache
+        self.load_window = load_window
+        self._loaders: dict[Type[Relation], Loader] = {}
+        self.replicas = replicas
+        self.read_your_writes = read_your_writes
+        self._last_write = float("-inf")
+        self.hedging = hedging
+        self.admission = admission
+        self.single_flight = single_flight
+        self.deduplicated = 0
+        self._flights: dict[tuple, asyncio.Future] = {}
+        self.key_cache_size = key_cache_size
+        self._keys: dict[tuple[Type[Relation], str], LRUCache] = {}
 
-    async def _execute(self, query: str, args: list[ValidSqlArg]) -> str:
-        if self.debug:
-            print(query, args)
+    def add_hook(self, hook: QueryHook):
+        """Registers a hook receiving the query events of this session."""
+        self.hooks.append(hook)
 
-        return await self.conn.execute(query, *args)
+    def remove_hook(self, hook: QueryHook):
+        self.hooks.remove(hook)
 
-    async def _fetchrow(
+    @asynccontextmanager
+    async def _acquire(
+        self, replica: bool = False, priority: Priority = "write", measure: bool = False
+    ) -> AsyncIterator[Any]:
+        """Yields a connection, checked out from the pool if there is one.
+
+        With replica, the connection is taken from a read replica if one is
+        available and this session has not written too recently. With an
+        admission controller, a slot of the given priority is held as well,
+        its latency measured if measure is set.
+        """
+        if self.admission is None:
+            async with self._checkout(replica) as conn:
+                yield conn
+            return
+
+        async with self.admission.admit(priority, measure):
+            async with self._checkout(replica) as conn:
+                yield conn
+
+    @asynccontextmanager
+    async def _checkout(self, replica: bool) -> AsyncIterator[Any]:
+        if (
+            replica
+            and self.replicas is not None
+            and monotonic() - self._last_write >= self.read_your_writes
+        ):
+            async with self.replicas.acquire() as conn:
+                if conn is not None:
+                    yield conn
+                    return
+
+        if hasattr(self.conn, "acquire"):
+            async with self.conn.acquire() as conn:
+                yield conn
+        else:
+            yield self.conn
+
+    async def _send(self, conn: Any, method: Method, query: str, args: Any) -> Any:
+        if self.statements is not None:
+            return await self.statements.run(conn, method, query, args)
+
+        if method == "executemany":
+            return await conn.executemany(query, args)
+
+        return await getattr(conn, method)(query, *args)
+
+    def _event(
+        self, query: str, args: Any, cls: Optional[Type[R]], pool_wait: float = 0.0
+    ) -> QueryEvent:
+        return QueryEvent(
+            fingerprint(query),
+            query,
+            args,
+            None if cls is None else cls.__table_name__,
+            normalize_query(query).split(maxsplit=1)[0].lower(),
+            pool_wait,
+        )
+
+    def _begin(
+        self, query: str, args: Any, cls: Optional[Type[R]], pool_wait: float
+    ) -> QueryEvent:
+        """Creates the event of a query about to be sent and reports it."""
+        event = self._event(query, args, cls, pool_wait)
+
+        if event.fingerprint not in self._shapes:
+            self._shapes.put(event.fingerprint, True)
+            for hook in self.hooks:
+                hook.query_compiled(event)
+
+        for hook in self.hooks:
+            hook.query_sent(event)
+
+        event.started = perf_counter()
+        return event
+
+    def _received(self, event: QueryEvent, records: Any):
+        """Reports the first rows of a query."""
+        if event.first_row is None and records:
+            event.first_row = perf_counter() - event.started
+            for hook in self.hooks:
+                hook.query_first_row(event)
+
+        if isinstance(records, list):
+            event.rows += len(records)
+            event.size += rows_size(records)
+        elif records is not None and not isinstance(records, str):
+            event.rows += 1
+            event.size += rows_size([records])
+
+    def _finish(self, event: QueryEvent, error: Optional[BaseException] = None):
+        event.duration = perf_counter() - event.started
+        event.error = error
+
+        for hook in self.hooks:
+            hook.query_finished(event)
+
+    async def _run(
         self,
+        conn: Any,
+        method: Method,
+        query: str,
+        args: Any,
+        cls: Optional[Type[R]] = None,
+        pool_wait: float = 0.0,
+    ) -> Any:
+        """Runs a query on a connection that is already checked out."""
+        if not self.hooks:
+            return await self._send(conn, method, query, args)
+
+        event = self._begin(query, args, cls, pool_wait)
+        try:
+            result = await self._send(conn, method, query, args)
+        except BaseException as exc:
+            self._finish(event, exc)
+            raise
+
+        self._received(event, result)
+        self._finish(event)
+        return result
+
+    async def _cursor(self, conn: Any, query: str, args: list[ValidSqlArg]) -> Any:
+        """Opens a server-side cursor, conn must be in a transaction."""
+        if self.statements is None:
+            return await conn.cursor(query, *args)
+
+        stmt = await self.statements.prepare(conn, query)
+        return await stmt.cursor(*args)
+
+    async def _query(
+        self,
+        method: Method,
         query: str,
         args: list[ValidSqlArg],
-    ) -> Optional[asyncpg.Record]:
-        if self.debug:
-            print(query, args)
+        cls: Optional[Type[R]] = None,
+        replica: bool = False,
+        priority: Priority = "write",
+    ) -> Any:
+        if not self.hooks:
+            async with self._acquire(replica, priority, True) as conn:
+                return await self._send(conn, method, query, args)
+
+        requested = perf_counter()
+        async with self._acquire(replica, priority, True) as conn:
+            return await self._run(
+                conn, method, query, args, cls, perf_counter() - requested
+            )
+
+    async def _hedged_query(
+        self,
+        method: Method,
+        query: str,
+        args: list[ValidSqlArg],
+        cls: Optional[Type[R]] = None,
+        replica: bool = False,
+        priority: Priority = "read",
+    ) -> Any:
+        """Runs a read, sending it a second time if the first is slow."""
+        policy = self.hedging
+        shape = fingerprint(query)
+        policy.admit()
+
+        async def attempt() -> Any:
+            started = perf_counter()
+            result = await self._query(method, query, args, cls, replica, priority)
+            policy.record(shape, perf_counter() - started)
+            return result
+
+        started = perf_counter()
+        first = asyncio.ensure_future(attempt())
+        try:
+            await asyncio.wait([first], timeout=policy.delay_for(shape))
+        except BaseException:
+            first.cancel()
+            raise
+
+        if first.done() or not policy.spend():
+            return await first
+
+        # The connection running the loser is released once asyncpg has
+        # cancelled its query on the server.
+        hedge = asyncio.ensure_future(attempt())
+        pending = {first, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=lambda task: task is hedge):
+                    if task.exception() is None:
+                        if task is hedge:
+                            # The first attempt took at least this long, and
+                            # only recording winners would drag the delay down.
+                            policy.record(shape, perf_counter() - started)
+                            policy.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise error
+
+    async def _single_flight(
+        self,
+        run: Callable[..., Awaitable[Any]],
+        method: Method,
+        query: str,
+        args: list[ValidSqlArg],
+        *options: Any,
+    ) -> Any:
+        """Runs a read, or awaits the result of an identical one in flight.
+
+        A read following a write of this session never joins a read sent
+        before it.
+        """
+        key = (self._last_write, method, query, freeze(args), options)
+        try:
+            flight = self._flights.get(key)
+        except TypeError:
+            return await run(method, query, args, *options)
+
+        if flight is None:
+            flight = self._flights[key] = asyncio.ensure_future(
+                run(method, query, args, *options)
+            )
+            flight.add_done_callback(partial(self._landed, key))
+        else:
+            self.deduplicated += 1
+            if self.hooks:
+                event = self._event(query, args, options[0])
+                for hook in self.hooks:
+                    hook.query_deduplicated(event)
+
+        # A caller giving up does not cancel the read for the others.
+        return await asyncio.shield(flight)
+
+    def _landed(self, key: tuple, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            flight.exception()
+
+    async def _read(
+        self,
+        cls: Type[R],
+        method: Method,
+        query: str,
+        args: list[ValidSqlArg],
+        replica: bool = True,
+    ) -> Any:
+        """Runs a select, through the result cache if cls is cached."""
+        cache = self.result_cache
+        ttl = None if cache is None else cache.ttl_for(cls)
+        key = None if ttl is None else cache.key(cls, query, args)
+
+        run = self._query
+        if self.hedging is not None and (
+            hasattr(self.conn, "acquire") or (replica and self.replicas is not None)
+        ):
+            run = self._hedged_query
+        if self.single_flight:
+            run = partial(self._single_flight, run)
+
+        if key is None:
+            return await run(method, query, args, cls, replica, "read")
 
-        return await self.conn.fetchrow(query, *args)
+        rows = await cache.get(key)
+        if rows is None:
+            result = await run(method, query, args, cls, replica, "read")
+            rows = (
+                [tuple(row) for row in result]
+                if method == "fetch"
+                else ([] if result is None else [tuple(result)])
+            )
+            await cache.set(key, rows, ttl)
 
-    async def _fetch(self, query: str, args: list[ValidSqlArg]) -> list[asyncpg.Record]:
-        if self.debug:
-            print(query, args)
+        return rows if method == "fetch" else next(iter(rows), None)
 
-        return await self.conn.fetch(query, *args)
+    async def _written(self, cls: Type[R]):
+        """Drops the cached results a write to cls makes stale."""
+        self._last_write = monotonic()
+        if self.result_cache is not None:
+            await self.result_cache.invalidate(cls)
+
+    async def _execute(
+        self, query: str, args: list[ValidSqlArg], cls: Optional[Type[R]] = None
+    ) -> str:
+        return await self._query("execute", query, args, cls)
+
+    async def _fetchrow(
+        self,
+        query: str,
+        args: list[ValidSqlArg],
+        cls: Optional[Type[R]] = None,
+    ) -> Optional[asyncpg.Record]:
+        return await self._query("fetchrow", query, args, cls)
+
+    async def _fetch(
+        self, query: str, args: list[ValidSqlArg], cls: Optional[Type[R]] = None
+    ) -> list[asyncpg.Record]:
+        return await self._query("fetch", query, args, cls)
 
     def sql_builder(self, cls: Type[R]):
         """Retrieves or instantiaties a DcBuilder instance."""
@@ -52,12 +446,109 @@ class Session:
             cls
         ) or self.__sql_builder_cache__.setdefault(cls, DcBuilder(cls))
 
-    def hydrate(self, cls: Type[R], mapping: Optional[asyncpg.Record]):
-        """Instantiates a R instance from a mapping"""
-        return None if mapping is None else cls(**mapping)
+    def hydrate(
+        self,
+        cls: Type[R],
+        mapping: Union[asyncpg.Record, Mapping[str, Any], None],
+        columns: Optional[Sequence[str]] = None,
+    ):
+        """Instantiates a R instance from a record of columns, all by default
+
+        Records are read by column name, whatever the order of the select
+        list. A plain mapping, such as a dict, is passed to cls as keyword
+        arguments. A plain sequence holds the values of columns in order.
+        """
+        if mapping is None:
+            return None
+        if isinstance(mapping, Mapping):
+            return cls(**mapping)
+
+        return self._named_hydrators(cls, mapping, columns)[0](mapping)
+
+    def hydrate_many(
+        self,
+        cls: Type[R],
+        records: list[asyncpg.Record],
+        columns: Optional[Sequence[str]] = None,
+    ) -> list[R]:
+        """Instantiates R instances from a list of records of columns
+
+        Records are read by column name, as with hydrate.
+        """
+        if not records:
+            return []
+
+        return self._named_hydrators(cls, records[0], columns)[1](records)
+
+    def _named_hydrators(
+        self, cls: Type[R], record: Any, columns: Optional[Sequence[str]]
+    ) -> tuple[Callable, Callable]:
+        """The hydrators of the columns of record, in its order."""
+        builder = self.sql_builder(cls)
+        if not hasattr(record, "keys"):
+            return builder.hydrators(columns or builder.attrs)
+
+        names = tuple(record.keys())
+        if unknown := set(names) - set(builder.attrs):
+            raise ValueError(f"Unknown {cls.__name__} fields {sorted(unknown)}")
+        return builder.hydrators(names)
+
+    def _hydrate(
+        self,
+        cls: Type[R],
+        record: Optional[asyncpg.Record],
+        columns: Optional[Sequence[str]] = None,
+    ) -> Optional[R]:
+        """Reads by position a record of a statement DcBuilder rendered."""
+        if record is None:
+            return None
+
+        builder = self.sql_builder(cls)
+        return builder.hydrators(columns or builder.attrs)[0](record)
+
+    def _hydrate_many(
+        self,
+        cls: Type[R],
+        records: list[asyncpg.Record],
+        columns: Optional[Sequence[str]] = None,
+    ) -> list[R]:
+        builder = self.sql_builder(cls)
+        return builder.hydrators(columns or builder.attrs)[1](records)
+
+    def get_pkey(self, obj: R) -> PKey:
+        return pkey_of(obj)
+
+    def _register(self, objs: Iterable[Optional[R]]):
+        """Refreshes the identity map with instances read from the database."""
+        if self.__object_registry__ is not None:
+            self.__object_registry__.add_many(obj for obj in objs if obj is not None)
 
-    def get_pkey(self, obj: R):
-        return (getattr(obj, pkey_attr) for pkey_attr in obj.__table_pkeys__)
+    @asynccontextmanager
+    async def transaction(self, **options: Any) -> AsyncIterator["Transaction"]:
+        """Pins one connection for a transaction block.
+
+        Yields a Transaction running every call on that connection. Writes
+        queued on it are flushed before commit. options are passed on to
+        asyncpg's Connection.transaction.
+        """
+        async with self._acquire() as conn, conn.transaction(**options):
+            tx = Transaction(self, conn)
+            yield tx
+            await tx.flush()
+
+        registry = self.__object_registry__
+        for cls in tx.written:
+            await self._written(cls)
+            if registry is not None:
+                registry.discard_class(cls)
+
+        # Keys resolved or deleted by the transaction count once committed.
+        for cls in tx.dropped:
+            self._drop_keys(cls)
+        for (cls, column), resolved in tx._keys.items():
+            known = self._known_keys(cls, column)
+            for value, pkey in resolved.items():
+                known.put(value, pkey)
 
     async def create(self, cls: Type[R], **kwargs: ValidSqlArg) -> Optional[R]:
         """Creates a new Relation instance based on kwargs input.
@@ -65,10 +556,112 @@ class Session:
         If named argument update_on_collision is set to True,
         values will be updated on collision.
         """
-        template_query, template_args = self.sql_builder(cls).insert(**kwargs)
-        query, query_args = render(template_query, template_args)
+        query, query_args = self.sql_builder(cls).render_insert(**kwargs)
+        obj = self._hydrate(cls, await self._fetchrow(query, query_args, cls))
+
+        await self._written(cls)
+        self._register([obj])
+        return obj
+
+    async def create_many(
+        self,
+        cls: Type[R],
+        rows: Iterable[Row],
+        columns: Optional[Sequence[str]] = None,
+        returning: bool = False,
+        chunk_size: int = 10_000,
+    ) -> Union[int, list[R]]:
+        """Creates Relation instances from dataclass instances or dicts.
+
+        Rows are sent through binary COPY, or as one multi-row INSERT per chunk
+        when returning is set or a column holds a Verbatim. All chunks are
+        written in a single transaction.
+
+        Returns the number of rows created, or the created instances if
+        returning is set.
+        """
+        builder = self.sql_builder(cls)
+        rows = iter(rows)
+        first = next(rows, None)
+
+        if first is None:
+            return [] if returning else 0
+
+        reader = RowReader(builder.attrs, first, columns)
+        created: list[R] = []
+        count = 0
+
+        async with self._acquire() as conn, conn.transaction():
+            for chunk in chunked(chain([first], rows), chunk_size):
+                count += len(chunk)
+
+                if returning or reader.verbatims:
+                    query, query_args = builder.render_insert_many(
+                        returning, **reader.transpose(chunk)
+                    )
+                    records = await self._run(conn, "fetch", query, query_args, cls)
+                    created.extend(self._hydrate_many(cls, records))
+                    self._register(created[-len(records) :])
+                else:
+                    await conn.copy_records_to_table(
+                        builder.table_name,
+                        records=map(reader, chunk),
+                        columns=reader.params,
+                    )
+
+        await self._written(cls)
+        return created if returning else count
+
+    async def upsert_many(
+        self,
+        cls: Type[R],
+        rows: Iterable[Row],
+        conflict: Optional[Sequence[str]] = None,
+        update: Optional[Sequence[str]] = None,
+        columns: Optional[Sequence[str]] = None,
+        skip_unchanged: bool = True,
+    ) -> UpsertResult:
+        """Inserts rows, updating the existing ones on conflict.
+
+        The rows are copied into a temporary staging table and merged with a
+        single INSERT ... ON CONFLICT. conflict defaults to the primary keys
+        and update to every other column. With skip_unchanged, rows whose
+        updated values equal the stored ones are left untouched. The rows
+        must not repeat a conflict key.
+        """
+        builder = self.sql_builder(cls)
+        rows = iter(rows)
+        first = next(rows, None)
+
+        if first is None:
+            return UpsertResult(0, 0, 0)
+
+        reader = RowReader(builder.attrs, first, columns)
+        conflict = list(conflict or builder.pkeys)
+        if update is None:
+            update = [key for key in reader.columns if key not in conflict]
+
+        query, query_args = builder.render_merge_staging(
+            reader.params, conflict, update, skip_unchanged, **reader.verbatims
+        )
+
+        async with self._acquire() as conn, conn.transaction():
+            await conn.execute(builder.create_staging(*reader.params))
+            status = await conn.copy_records_to_table(
+                builder.staging_name,
+                records=map(reader, chain([first], rows)),
+                columns=reader.params,
+            )
+            counts = await self._run(conn, "fetchrow", query, query_args, cls)
+            await conn.execute(f"DROP TABLE {builder.staging_name};")  # nosec
 
-        return self.hydrate(cls, await self._fetchrow(query, query_args))
+        await self._written(cls)
+        if self.__object_registry__ is not None:
+            self.__object_registry__.discard_class(cls)
+
+        total = int(status.split()[-1])
+        inserted, updated = counts["inserted"], counts["updated"]
+        return UpsertResult(inserted, updated, total - inserted - updated)
 
     async def update(
         self,
@@ -80,31 +673,77 @@ class Session:
 
         Returns the updated Relation instances.
         """
-        template_query, template_args = self.sql_builder(cls).update(where, **kwargs)
-        query, query_args = render(template_query, template_args)
+        builder = self.sql_builder(cls)
+        query, query_args = builder.render_update(where, **kwargs)
+        objs = self._hydrate_many(cls, await self._fetch(query, query_args, cls))
 
-        return [self.hydrate(cls, row) for row in await self._fetch(query, query_args)]
+        await self._written(cls)
+        registry = self.__object_registry__
+        if registry is not None and not kwargs.keys().isdisjoint(builder.pkeys):
+            # The instances known under the previous keys are not returned.
+            registry.discard_class(cls)
+        self._register(objs)
+        return objs
 
     async def delete(self, cls: Type[R], where: Optional[Where] = None) -> str:
-        template_query, template_args = self.sql_builder(cls).delete(where)
-        query, query_args = render(template_query, template_args)
-        return await self._execute(query, query_args)
+        """Deletes Relation instances, returning the command status."""
+        registry = self.__object_registry__
+
+        if registry is None or not cls.__table_pkeys__:
+            query, query_args = self.sql_builder(cls).render_delete(where)
+            status = await self._execute(query, query_args, cls)
+        else:
+            query, query_args = self.sql_builder(cls).render_delete(where, True)
+            rows = await self._fetch(query, query_args, cls)
+            status = f"DELETE {len(rows)}"
+
+            for row in rows:
+                registry.discard(cls, tuple(row))
+
+        self._drop_keys(cls)
+        await self._written(cls)
+        return status
 
     async def get_one(
         self,
         cls: Type[R],
         where: Optional[Where] = None,
         limit: Optional[int] = None,
+        only: Optional[Sequence[str]] = None,
+        defer: Optional[Sequence[str]] = None,
+        prefetch: Sequence[str] = (),
+        primary: bool = False,
     ) -> Optional[R]:
         """Retrieves a single Relation instance.
 
-        Returns None if no match if found.
+        Returns None if no match if found. Lookups by primary key are
+        answered from the identity map when the instance is known. only,
+        defer, prefetch and primary work as for get.
         """
+        builder = self.sql_builder(cls)
+        columns = builder.columns(only, defer)
+        registry = (
+            self.__object_registry__ if columns == builder.default_columns else None
+        )
+
+        if registry is not None:
+            pkey = registry.lookup_key(cls, where)
+            if pkey is not None and (obj := registry.get(cls, pkey)) is not None:
+                if prefetch:
+                    await self.prefetch([obj], *prefetch, primary=primary)
+                return obj
 
-        template_query, template_args = self.sql_builder(cls).select(where, limit)
-        query, query_args = render(template_query, template_args)
+        query, query_args = builder.render_select(
+            where, limit=Limit(limit), columns=columns
+        )
+        row = await self._read(cls, "fetchrow", query, query_args, not primary)
+        obj = self._hydrate(cls, row, columns)
 
-        return self.hydrate(cls, await self._fetchrow(query, query_args))
+        if registry is not None:
+            self._register([obj])
+        if prefetch and obj is not None:
+            await self.prefetch([obj], *prefetch, primary=primary)
+        return obj
 
     async def get(
         self,
@@ -112,12 +751,607 @@ class Session:
         where: Optional[Where] = None,
         order_by: Optional[OrderBy] = None,
         limit: Optional[Limit] = None,
+        only: Optional[Sequence[str]] = None,
+        defer: Optional[Sequence[str]] = None,
+        prefetch: Sequence[str] = (),
+        primary: bool = False,
     ) -> list[R]:
-        """Retrieves single Relation instances."""
+        """Retrieves single Relation instances.
+
+        Fields with metadata={"deferred": True} are not loaded by default.
+        only loads the given fields and the primary keys, defer leaves the
+        given fields out. Fields not loaded are set to DEFERRED until
+        undefer loads them. prefetch names relationship fields to load, see
+        Session.prefetch. primary reads from conn even if there are
+        replicas.
+        """
+        builder = self.sql_builder(cls)
+        columns = builder.columns(only, defer)
+
+        query, query_args = builder.render_select(
+            where, order_by, limit, columns=columns
+        )
+        rows = await self._read(cls, "fetch", query, query_args, not primary)
+        objs = self._hydrate_many(cls, rows, columns)
+
+        if columns == builder.default_columns:
+            self._register(objs)
+        if prefetch:
+            await self.prefetch(objs, *prefetch, primary=primary)
+        return objs
+
+    async def count(
+        self, cls: Type[R], where: Optional[Where] = None, primary: bool = False
+    ) -> int:
+        """Counts the matching Relation rows in the database."""
+        query, query_args = self.sql_builder(cls).render_count(where)
+        row = await self._read(cls, "fetchrow", query, query_args, not primary)
+        return row[0]
+
+    async def exists(
+        self, cls: Type[R], where: Optional[Where] = None, primary: bool = False
+    ) -> bool:
+        """Tells whether a Relation row matches, stopping at the first one."""
+        query, query_args = self.sql_builder(cls).render_exists(where)
+        row = await self._read(cls, "fetchrow", query, query_args, not primary)
+        return bool(row[0])
+
+    async def aggregate(
+        self,
+        cls: Type[R],
+        where: Optional[Where] = None,
+        group_by: Union[str, Sequence[str], GroupBy] = (),
+        order_by: Optional[OrderBy] = None,
+        primary: bool = False,
+        **aggregates: Union[str, Sequence[str]],
+    ) -> Union[dict[str, Any], list[dict[str, Any]]]:
+        """Computes aggregates of the matching Relation rows in the database.
+
+        aggregates map count, sum, min, max or avg to a column or a list of
+        columns, as in sum="value" or min=["value", "date_created"]. count
+        also takes "*". The results are named function_column, as
+        sum_value, or count for count("*").
+
+        Returns a dict of the results or, with group_by, one dict per group
+        holding the group_by columns as well. Without aggregates, group_by
+        lists the distinct groups.
+        """
+        builder = self.sql_builder(cls)
+        grouped = bool(group_by)
+        if isinstance(group_by, GroupBy):
+            group = [str(term) for term in group_by.terms()]
+        else:
+            group = [group_by] if isinstance(group_by, str) else list(group_by)
+            if unknown := set(group) - set(builder.attrs):
+                raise ValueError(f"Unknown {cls.__name__} fields {sorted(unknown)}")
+
+        pairs: list[tuple[str, str]] = []
+        for function, columns in aggregates.items():
+            if function not in AGGREGATES:
+                raise TypeError(f"Unknown aggregate function {function}")
+            for column in [columns] if isinstance(columns, str) else columns:
+                if column not in builder.attrs and (column, function) != ("*", "count"):
+                    raise ValueError(f"Unknown {cls.__name__} field {column}")
+                pairs.append((function, column))
+
+        if not pairs and not group:
+            raise TypeError("aggregate needs an aggregate or group_by columns")
+
+        query, query_args = builder.render_aggregate(pairs, where, group, order_by)
+        rows = await self._read(cls, "fetch", query, query_args, not primary)
+
+        names = group + [
+            function if column == "*" else f"{function}_{column}"
+            for function, column in pairs
+        ]
+        results = [dict(zip(names, row)) for row in rows]
+        return results if grouped else results[0]
+
+    async def prefetch(
+        self, objs: Sequence[R], *names: str, primary: bool = False
+    ) -> Sequence[R]:
+        """Loads relationship fields of Relation instances in place.
+
+        Each relationship is loaded with one query for all of objs, matching
+        the distinct keys found on them. Many-to-one fields get the related
+        instance or None, one-to-many fields a list.
+        """
+        if not objs:
+            return objs
+
+        cls = type(objs[0])
+        related = relationships(cls)
+
+        for name in names:
+            relation = related.get(name)
+            if relation is None:
+                raise ValueError(f"{cls.__name__} has no relationship {name}")
+
+            values = await self._related(relation, objs, primary)
+            for obj, value in zip(objs, values):
+                object.__setattr__(obj, name, value)
+        return objs
+
+    async def _related(
+        self, relation: Related, objs: Sequence[R], primary: bool
+    ) -> list[Any]:
+        """Returns the instances related to each of objs."""
+        builder = self.sql_builder(relation.target)
+
+        if relation.local:
+            refs = [tuple(getattr(obj, c) for c in relation.local) for obj in objs]
+            keys = [key for key in dict.fromkeys(refs) if None not in key]
+            found = (
+                {
+                    pkey_of(target): target
+                    for target in await self.get(
+                        relation.target, builder.where_pkeys(keys), primary=primary
+                    )
+                }
+                if keys
+                else {}
+            )
+            return [found.get(ref) for ref in refs]
+
+        keys = list(dict.fromkeys(map(pkey_of, objs)))
+        groups: dict[PKey, list[Any]] = {}
+        for target in await self.get(
+            relation.target, builder.where_in(relation.remote, keys), primary=primary
+        ):
+            ref = tuple(getattr(target, c) for c in relation.remote)
+            groups.setdefault(ref, []).append(target)
+
+        if relation.many:
+            return [groups.get(pkey, []) for pkey in map(pkey_of, objs)]
+        return [groups.get(pkey, [None])[0] for pkey in map(pkey_of, objs)]
+
+    async def undefer(self, objs: Sequence[R], *fields: str) -> Sequence[R]:
+        """Loads deferred fields of Relation instances in place.
+
+        fields defaults to every field still DEFERRED on any of objs. All of
+        objs, typically one result set, are loaded with a single query.
+        Instances whose rows no longer exist are left as they are.
+        """
+        if not objs:
+            return objs
+
+        cls = type(objs[0])
+        builder = self.sql_builder(cls)
+        fields = fields or tuple(
+            name
+            for name in builder.attrs
+            if any(getattr(obj, name) is DEFERRED for obj in objs)
+        )
+        if not fields:
+            return objs
+
+        pkeys = list(dict.fromkeys(map(pkey_of, objs)))
+        loaded = {
+            pkey_of(obj): obj
+            for obj in await self.get(cls, builder.where_pkeys(pkeys), only=fields)
+        }
+
+        for obj in objs:
+            source = loaded.get(pkey_of(obj))
+            if source is not None:
+                for name in fields:
+                    object.__setattr__(obj, name, getattr(source, name))
+        return objs
+
+    async def paginate(
+        self,
+        cls: Type[R],
+        where: Optional[Where] = None,
+        order_by: Optional[Sequence[str]] = None,
+        page_size: int = 100,
+        after: Optional[str] = None,
+        primary: bool = False,
+    ) -> Page[R]:
+        """Retrieves a page of Relation instances by keyset pagination.
+
+        order_by lists columns, each optionally followed by ASC or DESC, and
+        defaults to the primary keys. Pass the next token of a page as after
+        to retrieve the following page; every page costs the same, however
+        deep it is.
+        """
+        keyset = Keyset(order_by or cls.__table_pkeys__, cls.__table_pkeys__)
+        where = where or Where()
+
+        if after is not None:
+            where = where.extend(keyset.after(after))
+
+        objs = await self.get(
+            cls, where, keyset.order_by(), Limit(page_size + 1), primary=primary
+        )
+        if len(objs) <= page_size:
+            return Page(objs, None)
+
+        del objs[page_size:]
+        return Page(objs, keyset.encode(objs[-1]))
+
+    async def _record_batches(
+        self,
+        cls: Type[R],
+        query: str,
+        query_args: list[ValidSqlArg],
+        batch_size: int,
+        read_ahead: bool = True,
+        replica: bool = False,
+    ) -> AsyncIterator[list[asyncpg.Record]]:
+        """Iterates over batches of records through a server-side cursor.
+
+        A connection is held in a read-only transaction while iterating.
+        With read_ahead, the next batch is fetched while the current one is
+        consumed, otherwise the connection is free for other queries then.
+        """
+        requested = perf_counter()
+
+        async with self._acquire(replica, "read") as conn, conn.transaction(
+            readonly=True
+        ):
+            event = (
+                self._begin(query, query_args, cls, perf_counter() - requested)
+                if self.hooks
+                else None
+            )
+            error: Optional[BaseException] = None
+            pending: Optional[asyncio.Future] = None
+
+            try:
+                cursor = await self._cursor(conn, query, query_args)
+                pending = asyncio.ensure_future(cursor.fetch(batch_size))
+
+                while pending is not None and (records := await pending):
+                    if event is not None:
+                        self._received(event, records)
+
+                    more = len(records) == batch_size
+                    pending = (
+                        asyncio.ensure_future(cursor.fetch(batch_size))
+                        if more and read_ahead
+                        else None
+                    )
+                    yield records
+
+                    if more and not read_ahead:
+                        pending = asyncio.ensure_future(cursor.fetch(batch_size))
+            except BaseException as exc:
+                error = exc
+                raise
+            finally:
+                if pending is not None and not pending.done():
+                    pending.cancel()
+                    await asyncio.gather(pending, return_exceptions=True)
+                if event is not None:
+                    self._finish(event, error)
+
+    async def stream(
+        self,
+        cls: Type[R],
+        where: Optional[Where] = None,
+        order_by: Optional[OrderBy] = None,
+        batch_size: int = 1000,
+        batches: bool = False,
+        prefetch: Sequence[str] = (),
+        primary: bool = False,
+    ) -> AsyncIterator[Union[R, list[R]]]:
+        """Iterates over Relation instances through a server-side cursor.
+
+        A connection is held in a read-only transaction while iterating, and
+        the next batch is fetched while the current one is consumed. Yields
+        lists of up to batch_size instances if batches is set. prefetch
+        loads relationship fields once per batch, before yielding it.
+        """
+        builder = self.sql_builder(cls)
+        columns = builder.default_columns
+        hydrate, hydrate_many = builder.hydrators(columns)
+
+        query, query_args = builder.render_select(where, order_by, columns=columns)
+        # A lone connection cannot read ahead while prefetch queries run.
+        read_ahead = not prefetch or hasattr(self.conn, "acquire")
+        record_batches = self._record_batches(
+            cls, query, query_args, batch_size, read_ahead, not primary
+        )
+
+        async with aclosing(record_batches):
+            async for records in record_batches:
+                objs = hydrate_many(records)
+                if prefetch:
+                    await self.prefetch(objs, *prefetch, primary=primary)
+
+                if batches:
+                    yield objs
+                else:
+                    for obj in objs:
+                        yield obj
+
+    async def _copy_batches(
+        self,
+        conn: Any,
+        plan: ColumnPlan,
+        query: str,
+        query_args: list[ValidSqlArg],
+        batch_size: Optional[int],
+    ) -> AsyncIterator[Columns]:
+        """Iterates over batches of columns decoded from binary COPY output.
+
+        The COPY waits for each batch to be consumed before decoding more.
+        """
+        decoder = CopyDecoder(plan, batch_size)
+        queue: asyncio.Queue[Optional[Columns]] = asyncio.Queue(maxsize=1)
+
+        async def output(data: bytes):
+            for batch in decoder.feed(data):
+                await queue.put(batch)
+
+        async def copy():
+            try:
+                await conn.copy_from_query(
+                    query, *query_args, output=output, format="binary"
+                )
+                if (batch := decoder.finish()) is not None:
+                    await queue.put(batch)
+            finally:
+                await queue.put(None)
+
+        task = asyncio.ensure_future(copy())
+        try:
+            while (batch := await queue.get()) is not None:
+                yield batch
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    async def get_columns(
+        self,
+        cls: Type[R],
+        where: Optional[Where] = None,
+        columns: Optional[Sequence[str]] = None,
+        order_by: Optional[OrderBy] = None,
+        limit: Optional[Limit] = None,
+        primary: bool = False,
+    ) -> Columns:
+        """Retrieves columns of Relation rows as numpy arrays.
+
+        Returns a dict of column name to array, typed from the dataclass
+        annotations, with Optional columns as masked arrays. columns
+        defaults to the fields that are not deferred. When all columns have
+        a fixed size type, the rows are read from binary COPY output without
+        creating a Python object per value. Needs numpy.
+        """
+        builder = self.sql_builder(cls)
+        plan = ColumnPlan(cls, columns or builder.default_columns)
+
+        async with self._acquire(not primary, "read") as conn:
+            if plan.copyable and hasattr(conn, "copy_from_query"):
+                query, query_args = builder.render_select_columns(
+                    plan.expressions(copy=True), where, order_by, limit
+                )
+                copy_batches = self._copy_batches(conn, plan, query, query_args, None)
+                async with aclosing(copy_batches):
+                    return concatenate(plan, [batch async for batch in copy_batches])
+
+            query, query_args = builder.render_select_columns(
+                plan.expressions(copy=False), where, order_by, limit
+            )
+            records = await self._run(conn, "fetch", query, query_args, cls)
+            return plan.from_records(records)
+
+    async def stream_columns(
+        self,
+        cls: Type[R],
+        where: Optional[Where] = None,
+        columns: Optional[Sequence[str]] = None,
+        order_by: Optional[OrderBy] = None,
+        batch_size: int = 100_000,
+        primary: bool = False,
+    ) -> AsyncIterator[Columns]:
+        """Iterates over batches of up to batch_size rows as columns.
+
+        Like get_columns, for results larger than memory. Rows are read
+        from binary COPY output, or through a server-side cursor when a
+        column has no fixed size type.
+        """
+        builder = self.sql_builder(cls)
+        plan = ColumnPlan(cls, columns or builder.default_columns)
+
+        if plan.copyable:
+            query, query_args = builder.render_select_columns(
+                plan.expressions(copy=True), where, order_by
+            )
+            async with self._acquire(not primary, "read") as conn:
+                if hasattr(conn, "copy_from_query"):
+                    copy_batches = self._copy_batches(
+                        conn, plan, query, query_args, batch_size
+                    )
+                    async with aclosing(copy_batches):
+                        async for batch in copy_batches:
+                            yield batch
+                    return
+
+        query, query_args = builder.render_select_columns(
+            plan.expressions(copy=False), where, order_by
+        )
+        record_batches = self._record_batches(
+            cls, query, query_args, batch_size, replica=not primary
+        )
+
+        async with aclosing(record_batches):
+            async for records in record_batches:
+                yield plan.from_records(records)
+
+    async def load(self, cls: Type[R], pkey: Union[PKey, Any]) -> Optional[R]:
+        """Retrieves a Relation instance by primary key.
+
+        Concurrent loads of the same relation are batched into one query.
+        pkey is a tuple in __table_pkeys__ order, or a single value for
+        relations with one primary key. Returns None if there is no match.
+        """
+        if not isinstance(pkey, tuple):
+            pkey = (pkey,)
+
+        registry = self.__object_registry__
+        if registry is not None and (obj := registry.get(cls, pkey)) is not None:
+            return obj
+
+        loader = self._loaders.get(cls)
+        if loader is None:
+            loader = self._loaders[cls] = Loader(self, cls, self.load_window)
 
-        template_query, template_args = self.sql_builder(cls).select(
-            where, order_by, limit
+        return await loader.load(pkey)
+
+    async def load_many(
+        self, cls: Type[R], pkeys: Iterable[Union[PKey, Any]]
+    ) -> list[Optional[R]]:
+        """Retrieves Relation instances by primary key, in order of pkeys."""
+        return list(await asyncio.gather(*(self.load(cls, pkey) for pkey in pkeys)))
+
+    async def resolve_keys(
+        self, cls: Type[R], column: str, values: Iterable[ValidSqlArg]
+    ) -> dict[ValidSqlArg, Any]:
+        """Maps values of a unique column to primary keys, creating rows.
+
+        Values not known to this session are resolved in one query, which
+        inserts those missing. cls must have a single primary key and its
+        other columns defaults. None values are left out.
+
+        The mappings are kept, on the assumption that rows of such a
+        dictionary table are not changed. Deleting rows of cls through
+        this session drops them.
+        """
+        known = self._known_keys(cls, column)
+        resolved: dict[ValidSqlArg, Any] = {}
+        missing: list[ValidSqlArg] = []
+        for value in values:
+            if value is None or value in resolved:
+                continue
+            resolved[value] = pkey = known.get(value)
+            if pkey is None:
+                missing.append(value)
+
+        # Rows a concurrent transaction inserts while the query runs are
+        # invisible to it, they are found by the next attempt.
+        written = False
+        for _ in range(3):
+            if not missing:
+                break
+
+            query, query_args = self.sql_builder(cls).render_resolve(column, missing)
+            for value, pkey in await self._fetch(query, query_args, cls):
+                resolved[value] = known.put(value, pkey)
+            missing = [value for value in missing if resolved[value] is None]
+            written = True
+
+        if written:
+            await self._written(cls)
+        if missing:
+            raise LookupError(f"Could not resolve {column} values {missing!r}")
+        return resolved
+
+    def _known_keys(self, cls: Type[R], column: str) -> LRUCache:
+        known = self._keys.get((cls, column))
+        if known is None:
+            known = self._keys[(cls, column)] = LRUCache(self.key_cache_size)
+        return known
+
+    def _drop_keys(self, cls: Type[R]):
+        for key in [key for key in self._keys if key[0] is cls]:
+            del self._keys[key]
+
+    def writer(
+        self,
+        cls: Type[R],
+        max_rows: int = 1000,
+        max_delay: float = 0.05,
+        on_conflict: Optional[OnConflict] = None,
+        conflict: Optional[Sequence[str]] = None,
+        max_pending: int = 10_000,
+    ) -> Writer:
+        """Returns a Writer inserting rows of cls in batches.
+
+        Use it as an async context manager, or close it, to write the rows
+        still buffered.
+        """
+        return Writer(
+            self, cls, max_rows, max_delay, on_conflict, conflict, max_pending
+        )
+
+
+class Transaction(Session):
+    """
+    A Session bound to one connection inside a transaction.
+
+    Besides running the Session methods on its connection, it queues writes
+    made with queue_create, queue_update and queue_delete. Queued writes are
+    sent with executemany, one batch per run of identical statements, right
+    before the next query and at commit. Reads inside the transaction bypass
+    the result cache and use an identity map of their own. The keys
+    resolve_keys maps are kept apart until commit too.
+    """
+
+    def __init__(self, session: Session, conn: Any):
+        vars(self).update(vars(session))
+        self.conn = conn
+        self.result_cache = None
+        self.hedging = None
+        self.single_flight = False
+        self.written: set[Type[Relation]] = set()
+        self.dropped: set[Type[Relation]] = set()
+        self._keys = {}
+        self._loaders = {}
+        self._queue: list[tuple[str, list[ValidSqlArg], Type[Relation]]] = []
+
+        if session.__object_registry__ is not None:
+            self.__object_registry__ = IdentityMap(session.__object_registry__.maxsize)
+
+    @asynccontextmanager
+    async def _acquire(
+        self, replica: bool = False, priority: Priority = "write", measure: bool = False
+    ) -> AsyncIterator[Any]:
+        await self.flush()
+        yield self.conn
+
+    async def _written(self, cls: Type[R]):
+        self.written.add(cls)
+
+    def _drop_keys(self, cls: Type[R]):
+        super()._drop_keys(cls)
+        self.dropped.add(cls)
+
+    def _enqueue(self, cls: Type[R], query: str, args: list[ValidSqlArg]):
+        self._queue.append((query, args, cls))
+        self.written.add(cls)
+
+        if self.__object_registry__ is not None:
+            self.__object_registry__.discard_class(cls)
+
+    def queue_create(self, cls: Type[R], **kwargs: ValidSqlArg):
+        """Queues an insert of a new Relation instance."""
+        self._enqueue(
+            cls, *self.sql_builder(cls).render_insert(returning=False, **kwargs)
+        )
+
+    def queue_update(
+        self, cls: Type[R], where: Optional[Where] = None, **kwargs: ValidSqlArg
+    ):
+        """Queues an update of Relation instances."""
+        self._enqueue(
+            cls, *self.sql_builder(cls).render_update(where, returning=False, **kwargs)
         )
-        query, query_args = render(template_query, template_args)
 
-        return [self.hydrate(cls, row) for row in await self._fetch(query, query_args)]
+    def queue_delete(self, cls: Type[R], where: Optional[Where] = None):
+        """Queues a delete of Relation instances."""
+        self._enqueue(cls, *self.sql_builder(cls).render_delete(where))
+        self._drop_keys(cls)
+
+    async def flush(self):
+        """Sends the queued writes."""
+        queue, self._queue = self._queue, []
+
+        for query, group in groupby(queue, key=itemgetter(0)):
+            batch = list(group)
+            args = [query_args for _, query_args, _ in batch]
+
+            await self._run(self.conn, "executemany", query, args, batch[0][2])
@@ -0,0 +1,154 @@
+import re
+import weakref
+from functools import lru_cache
+from typing import Any, Literal, Optional
+
+import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
+
+from .args import ValidSqlArg
+from .cache import LRUCache
+
+Method = Literal["fetch", "fetchrow", "execute", "executemany"]
+
+_NOISE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|(?:\s+|--[^\n]*)+""")
+
+SCHEMA_CHANGE_ERRORS = (
+    asyncpg.exceptions.InvalidCachedStatementError,
+    asyncpg.exceptions.OutdatedSchemaCacheError,
+)
+
+
+@lru_cache(maxsize=1024)
+def normalize_query(query: str) -> str:
+    """Strips comments and collapses whitespace outside of quoted text."""
+    return _NOISE.sub(lambda match: match.group(1) or " ", query).strip()
+
+
+# The asyncpg releases whose private PreparedStatement fields _checkout
+# relies on, from and excluding. Other releases prepare statements of pooled
+# connections on every query.
+TESTED_ASYNCPG = ((0, 27), (0, 33))
+
+
+def _version(text: str) -> tuple[int, ...]:
+    return tuple(int(part) for part in re.findall(r"\d+", text)[:2])
+
+
+REWRAPPABLE = TESTED_ASYNCPG[0] <= _version(asyncpg.__version__) < TESTED_ASYNCPG[1]
+
+
+def raw_connection(conn: Any) -> Any:
+    """Unwraps the connection behind a pool connection proxy."""
+    return getattr(conn, "_con", conn)
+
+
+def _checkout(stmt: Any) -> Optional[Any]:
+    """
+    asyncpg guards a prepared statement against use once its connection has
+    been released back to the pool, while the server side statement lives on
+    with the connection. Rewrap it for the current checkout, or return None
+    if this asyncpg does not allow it.
+    """
+    if not isinstance(stmt, PreparedStatement):
+        return stmt
+
+    try:
+        if stmt._con_release_ctr == stmt._connection._pool_release_ctr:
+            return stmt
+        return PreparedStatement(stmt._connection, stmt._query, stmt._state)
+    except (AttributeError, TypeError):
+        return None
+
+
+class StatementCache:
+    """
+    Prepared statements per pooled connection, keyed by normalized query text.
+
+    Each connection keeps at most maxsize statements and evicts the least
+    recently used one. Statements invalidated by a schema change are prepared
+    again and the query is retried once.
+
+    Statements outlive a pool checkout through private asyncpg fields, with
+    the releases in TESTED_ASYNCPG only. With others, the statements of
+    pooled connections are prepared for every query instead.
+    """
+
+    def __init__(self, maxsize: int = 100):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._connections: weakref.WeakKeyDictionary[Any, LRUCache[str, Any]] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _statements(self, conn: Any) -> Optional[LRUCache[str, Any]]:
+        """The statements kept for conn, None if they cannot be kept."""
+        key = raw_connection(conn)
+        if key is not conn and not REWRAPPABLE:
+            return None
+
+        try:
+            statements = self._connections.get(key)
+            if statements is None:
+                statements = self._connections[key] = LRUCache(self.maxsize)
+        except TypeError:
+            # A pool connection proxy, which cannot be weakly referenced.
+            return None
+
+        return statements
+
+    async def prepare(self, conn: Any, query: str) -> Any:
+        """Returns a prepared statement for query on conn."""
+        statements = self._statements(conn)
+        key = normalize_query(query)
+
+        if statements is None:
+            self.misses += 1
+            return await conn.prepare(key)
+
+        stmt = statements.get(key)
+        if stmt is not None and (stmt := _checkout(stmt)) is not None:
+            self.hits += 1
+            return statements.put(key, stmt)
+
+        self.misses += 1
+        evictions = statements.evictions
+        stmt = statements.put(key, await conn.prepare(key))
+        self.evictions += statements.evictions - evictions
+        return stmt
+
+    def invalidate(self, conn: Any, query: str):
+        statements = self._statements(conn)
+        if statements is not None:
+            statements.pop(normalize_query(query))
+
+    def clear(self):
+        self._connections.clear()
+
+    async def run(
+        self,
+        conn: Any,
+        method: Method,
+        query: str,
+        args: list[ValidSqlArg],
+    ) -> Any:
+        """Runs query on conn through a cached prepared statement."""
+        for retry in (False, True):
+            stmt = await self.prepare(conn, query)
+            try:
+                if method == "execute":
+                    await stmt.fetch(*args)
+                    return stmt.get_statusmsg()
+
+                if method == "executemany":
+                    return await stmt.executemany(args)
+
+                return await getattr(stmt, method)(*args)
+            except SCHEMA_CHANGE_ERRORS:
+                self.invalidate(conn, query)
+
+                # An aborted transaction cannot be retried from here.
+                if retry or conn.is_in_transaction():
+                    raise
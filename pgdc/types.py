@@ -0,0 +1,64 @@
+import dataclasses
+import typing
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Type
+from uuid import UUID
+
+from .relation import Relation
+
+SQL_TYPES: dict[Any, str] = {
+    bool: "boolean",
+    int: "bigint",
+    float: "double precision",
+    Decimal: "numeric",
+    str: "text",
+    bytes: "bytea",
+    datetime: "timestamptz",
+    date: "date",
+    time: "time",
+    timedelta: "interval",
+    UUID: "uuid",
+}
+
+
+def unwrap_optional(annotation: Any) -> tuple[Any, bool]:
+    """Returns the annotation without Optional and whether it was optional."""
+    args = typing.get_args(annotation)
+
+    if typing.get_origin(annotation) is typing.Union and type(None) in args:
+        rest = [arg for arg in args if arg is not type(None)]
+        return (rest[0] if len(rest) == 1 else typing.Union[tuple(rest)]), True
+
+    return annotation, False
+
+
+@lru_cache(maxsize=None)
+def field_types(cls: Type[Relation]) -> dict[str, Any]:
+    """Resolved annotations of the dataclass fields of cls."""
+    hints = typing.get_type_hints(cls)
+    return {field.name: hints[field.name] for field in dataclasses.fields(cls)}
+
+
+def sql_type(cls: Type[Relation], name: str) -> str:
+    """
+    Returns the postgres type of a field.
+
+    metadata["type"] on the field overrides the type derived from its
+    annotation.
+    """
+    field = next(f for f in dataclasses.fields(cls) if f.name == name)
+
+    if "type" in field.metadata:
+        return field.metadata["type"]
+
+    annotation, _ = unwrap_optional(field_types(cls)[name])
+
+    if typing.get_origin(annotation) in (list, tuple):
+        return SQL_TYPES[typing.get_args(annotation)[0]] + "[]"
+
+    try:
+        return SQL_TYPES[annotation]
+    except KeyError:
+        raise TypeError(f"No sql type for {cls.__name__}.{name}: {annotation}")
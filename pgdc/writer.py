@@ -0,0 +1,163 @@
+import asyncio
+from typing import TYPE_CHECKING, Any, Literal, Optional, Sequence, Type
+
+from .args import ValidSqlArg
+from .relation import Relation
+
+if TYPE_CHECKING:
+    from .session import Session
+
+OnConflict = Literal["nothing", "update"]
+
+
+class Writer:
+    """
+    Buffers the rows inserted into one relation and writes them in batches.
+
+    A batch is written once max_rows rows are buffered, or max_delay
+    seconds after its first row. Rows are sent through binary COPY, or,
+    with on_conflict, copied into a staging table and merged with INSERT
+    ... ON CONFLICT on the conflict columns, the primary keys by default.
+    on_conflict="nothing" skips the conflicting rows, "update" updates
+    them. A batch must not repeat a conflict key then.
+
+    At most max_pending rows are buffered or being written. add waits for
+    room beyond that. Batches are written one at a time, in order.
+    """
+
+    def __init__(
+        self,
+        session: "Session",
+        cls: Type[Relation],
+        max_rows: int = 1000,
+        max_delay: float = 0.05,
+        on_conflict: Optional[OnConflict] = None,
+        conflict: Optional[Sequence[str]] = None,
+        max_pending: int = 10_000,
+    ):
+        if on_conflict not in (None, "nothing", "update"):
+            raise ValueError(f"Unknown on_conflict {on_conflict!r}")
+
+        self.session = session
+        self.cls = cls
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.on_conflict = on_conflict
+        self.conflict = conflict
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.closed = False
+        self._rows: list[tuple[dict[str, ValidSqlArg], asyncio.Future]] = []
+        self._room = asyncio.Semaphore(max_pending)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writing: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "Writer":
+        return self
+
+    async def __aexit__(self, *exc_info: Any):
+        await self.close()
+
+    async def add(self, **row: ValidSqlArg) -> asyncio.Future:
+        """
+        Buffers a row, waiting for room if too many are pending.
+
+        Returns a future resolving to None once the row is written, failing
+        with the error of its batch, or cancelled with its batch. Awaiting it is optional, the
+        rows that could not be written are counted in failed.
+        """
+        if self.closed:
+            raise RuntimeError("The writer is closed")
+
+        await self._room.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(self._settled)
+        self._rows.append((row, future))
+
+        if len(self._rows) >= self.max_rows:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._dispatch)
+
+        return future
+
+    def _settled(self, future: asyncio.Future):
+        self._room.release()
+        # Unawaited failures are counted in failed, not logged by asyncio.
+        if not future.cancelled():
+            future.exception()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._rows = self._rows, []
+        if batch:
+            self.batches += 1
+            self._writing = asyncio.ensure_future(self._write(self._writing, batch))
+
+    async def _write(
+        self,
+        previous: Optional[asyncio.Task],
+        batch: list[tuple[dict[str, ValidSqlArg], asyncio.Future]],
+    ):
+        try:
+            if previous is not None:
+                # Batches are written in order. The rows of previous are
+                # resolved or failed by it, even if it was cancelled.
+                await asyncio.wait([previous])
+                if not previous.cancelled():
+                    previous.exception()
+
+            await self._write_groups(batch)
+        finally:
+            for _, future in batch:
+                if not future.done():
+                    self.failed += 1
+                    future.cancel()
+
+    async def _write_groups(
+        self, batch: list[tuple[dict[str, ValidSqlArg], asyncio.Future]]
+    ):
+        # Rows leaving out different columns are written separately, so
+        # that database defaults apply to each.
+        groups: dict[frozenset, list] = {}
+        for row, future in batch:
+            groups.setdefault(frozenset(row), []).append((row, future))
+
+        for group in groups.values():
+            rows = [row for row, _ in group]
+            try:
+                if self.on_conflict is None:
+                    await self.session.create_many(self.cls, rows)
+                else:
+                    await self.session.upsert_many(
+                        self.cls,
+                        rows,
+                        conflict=self.conflict,
+                        update=[] if self.on_conflict == "nothing" else None,
+                    )
+            except Exception as exc:
+                self.failed += len(group)
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(exc)
+            else:
+                self.written += len(group)
+                for _, future in group:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def flush(self):
+        """Writes the buffered rows, waiting for every pending batch."""
+        self._dispatch()
+        if self._writing is not None:
+            await asyncio.shield(self._writing)
+
+    async def close(self):
+        """Flushes the buffered rows and refuses new ones."""
+        self.closed = True
+        await self.flush()
@@ -0,0 +1,220 @@
+import tests.ctx
+
+import asyncio
+import struct
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from pgdc.statements import normalize_query
+
+Handler = Callable[[str, tuple], list[dict]]
+
+
+class FakeRecord:
+    """Mimics the parts of asyncpg.Record pgdc relies on."""
+
+    __slots__ = ("_names", "_values")
+
+    def __init__(self, mapping: dict):
+        self._names = tuple(mapping)
+        self._values = tuple(mapping.values())
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._names.index(key)]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._names else default
+
+    def keys(self):
+        return iter(self._names)
+
+    def values(self):
+        return iter(self._values)
+
+    def items(self):
+        return iter(zip(self._names, self._values))
+
+
+def no_rows(query: str, args: tuple) -> list[dict]:
+    return []
+
+
+def encode_value(value: Any) -> bytes:
+    if isinstance(value, bool):
+        return struct.pack(">i?", 1, value)
+    if isinstance(value, int):
+        return struct.pack(">iq", 8, value)
+    if isinstance(value, float):
+        return struct.pack(">id", 8, value)
+    if isinstance(value, datetime):
+        micros = (value - datetime(2000, 1, 1, tzinfo=value.tzinfo)) // timedelta(
+            microseconds=1
+        )
+        return struct.pack(">iq", 8, micros)
+    raise TypeError(f"Cannot encode {value!r}")
+
+
+def encode_copy(rows: list[FakeRecord]) -> bytes:
+    """Encodes rows as binary COPY output."""
+    data = bytearray(b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0))
+    for row in rows:
+        data += struct.pack(">h", len(row))
+        for value in row:
+            data += encode_value(value)
+    return bytes(data + struct.pack(">h", -1))
+
+
+class FakeStatement:
+    def __init__(self, conn: "FakeConnection", query: str):
+        self._conn = conn
+        self._query = query
+        self._status: Optional[str] = None
+
+    async def fetch(self, *args) -> list[FakeRecord]:
+        rows = await self._conn._respond(self._query, args)
+        self._status = f"{normalize_query(self._query).split()[0]} {len(rows)}"
+        return rows
+
+    async def fetchrow(self, *args) -> Optional[FakeRecord]:
+        rows = await self.fetch(*args)
+        return rows[0] if rows else None
+
+    def get_statusmsg(self) -> Optional[str]:
+        return self._status
+
+    async def executemany(self, args: list[tuple]):
+        self._conn.log.append(("executemany", normalize_query(self._query), args))
+
+    async def cursor(self, *args) -> "FakeCursor":
+        return FakeCursor(await self.fetch(*args))
+
+
+class FakeCursor:
+    def __init__(self, rows: list[FakeRecord]):
+        self._rows = rows
+        self.fetches = 0
+
+    async def fetch(self, n: int) -> list[FakeRecord]:
+        await asyncio.sleep(0)
+        self.fetches += 1
+        rows, self._rows = self._rows[:n], self._rows[n:]
+        return rows
+
+
+class FakeConnection:
+    """An in-process stand-in for an asyncpg connection.
+
+    Every query is logged and answered by handler, which maps a query and
+    its arguments to rows given as dicts.
+    """
+
+    def __init__(self, handler: Handler = no_rows):
+        self.handler = handler
+        self.log: list[tuple[str, str, tuple]] = []
+        self.prepared: list[str] = []
+        self._transactions = 0
+
+    async def _respond(self, query: str, args: tuple) -> list[FakeRecord]:
+        self.log.append(("query", normalize_query(query), args))
+        return [FakeRecord(row) for row in self.handler(query, args)]
+
+    async def prepare(self, query: str) -> FakeStatement:
+        self.prepared.append(query)
+        return FakeStatement(self, query)
+
+    async def fetch(self, query: str, *args) -> list[FakeRecord]:
+        return await FakeStatement(self, query).fetch(*args)
+
+    async def fetchrow(self, query: str, *args) -> Optional[FakeRecord]:
+        return await FakeStatement(self, query).fetchrow(*args)
+
+    async def executemany(self, query: str, args: list[tuple]):
+        await FakeStatement(self, query).executemany(args)
+
+    async def cursor(self, query: str, *args) -> FakeCursor:
+        return await FakeStatement(self, query).cursor(*args)
+
+    async def execute(self, query: str, *args) -> Optional[str]:
+        stmt = FakeStatement(self, query)
+        await stmt.fetch(*args)
+        return stmt.get_statusmsg()
+
+    async def copy_records_to_table(
+        self, table_name: str, *, records, columns=None
+    ) -> str:
+        records = list(records)
+        self.log.append(("copy", table_name, (tuple(columns or ()), records)))
+        return f"COPY {len(records)}"
+
+    async def copy_from_query(self, query: str, *args, output, format=None) -> str:
+        """Sends the handler rows as binary COPY output, in small chunks."""
+        rows = [FakeRecord(row) for row in self.handler(query, args)]
+        self.log.append(("copy_out", normalize_query(query), args))
+
+        data = encode_copy(rows)
+        for i in range(0, len(data), 7):
+            await output(data[i : i + 7])
+        return f"COPY {len(rows)}"
+
+    @asynccontextmanager
+    async def transaction(self, **options):
+        self.log.append(("begin", "", tuple(options.items())))
+        self._transactions += 1
+        try:
+            yield
+        except BaseException:
+            self.log.append(("rollback", "", ()))
+            raise
+        else:
+            self.log.append(("commit", "", ()))
+        finally:
+            self._transactions -= 1
+
+    def is_in_transaction(self) -> bool:
+        return self._transactions > 0
+
+
+class FakePool:
+    """A pool of FakeConnections sharing one handler."""
+
+    def __init__(self, handler: Handler = no_rows, size: int = 4):
+        self.connections = [FakeConnection(handler) for _ in range(size)]
+        self._idle: asyncio.Queue = asyncio.Queue()
+        for conn in self.connections:
+            self._idle.put_nowait(conn)
+
+    @property
+    def log(self) -> list[tuple[str, str, tuple]]:
+        return [entry for conn in self.connections for entry in conn.log]
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    async def fetch(self, query: str, *args) -> Any:
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args) -> Any:
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args)
+
+    async def execute(self, query: str, *args) -> Any:
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args)
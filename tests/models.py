@@ -4,7 +4,7 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
-from pgdc import Relation
+from pgdc import Relation, relationship
 
 
 @dataclass(frozen=True)
@@ -12,6 +12,7 @@ class SearchKey(Relation, table_name="search_keys", pkey="id"):
     id: Optional[int]
     key: str
     date_created: datetime
+    indexes: Optional[list["SearchIndexInt"]] = relationship(remote="key_id")
 
 
 @dataclass(frozen=True)
@@ -22,3 +23,4 @@ class SearchIndexInt(
     key_id: int
     date_created: datetime
     value: int
+    key: Optional[SearchKey] = relationship(local="key_id")
@@ -0,0 +1,106 @@
+import tests.ctx
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+import pytest
+
+from pgdc import Relation, Session
+from tests.fakes import FakeConnection
+
+np = pytest.importorskip("numpy")
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+NOW_US = int(NOW.timestamp()) * 1_000_000
+
+
+@dataclass(frozen=True)
+class Sample(Relation, table_name="samples", pkey="id"):
+    id: int
+    value: Optional[int]
+    flag: bool
+    created: datetime
+    note: Optional[str] = None
+
+
+def samples(query, args):
+    rows = [(i, None if i % 2 else i * 10, i > 2, i) for i in range(5)]
+
+    if "coalesce" in query:
+        return [
+            {
+                "id": i,
+                "value": value or 0,
+                "value_null": value is None,
+                "flag": flag,
+                "created": NOW.replace(second=second),
+            }
+            for i, value, flag, second in rows
+        ]
+    return [
+        {
+            "id": i,
+            "value": value,
+            "flag": flag,
+            "created": NOW_US + second * 1_000_000,
+            "note": None if i == 1 else f"note-{i}",
+        }
+        for i, value, flag, second in rows
+    ]
+
+
+async def test_get_columns_copy():
+    conn = FakeConnection(samples)
+    columns = await Session(conn).get_columns(
+        Sample, columns=["id", "value", "flag", "created"]
+    )
+
+    assert conn.log[0][0] == "copy_out"
+    assert "coalesce(value::bigint, 0), value IS NULL" in conn.log[0][1]
+    assert columns["id"].dtype == np.int64
+    assert columns["id"].tolist() == [0, 1, 2, 3, 4]
+    assert isinstance(columns["value"], np.ma.MaskedArray)
+    assert columns["value"].tolist() == [0, None, 20, None, 40]
+    assert columns["flag"].tolist() == [False, False, False, True, True]
+    assert columns["created"].dtype == np.dtype("datetime64[us]")
+    assert columns["created"][3] == np.datetime64("2024-01-01T00:00:03")
+
+
+async def test_get_columns_records():
+    conn = FakeConnection(samples)
+    columns = await Session(conn).get_columns(Sample)
+
+    assert conn.log[0][0] == "query"
+    assert "EXTRACT(EPOCH FROM created)" in conn.log[0][1]
+    assert list(columns) == ["id", "value", "flag", "created", "note"]
+    assert columns["value"].tolist() == [0, None, 20, None, 40]
+    assert columns["note"].dtype == object
+    assert columns["note"].tolist() == ["note-0", None, "note-2", "note-3", "note-4"]
+    assert columns["created"][3] == np.datetime64("2024-01-01T00:00:03")
+
+
+def id_and_value(query, args):
+    if "coalesce" in query:
+        return [{"id": i, "value": i, "value_null": False} for i in range(5)]
+    return [{"id": i, "note": f"note-{i}" if i != 1 else None} for i in range(5)]
+
+
+async def test_stream_columns():
+    session = Session(FakeConnection(id_and_value))
+
+    copied = [
+        batch["id"].tolist()
+        async for batch in session.stream_columns(
+            Sample, columns=["id", "value"], batch_size=2
+        )
+    ]
+    assert copied == [[0, 1], [2, 3], [4]]
+
+    fetched = [
+        batch["note"].tolist()
+        async for batch in session.stream_columns(
+            Sample, columns=["id", "note"], batch_size=3
+        )
+    ]
+    assert fetched == [["note-0", None, "note-2"], ["note-3", "note-4"]]
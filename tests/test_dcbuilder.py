@@ -1,10 +1,27 @@
 from tests import ctx
 import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import pytest
 
 from pgdc import (
+    DEFERRED,
+    And,
+    Between,
+    Contains,
+    Eq,
+    Ge,
+    In,
+    Lt,
+    NotIn,
+    Or,
+    Overlaps,
     Where,
     Limit,
     DcBuilder,
+    Relation,
     render,
     session,
     Verbatim,
@@ -68,3 +85,167 @@ async def _test_custom_sql():
         raw_query, {"id": 2, "key_fragment": "updated-key"}, flavor="psycopg2"
     )
     print(query, args)
+
+
+async def test_render_select_matches_render():
+    builder = DcBuilder(SearchIndexInt)
+    where = Where(doc_id=1, key_id=2)
+    assert builder.render_select(where, limit=Limit(1)) == render(
+        *builder.select(where, limit=Limit(1))
+    )
+    assert builder.render_select(where, flavor="psycopg2") == render(
+        *builder.select(where), flavor="psycopg2"
+    )
+
+
+async def test_compiled_kwargs_order():
+    builder = DcBuilder(SearchIndexInt)
+    q1, args1 = builder.render_select(Where(doc_id=1, key_id=2))
+    q2, args2 = builder.render_select(Where(key_id=2, doc_id=1))
+    assert q1 is q2
+    assert args1 == args2 == [1, 2]
+    assert len(builder._compiled) == 1
+
+    q3, args3 = builder.render_select(Where(key_id=4, doc_id=3))
+    assert q3 is q1
+    assert args3 == [3, 4]
+
+
+async def test_compiled_verbatim_shape():
+    builder = DcBuilder(SearchKey)
+    q1, args1 = builder.render_update(Where(id=1), date_created=Verbatim("NOW()"))
+    q2, args2 = builder.render_update(Where(id=1), date_created="2020-01-01")
+    assert "NOW()" in q1 and "NOW()" not in q2
+    assert args1 == [1]
+    assert args2 == ["2020-01-01", 1]
+
+
+async def test_select_without_where():
+    builder = DcBuilder(SearchKey)
+    query, args = builder.render_select()
+    assert "WHERE" not in query
+    assert args == []
+
+
+async def test_hydrate():
+    now = datetime(2024, 1, 1)
+    builder = DcBuilder(SearchKey)
+    key = builder.hydrate((1, "key", now))
+    assert key == SearchKey(id=1, key="key", date_created=now)
+    assert builder.hydrate_many([(1, "key", now), (2, "other", now)])[1].id == 2
+
+
+@dataclass
+class Validated(Relation, table_name="validated", pkey="id", post_init=True):
+    id: int
+    tags: list = field(default_factory=list)
+    _cache: Optional[dict] = None
+
+    def __post_init__(self):
+        assert self.id > 0
+
+
+async def test_hydrate_defaults_and_post_init():
+    builder = DcBuilder(Validated)
+    assert builder.attrs == ["id", "tags"]
+    obj = builder.hydrate((1, ["a"]))
+    assert obj._cache is None
+
+    with pytest.raises(AssertionError):
+        builder.hydrate((0, []))
+
+
+@dataclass(frozen=True)
+class Document(Relation, table_name="documents", pkey="id"):
+    id: int
+    title: str
+    body: str = field(default="", metadata={"deferred": True})
+
+
+async def test_projection():
+    builder = DcBuilder(Document)
+    assert builder.columns() == ("id", "title")
+    assert builder.columns(only=["body"]) == ("id", "body")
+    assert builder.columns(defer=["title"]) == ("id",)
+
+    with pytest.raises(ValueError):
+        builder.columns(only=["missing"])
+    with pytest.raises(ValueError):
+        builder.columns(defer=["id"])
+
+    query, _ = builder.render_select(Where(id=1))
+    assert "body" not in query
+
+    doc = builder.hydrators(("id", "title"))[0]((1, "title"))
+    assert doc.body is DEFERRED
+    assert repr(doc) == "Document(id=1, title='title', body=DEFERRED)"
+
+
+@dataclass(frozen=True)
+class IndexArray(
+    Relation, table_name="search_index_int_array", pkeys=("doc_id", "key_id")
+):
+    doc_id: int
+    key_id: int
+    value: list[int]
+
+
+async def test_operators_share_one_shape():
+    builder = DcBuilder(SearchKey)
+    q1, args1 = builder.render_select(Where(In("id", [1, 2, 3])))
+    q2, args2 = builder.render_select(Where(In("id", list(range(3000)))))
+    assert q1 is q2
+    assert "WHERE (id = ANY($1))" in q1
+    assert args1 == [[1, 2, 3]]
+    assert len(args2[0]) == 3000
+
+    query, args = builder.render_select(
+        Where(Ge("id", 10), Lt("id", 20), NotIn("key", ["a"], cast="text"))
+    )
+    assert "(id >= $1 AND id < $2 AND key <> ALL($3::text[]))" in query
+    assert args == [10, 20, ["a"]]
+
+    query, args = builder.render_select(
+        Where(Between("date_created", Verbatim("NOW()"), "2030-01-01"))
+    )
+    assert "date_created BETWEEN NOW() AND $1" in query
+    assert args == ["2030-01-01"]
+
+
+async def test_array_operators():
+    builder = DcBuilder(IndexArray)
+    query, args = builder.render_select(
+        Where(Or(Contains("value", [1, 2]), Overlaps("value", [7])), Eq("key_id", 3))
+    )
+    assert "((value @> $1 OR value && $2) AND key_id = $3)" in query
+    assert args == [[1, 2], [7], 3]
+
+
+async def test_repeated_operators():
+    builder = DcBuilder(SearchIndexInt)
+
+    def ranges(*bounds):
+        return Where(
+            Or(*(And(Ge("value", low), Lt("value", high)) for low, high in bounds))
+        )
+
+    query, args = builder.render_select(ranges((1, 5), (10, 20)))
+    assert "(value >= $1 AND value < $2) OR (value >= $3 AND value < $4)" in query
+    assert args == [1, 5, 10, 20]
+
+    assert builder.render_select(ranges((2, 3), (7, 9))) == (query, [2, 3, 7, 9])
+    _, raw_args = builder.select(ranges((1, 5), (10, 20)))
+    assert sorted(raw_args.values()) == [1, 5, 10, 20]
+    assert builder.render_select(Where(Ge("value", 1)))[1] == [1]
+
+
+async def test_update_and_delete_need_a_where():
+    builder = DcBuilder(SearchKey)
+    for where in (None, Where()):
+        with pytest.raises(ValueError):
+            builder.render_delete(where)
+        with pytest.raises(ValueError):
+            builder.render_update(where, key="key")
+
+    query, _ = builder.render_delete(Where(id=1))
+    assert "WHERE (id = $1)" in query
@@ -0,0 +1,1092 @@
+import tests.ctx
+
+import asyncio
+import base64
+import gc
+import json
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import asyncpg
+import pytest
+
+from pgdc import DEFERRED, In, Relation, Session, Verbatim, Where, statements
+from pgdc.admission import AdmissionController, Overloaded
+from pgdc.hedging import HedgePolicy
+from pgdc.instrument import QueryHook, QueryStats, fingerprint
+from pgdc.replicas import ReplicaSet
+from pgdc.results import MemoryBackend, ResultCache
+from tests.fakes import FakeConnection, FakePool, FakeRecord
+from tests.models import SearchIndexInt, SearchKey
+
+NOW = datetime(2024, 1, 1)
+
+
+def search_keys(query, args):
+    if query.startswith("DELETE"):
+        return [{"id": args[0]}]
+    return [{"id": args[0], "key": f"key-{args[0]}", "date_created": NOW}]
+
+
+async def test_prepared_statement_cache():
+    pool = FakePool(search_keys, size=1)
+    session = Session(pool, statement_cache_size=2)
+
+    assert (await session.get_one(SearchKey, Where(id=1))).key == "key-1"
+    assert (await session.get_one(SearchKey, Where(id=2))).key == "key-2"
+
+    (conn,) = pool.connections
+    assert len(conn.prepared) == 1
+    assert "--" not in conn.prepared[0]
+    assert (session.statements.hits, session.statements.misses) == (1, 1)
+
+
+async def test_prepared_statement_eviction():
+    conn = FakeConnection(search_keys)
+    session = Session(conn, statement_cache_size=1, identity_map_size=0)
+
+    await session.get_one(SearchKey, Where(id=1))
+    await session.get_one(SearchKey, Where(key="key-1"))
+    await session.get_one(SearchKey, Where(id=1))
+
+    assert len(conn.prepared) == 3
+    assert session.statements.evictions == 2
+
+
+async def test_prepared_statement_reprepare():
+    conn = FakeConnection(search_keys)
+    session = Session(conn)
+    await session.get_one(SearchKey, Where(id=1))
+
+    def schema_changed(query, args):
+        conn.handler = search_keys
+        raise asyncpg.exceptions.InvalidCachedStatementError("schema changed")
+
+    conn.handler = schema_changed
+    assert (await session.get_one(SearchKey, Where(id=3))).id == 3
+    assert len(conn.prepared) == 2
+
+
+class PoolProxy:
+    __slots__ = ("_con",)
+
+    def __init__(self, con):
+        self._con = con
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+async def test_prepared_statements_of_untested_asyncpg(monkeypatch):
+    monkeypatch.setattr(statements, "REWRAPPABLE", False)
+    conn = FakeConnection()
+    cache = statements.StatementCache()
+
+    for target in (PoolProxy(conn), PoolProxy(conn), conn, conn):
+        await cache.run(target, "fetch", "SELECT 1", [])
+
+    assert len(conn.prepared) == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+async def test_without_statement_cache():
+    conn = FakeConnection(search_keys)
+    session = Session(conn, statement_cache_size=0)
+
+    await session.get_one(SearchKey, Where(id=1))
+    assert conn.prepared == []
+    assert len(conn.log) == 1
+
+
+async def test_create_many_copy():
+    conn = FakeConnection()
+    session = Session(conn)
+    rows = [{"doc_id": i, "key_id": 1, "value": i * i} for i in range(5)]
+
+    assert await session.create_many(SearchIndexInt, rows, chunk_size=2) == 5
+
+    copies = [entry for entry in conn.log if entry[0] == "copy"]
+    assert [len(records) for _, _, (_, records) in copies] == [2, 2, 1]
+    assert copies[0][1] == "search_index_int"
+    assert copies[0][2] == (("doc_id", "key_id", "value"), [(0, 1, 0), (1, 1, 1)])
+    assert [kind for kind, _, _ in conn.log] == [
+        "begin",
+        "copy",
+        "copy",
+        "copy",
+        "commit",
+    ]
+
+
+async def test_create_many_returning():
+    def inserted(query, args):
+        return [
+            {"doc_id": d, "key_id": k, "date_created": NOW, "value": v}
+            for d, k, v in zip(*args)
+        ]
+
+    conn = FakeConnection(inserted)
+    session = Session(conn)
+    rows = [
+        SearchIndexInt(doc_id=i, key_id=1, date_created=Verbatim("NOW()"), value=i)
+        for i in range(3)
+    ]
+
+    created = await session.create_many(SearchIndexInt, rows, returning=True)
+    assert [row.doc_id for row in created] == [0, 1, 2]
+    assert created[0].date_created == NOW
+
+    ((_, query, args),) = [entry for entry in conn.log if entry[0] == "query"]
+    assert "unnest($1::bigint[], $2::bigint[], $3::bigint[])" in query
+    assert "NOW()" in query
+    assert args == ([0, 1, 2], [1, 1, 1], [0, 1, 2])
+
+
+async def test_create_many_rejects_unexpected_columns():
+    session = Session(FakeConnection())
+    rows = [{"doc_id": 1, "key_id": 1}, {"doc_id": 2, "key_id": 1, "value": 3}]
+
+    with pytest.raises(ValueError):
+        await session.create_many(SearchIndexInt, rows)
+
+
+async def test_upsert_many():
+    def merged(query, args):
+        return [{"inserted": 2, "updated": 1}] if "merged" in query else []
+
+    conn = FakeConnection(merged)
+    session = Session(conn)
+    rows = [{"doc_id": i, "key_id": 1, "value": i} for i in range(4)]
+
+    result = await session.upsert_many(SearchIndexInt, rows)
+    assert (result.inserted, result.updated, result.unchanged) == (2, 1, 1)
+
+    kinds = [kind for kind, _, _ in conn.log]
+    assert kinds == ["begin", "query", "copy", "query", "query", "commit"]
+
+    query = conn.log[3][1]
+    assert "ON CONFLICT (doc_id, key_id) DO UPDATE SET value = EXCLUDED.value" in query
+    assert "IS DISTINCT FROM (EXCLUDED.value)" in query
+    assert conn.log[2][1] == "pgdc_staging_search_index_int"
+
+
+def search_key_table(query, args):
+    if "search_keys" not in query:
+        return []
+    return [{"id": i, "key": f"key-{i}", "date_created": NOW} for i in range(10)]
+
+
+async def test_stream():
+    conn = FakeConnection(search_key_table)
+    session = Session(conn)
+
+    keys = [key async for key in session.stream(SearchKey, batch_size=3)]
+    assert [key.id for key in keys] == list(range(10))
+    assert [kind for kind, _, _ in conn.log] == ["begin", "query", "commit"]
+
+
+async def test_stream_batches():
+    session = Session(FakeConnection(search_key_table), statement_cache_size=0)
+
+    sizes = [
+        len(batch)
+        async for batch in session.stream(SearchKey, batch_size=5, batches=True)
+    ]
+    assert sizes == [5, 5]
+
+
+async def test_stream_early_exit():
+    conn = FakeConnection(search_key_table)
+    session = Session(conn)
+
+    async with aclosing(session.stream(SearchKey, batch_size=2)) as keys:
+        async for key in keys:
+            break
+
+    assert not conn.is_in_transaction()
+
+
+def test_hydrate_mapping():
+    session = Session(FakeConnection())
+    row = {"id": 1, "key": "key-1", "date_created": NOW}
+
+    assert session.hydrate(SearchKey, row) == SearchKey(1, "key-1", NOW)
+    assert session.hydrate(SearchKey, None) is None
+
+
+def test_hydrate_records_by_name():
+    session = Session(FakeConnection())
+    record = FakeRecord({"date_created": NOW, "key": "key-1", "id": 1})
+
+    assert session.hydrate(SearchKey, record) == SearchKey(1, "key-1", NOW)
+    assert session.hydrate_many(SearchKey, [record]) == [SearchKey(1, "key-1", NOW)]
+    assert session.hydrate_many(SearchKey, []) == []
+    assert session.hydrate(SearchKey, (1, "key-1", NOW)).key == "key-1"
+
+    partial = session.hydrate(SearchKey, FakeRecord({"key": "key-1", "id": 1}))
+    assert partial.date_created is DEFERRED
+    with pytest.raises(ValueError):
+        session.hydrate(SearchKey, FakeRecord({"id": 1, "other": 2}))
+
+
+async def test_identity_map():
+    conn = FakeConnection(search_keys)
+    session = Session(conn, identity_map_size=1024)
+
+    key = await session.get_one(SearchKey, Where(id=1))
+    assert await session.get_one(SearchKey, Where(id=1)) is key
+    assert await session.get_one(SearchKey, Where(key="key-1")) is not key
+    assert len(conn.log) == 2
+
+    await session.delete(SearchKey, Where(id=1))
+    assert "RETURNING id" in conn.log[-1][1]
+    await session.get_one(SearchKey, Where(id=1))
+    assert len(conn.log) == 4
+
+
+async def test_identity_map_refreshed_by_update():
+    def updated(query, args):
+        return [{"id": 1, "key": "updated", "date_created": NOW}]
+
+    session = Session(FakeConnection(updated), identity_map_size=1024)
+    await session.update(SearchKey, Where(id=1), key="updated")
+    assert (await session.get_one(SearchKey, Where(id=1))).key == "updated"
+    assert session.__object_registry__.hits == 1
+
+
+async def test_identity_map_update_of_primary_key():
+    conn = FakeConnection(search_keys)
+    session = Session(conn, identity_map_size=1024)
+
+    await session.get_one(SearchKey, Where(id=1))
+    await session.update(SearchKey, Where(id=1), id=2)
+    await session.get_one(SearchKey, Where(id=1))
+    assert len(conn.log) == 3
+
+
+async def test_identity_map_disabled():
+    conn = FakeConnection(search_keys)
+    session = Session(conn, identity_map_size=0)
+
+    await session.get_one(SearchKey, Where(id=1))
+    await session.get_one(SearchKey, Where(id=1))
+    assert len(conn.log) == 2
+
+
+async def test_result_cache():
+    conn = FakeConnection(search_key_table)
+    cache = ResultCache(ttls={SearchKey: 60})
+    session = Session(conn, result_cache=cache)
+
+    first = await session.get(SearchKey, Where(key="key-1"))
+    second = await session.get(SearchKey, Where(key="key-1"))
+    assert first == second and first[0] is not second[0]
+    assert (await session.get_one(SearchKey, Where(key="key-2"))).id == 0
+    assert await session.get(SearchIndexInt, Where(key_id=1)) == []
+    assert len(conn.log) == 3
+    assert cache.stats() == {"hits": 1, "misses": 2, "evictions": 0}
+
+    await session.create(SearchKey, key="key-3")
+    await session.get(SearchKey, Where(key="key-1"))
+    assert len(conn.log) == 5
+    assert len(cache.backend) == 1
+
+
+async def test_result_cache_bounds():
+    backend = MemoryBackend(max_entries=2)
+    session = Session(
+        FakeConnection(search_keys), result_cache=ResultCache(backend, ttl=60)
+    )
+
+    for i in range(3):
+        await session.get(SearchKey, Where(key=f"key-{i}"))
+    assert (len(backend), backend.evictions) == (2, 1)
+
+    backend.max_bytes = 1
+    await session.get(SearchKey, Where(key="key-1"))
+    await session.get(SearchKey, Where(key="key-9"))
+    assert len(backend) <= 1
+
+
+async def test_load_batches_concurrent_lookups():
+    def by_ids(query, args):
+        (ids,) = args
+        return [{"id": i, "key": f"key-{i}", "date_created": NOW} for i in ids if i < 3]
+
+    conn = FakeConnection(by_ids)
+    session = Session(conn, identity_map_size=1024)
+
+    keys = await asyncio.gather(*(session.load(SearchKey, i) for i in (1, 2, 3, 2)))
+    assert [key and key.id for key in keys] == [1, 2, None, 2]
+    assert keys[1] is keys[3]
+    assert len(conn.log) == 1
+    assert "id = ANY($1)" in conn.log[0][1]
+    assert conn.log[0][2] == ([1, 2, 3],)
+
+    assert (await session.load_many(SearchKey, [1, 2]))[0] is keys[0]
+    assert len(conn.log) == 1
+
+
+async def test_load_survives_a_cancelled_caller():
+    conn = FakeConnection(
+        lambda query, args: [
+            {"id": i, "key": "key", "date_created": NOW} for i in args[0]
+        ]
+    )
+    stall(conn, 0.01)
+    session = Session(conn)
+
+    first = asyncio.ensure_future(session.load(SearchKey, 1))
+    second = asyncio.ensure_future(session.load(SearchKey, 1))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert (await second).id == 1
+    assert first.cancelled()
+    assert len(conn.log) == 1
+
+
+async def test_load_composite_keys():
+    def by_keys(query, args):
+        return [
+            {"doc_id": d, "key_id": k, "date_created": NOW, "value": d + k}
+            for d, k in zip(*args)
+        ]
+
+    conn = FakeConnection(by_keys)
+    session = Session(conn, load_window=0.001)
+
+    rows = await session.load_many(SearchIndexInt, [(1, 2), (3, 4)])
+    assert [row.value for row in rows] == [3, 7]
+    assert "(doc_id, key_id) IN (SELECT * FROM unnest(" in conn.log[0][1]
+
+
+async def test_transaction_pins_and_batches_writes():
+    pool = FakePool(search_keys, size=2)
+    session = Session(pool)
+
+    async with session.transaction() as tx:
+        for i in range(3):
+            tx.queue_create(SearchIndexInt, doc_id=i, key_id=1, value=i)
+        tx.queue_update(SearchIndexInt, Where(doc_id=0, key_id=1), value=5)
+        tx.queue_update(SearchIndexInt, Where(doc_id=1, key_id=1), value=6)
+        key = await tx.get_one(SearchKey, Where(id=1))
+        tx.queue_delete(SearchIndexInt, Where(doc_id=2, key_id=1))
+
+    assert key.id == 1
+    (conn,) = [conn for conn in pool.connections if conn.log]
+    kinds = [(kind, len(args)) for kind, _, args in conn.log]
+    assert kinds == [
+        ("begin", 0),
+        ("executemany", 3),
+        ("executemany", 2),
+        ("query", 1),
+        ("executemany", 1),
+        ("commit", 0),
+    ]
+    assert "RETURNING" not in conn.log[1][1]
+
+
+async def test_transaction_rollback_discards_queue():
+    conn = FakeConnection(search_keys)
+    session = Session(conn)
+
+    with pytest.raises(RuntimeError):
+        async with session.transaction() as tx:
+            tx.queue_create(SearchIndexInt, doc_id=1, key_id=1, value=1)
+            raise RuntimeError()
+
+    assert [kind for kind, _, _ in conn.log] == ["begin", "rollback"]
+
+
+async def test_transaction_invalidates_after_commit():
+    conn = FakeConnection(search_keys)
+    session = Session(conn, result_cache=ResultCache(ttl=60), identity_map_size=1024)
+
+    key = await session.get_one(SearchKey, Where(id=1))
+    await session.get(SearchKey, Where(key="key-1"))
+
+    async with session.transaction() as tx:
+        assert await tx.get_one(SearchKey, Where(id=1)) is not key
+        await tx.update(SearchKey, Where(id=1), key="key-2")
+        assert await session.get_one(SearchKey, Where(id=1)) is key
+
+    assert await session.get_one(SearchKey, Where(id=1)) is not key
+    assert session.result_cache.hits == 0
+    await session.get(SearchKey, Where(key="key-1"))
+    assert session.result_cache.hits == 0
+
+
+async def test_paginate():
+    table = [
+        {"doc_id": d, "key_id": k, "date_created": NOW, "value": d * k}
+        for d in range(3)
+        for k in range(3)
+    ]
+
+    def seek(query, args):
+        rows = table
+        if "> ($1, $2)" in query:
+            rows = [r for r in rows if (r["doc_id"], r["key_id"]) > args[:2]]
+        return rows[: args[-1]]
+
+    conn = FakeConnection(seek)
+    session = Session(conn)
+
+    pages = [await session.paginate(SearchIndexInt, page_size=4)]
+    while pages[-1].next:
+        pages.append(
+            await session.paginate(SearchIndexInt, page_size=4, after=pages[-1].next)
+        )
+
+    assert [len(page.items) for page in pages] == [4, 4, 1]
+    assert [(r.doc_id, r.key_id) for r in pages[1].items][0] == (1, 1)
+    assert "ORDER BY doc_id ASC, key_id ASC" in conn.log[1][1]
+    assert "WHERE (((doc_id, key_id) > ($1, $2)))" in conn.log[1][1]
+
+
+async def test_paginate_where_and_ordering():
+    conn = FakeConnection(search_key_table)
+    session = Session(conn)
+
+    page = await session.paginate(
+        SearchKey, Where(key="key-1"), ["date_created DESC"], page_size=2
+    )
+    assert page.next is not None
+    await session.paginate(
+        SearchKey, Where(key="key-1"), ["date_created DESC"], after=page.next
+    )
+    query = conn.log[1][1]
+    assert "WHERE ((key = $1) AND ((date_created, id) < ($2, $3)))" in query
+    assert "ORDER BY date_created DESC, id DESC" in query
+    assert conn.log[1][2][1:3] == (NOW, 1)
+
+    with pytest.raises(ValueError):
+        await session.paginate(SearchKey, after=page.next)
+
+
+async def test_paginate_null_ordering_value():
+    rows = [{"id": i, "key": "key", "date_created": None} for i in range(3)]
+    session = Session(FakeConnection(lambda query, args: rows[: args[-1]]))
+
+    with pytest.raises(ValueError):
+        await session.paginate(SearchKey, order_by=["date_created"], page_size=2)
+
+
+async def test_paginate_malformed_tokens():
+    session = Session(FakeConnection(search_key_table))
+    payloads = [[1], {"columns": ["id"]}, {"columns": ["id"], "values": [{"x": 1}]}]
+
+    for payload in payloads:
+        token = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        with pytest.raises(ValueError):
+            await session.paginate(SearchKey, after=token)
+    with pytest.raises(ValueError):
+        await session.paginate(SearchKey, after="not a token")
+
+
+class Recorder(QueryHook):
+    def __init__(self):
+        self.events = []
+
+    def query_compiled(self, event):
+        self.events.append(("compiled", event.operation))
+
+    def query_sent(self, event):
+        self.events.append(("sent", event.operation))
+
+    def query_first_row(self, event):
+        self.events.append(("first_row", event.operation))
+
+    def query_finished(self, event):
+        self.events.append(("finished", event.operation))
+        self.last = event
+
+
+async def test_hooks():
+    session = Session(FakePool(search_keys, size=1))
+    recorder = Recorder()
+    session.add_hook(recorder)
+
+    await session.get_one(SearchKey, Where(id=1))
+    await session.get_one(SearchKey, Where(id=2), limit=1)
+    await session.get_one(SearchKey, Where(id=3))
+
+    assert recorder.events[:4] == [
+        ("compiled", "select"),
+        ("sent", "select"),
+        ("first_row", "select"),
+        ("finished", "select"),
+    ]
+    assert recorder.events.count(("compiled", "select")) == 2
+    assert recorder.last.relation == "search_keys"
+    assert recorder.last.rows == 1
+    assert recorder.last.size > 0
+    assert recorder.last.duration >= recorder.last.first_row >= 0
+
+    session.remove_hook(recorder)
+    await session.get_one(SearchKey, Where(id=4))
+    assert len(recorder.events) == 11
+
+
+async def test_hooks_report_errors_and_streams():
+    def failing(query, args):
+        raise asyncpg.exceptions.UndefinedTableError("missing")
+
+    stats = QueryStats(slow_threshold=0)
+    session = Session(FakeConnection(failing))
+    session.add_hook(stats)
+
+    with pytest.raises(asyncpg.exceptions.UndefinedTableError):
+        await session.get(SearchKey)
+
+    session.conn = FakeConnection(search_key_table)
+    assert len([key async for key in session.stream(SearchKey, batch_size=3)]) == 10
+
+    (shape,) = stats.summary()
+    assert (shape["calls"], shape["errors"], shape["rows"]) == (2, 1, 10)
+    assert shape["operation"] == "select"
+    assert shape["p50"] <= shape["p99"]
+    assert len(stats.slow_log) == 2
+
+
+async def test_debug_prints_queries(capsys):
+    session = Session(FakeConnection(search_keys), debug=True)
+
+    async with session.transaction() as tx:
+        tx.queue_create(SearchIndexInt, doc_id=1, key_id=1, value=1)
+
+    out = capsys.readouterr().out
+    assert "search_index_int" in out
+    assert "[[1, 1, 1]]" in out
+
+
+def selected(query, args):
+    """Answers search_keys selects with the selected columns only."""
+    row = search_keys(query, args)[0]
+    columns = " ".join(query.split()).split("SELECT ")[1].split(" FROM")[0]
+    return [{name: row[name] for name in columns.split(", ")}]
+
+
+async def test_only_and_defer():
+    conn = FakeConnection(selected)
+    session = Session(conn)
+
+    (key,) = await session.get(SearchKey, Where(id=1), only=["key"])
+    assert "date_created" not in conn.log[-1][1]
+    assert (key.id, key.key, key.date_created) == (1, "key-1", DEFERRED)
+
+    (key,) = await session.get(SearchKey, Where(id=1), defer=["key"])
+    assert (key.key, key.date_created) == (DEFERRED, NOW)
+
+    # Partially loaded instances stay out of the identity map.
+    assert (await session.get_one(SearchKey, Where(id=1))).key == "key-1"
+
+
+def documents(query, args):
+    if "SELECT id, body" in " ".join(query.split()):
+        return [{"id": i, "body": f"body-{i}"} for i in args[0]]
+    return [{"id": i, "key": f"key-{i}"} for i in range(3)]
+
+
+async def test_undefer_loads_result_set_at_once():
+    @dataclass(frozen=True)
+    class Document(Relation, table_name="documents", pkey="id"):
+        id: int
+        key: str
+        body: str = field(default="", metadata={"deferred": True})
+
+    conn = FakeConnection(documents)
+    session = Session(conn)
+
+    docs = await session.get(Document)
+    assert [doc.body for doc in docs] == [DEFERRED] * 3
+
+    assert await session.undefer(docs) is docs
+    assert [doc.body for doc in docs] == ["body-0", "body-1", "body-2"]
+    assert len(conn.log) == 2
+    assert "id = ANY($1)" in conn.log[1][1]
+
+    await session.undefer(docs)
+    assert len(conn.log) == 2
+
+
+def keys_and_indexes(query, args):
+    if "FROM search_index_int" in query:
+        key_ids = args[0] if "ANY" in query else [1, 1, 2]
+        return [
+            {"doc_id": doc_id, "key_id": key_id, "date_created": NOW, "value": 0}
+            for doc_id, key_id in enumerate(key_ids * 2)
+        ]
+    ids = args[0] if "ANY" in query else [1, 2, 3]
+    return [{"id": i, "key": f"key-{i}", "date_created": NOW} for i in ids]
+
+
+async def test_prefetch_many_to_one():
+    conn = FakeConnection(keys_and_indexes)
+    rows = await Session(conn).get(SearchIndexInt, prefetch=["key"])
+
+    assert [row.key.id for row in rows] == [1, 1, 2, 1, 1, 2]
+    assert rows[0].key is rows[1].key
+    assert len(conn.log) == 2
+    assert conn.log[1][2] == ([1, 2],)
+
+    with pytest.raises(ValueError):
+        await Session(conn).get(SearchIndexInt, prefetch=["value"])
+
+
+async def test_prefetch_one_to_many():
+    conn = FakeConnection(keys_and_indexes)
+    keys = await Session(conn).get(SearchKey, prefetch=["indexes"])
+
+    assert [len(key.indexes) for key in keys] == [2, 2, 2]
+    assert {index.key_id for index in keys[2].indexes} == {3}
+    assert "key_id = ANY($1)" in conn.log[1][1]
+
+
+async def test_stream_prefetch():
+    conn = FakeConnection(keys_and_indexes)
+    session = Session(conn)
+
+    batches = [
+        [row.key.id for row in batch]
+        async for batch in session.stream(
+            SearchIndexInt, batch_size=4, batches=True, prefetch=["key"]
+        )
+    ]
+    assert batches == [[1, 1, 2, 1], [1, 2]]
+    assert [kind for kind, _, _ in conn.log].count("query") == 3
+
+
+def replica_keys(lag):
+    def handler(query, args):
+        if "pg_is_in_recovery" in query:
+            if lag is None:
+                raise OSError("unreachable")
+            return [{"lag": lag}]
+        return search_keys(query, args)
+
+    return handler
+
+
+async def test_replica_routing():
+    primary, replica = FakePool(search_keys, size=1), FakePool(search_keys, size=1)
+    session = Session(
+        primary,
+        identity_map_size=0,
+        replicas=ReplicaSet([replica], check_interval=0),
+        read_your_writes=60,
+    )
+
+    await session.get_one(SearchKey, Where(id=1))
+    await session.get(SearchKey, Where(id=1), primary=True)
+    assert (len(replica.log), len(primary.log)) == (1, 1)
+
+    assert [key.id async for key in session.stream(SearchKey, Where(id=1))] == [1]
+    assert len(replica.log) == 4  # begin, query, commit
+
+    await session.update(SearchKey, Where(id=1), key="new")
+    await session.get_one(SearchKey, Where(id=1))
+    assert (len(replica.log), len(primary.log)) == (4, 3)
+
+    session.read_your_writes = 0
+    await session.get_one(SearchKey, Where(id=1))
+    assert len(replica.log) == 5
+
+
+async def test_replica_balancing_and_health():
+    pools = [FakePool(replica_keys(lag), size=1) for lag in (0.1, 5.0, None)]
+    replicas = ReplicaSet(pools, max_lag=1.0, check_interval=0)
+
+    await replicas.check_all()
+    assert [replica.healthy for replica in replicas.replicas] == [True, True, False]
+    assert replicas.available() == replicas.replicas[:1]
+
+    replicas.max_lag = None
+    replicas.replicas[0].outstanding = 2
+    assert replicas.choose() is replicas.replicas[1]
+
+    for replica in replicas.replicas[:2]:
+        replica.healthy = False
+    primary = FakePool(search_keys, size=1)
+    session = Session(primary, identity_map_size=0, replicas=replicas)
+    await session.get_one(SearchKey, Where(id=1))
+    assert len(primary.log) == 1
+
+
+def stall(conn, seconds):
+    respond = conn._respond
+
+    async def slow(query, args):
+        await asyncio.sleep(seconds)
+        return await respond(query, args)
+
+    conn._respond = slow
+
+
+async def test_hedged_reads():
+    pool = FakePool(search_keys, size=2)
+    stall(pool.connections[0], 10)
+    session = Session(pool, identity_map_size=0, hedging=HedgePolicy(delay=0.01))
+
+    key = await asyncio.wait_for(session.get_one(SearchKey, Where(id=1)), 1)
+    assert key.id == 1
+    assert session.hedging.stats() == {"reads": 1, "hedged": 1, "hedge_wins": 1}
+    assert pool.connections[0].log == []
+
+    # The first attempt counts for at least as long as it ran.
+    policy = session.hedging
+    policy.delay, policy.min_samples, policy.percentile = None, 2, 1.0
+    assert policy.delay_for(fingerprint(pool.connections[1].log[0][1])) >= 0.01
+
+
+async def test_hedging_budget():
+    pool = FakePool(search_keys, size=2)
+    for conn in pool.connections:
+        stall(conn, 0.05)
+    policy = HedgePolicy(delay=0.01, budget=0.0, burst=1.0)
+    session = Session(pool, identity_map_size=0, hedging=policy)
+
+    for _ in range(3):
+        await session.get_one(SearchKey, Where(id=1))
+    assert policy.stats() == {"reads": 3, "hedged": 1, "hedge_wins": 0}
+
+
+def test_hedging_percentile_delay():
+    policy = HedgePolicy(percentile=0.5, window=10, min_samples=4)
+    for latency in (0.3, 0.1, 0.2):
+        policy.record("shape", latency)
+    assert policy.delay_for("shape") is None
+
+    policy.record("shape", 0.4)
+    assert policy.delay_for("shape") == 0.2
+    assert policy.delay_for("other") is None
+
+
+def test_hedging_delay_recomputed_every_tenth_of_window():
+    policy = HedgePolicy(percentile=1.0, window=20, min_samples=1)
+    for _ in range(20):
+        policy.record("shape", 0.1)
+    assert policy.delay_for("shape") == 0.1
+
+    policy.record("shape", 0.5)
+    assert policy.delay_for("shape") == 0.1
+    policy.record("shape", 0.5)
+    assert policy.delay_for("shape") == 0.5
+
+
+async def test_admission_limit_and_deadline():
+    pool = FakePool(search_keys, size=4)
+    for conn in pool.connections:
+        stall(conn, 0.05)
+    admission = AdmissionController(limit=1, timeout=0.08)
+    session = Session(pool, identity_map_size=0, admission=admission)
+
+    results = await asyncio.gather(
+        *(session.get_one(SearchKey, Where(id=i)) for i in range(3)),
+        return_exceptions=True,
+    )
+    assert [key.id for key in results[:2]] == [0, 1]
+    assert isinstance(results[2], Overloaded)
+    assert admission.stats() == {
+        "limit": 1,
+        "in_flight": 0,
+        "queued": 0,
+        "admitted": 2,
+        "rejected": 1,
+    }
+
+
+async def test_admission_priorities():
+    admission = AdmissionController(limit=1, max_queue=2, timeout=None)
+    started = []
+    release = asyncio.Event()
+
+    async def request(name, priority):
+        async with admission.admit(priority):
+            started.append(name)
+            await release.wait()
+
+    holder = asyncio.ensure_future(request("first", "read"))
+    await asyncio.sleep(0)
+    waiting = [
+        asyncio.ensure_future(request(name, priority))
+        for name, priority in [("read", "read"), ("late", "read"), ("write", "write")]
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(holder, *waiting, return_exceptions=True)
+
+    assert started == ["first", "write", "read"]
+    assert isinstance(results[2], Overloaded)
+
+
+async def test_admission_reentrant_stream():
+    conn = FakeConnection(keys_and_indexes)
+    admission = AdmissionController(limit=1, timeout=0.3)
+    session = Session(conn, admission=admission)
+
+    keys = [
+        (row.key.id, await session.get_one(SearchKey, Where(id=row.key_id)))
+        async for row in session.stream(SearchIndexInt, prefetch=["key"])
+    ]
+    assert [key_id for key_id, _ in keys] == [1, 1, 2, 1, 1, 2]
+    assert all(key is not None for _, key in keys)
+    assert admission.stats()["rejected"] == 0
+    assert admission.stats()["in_flight"] == 0
+
+
+async def test_admission_of_tasks_started_by_a_stream():
+    conn = FakeConnection(keys_and_indexes)
+    admission = AdmissionController(limit=1, timeout=0.05)
+    session = Session(conn, admission=admission)
+
+    async with aclosing(session.stream(SearchIndexInt)) as rows:
+        async for row in rows:
+            get = session.get_one(SearchKey, Where(id=row.key_id))
+            with pytest.raises(Overloaded):
+                await asyncio.ensure_future(get)
+            break
+
+    assert await session.get_one(SearchKey, Where(id=1)) is not None
+    assert admission.stats()["in_flight"] == 0
+
+
+async def test_admission_adapts_limit():
+    admission = AdmissionController(initial_limit=2, backoff=0.5)
+
+    async def request(seconds):
+        async with admission.admit():
+            await asyncio.sleep(seconds)
+
+    for _ in range(10):
+        await asyncio.gather(request(0.002), request(0.002))
+    assert admission.limit > 2
+
+    raised = admission.limit
+    await request(0.05)
+    assert admission.limit < raised
+
+
+async def test_writer_batches():
+    conn = FakeConnection()
+    session = Session(conn)
+
+    async with session.writer(SearchIndexInt, max_rows=3, max_delay=0.01) as writer:
+        futures = [await writer.add(doc_id=i, key_id=1, value=i) for i in range(4)]
+        await futures[0]
+        assert [len(entry[2][1]) for entry in conn.log if entry[0] == "copy"] == [3]
+
+        await asyncio.wait_for(futures[3], 1)
+        await writer.add(doc_id=4, key_id=1)
+
+    copies = [entry[2] for entry in conn.log if entry[0] == "copy"]
+    assert [len(records) for _, records in copies] == [3, 1, 1]
+    assert copies[2] == (("doc_id", "key_id"), [(4, 1)])
+    assert (writer.batches, writer.written, writer.failed) == (3, 5, 0)
+
+    with pytest.raises(RuntimeError):
+        await writer.add(doc_id=5, key_id=1)
+
+
+async def test_writer_on_conflict_and_errors():
+    def merged(query, args):
+        if "merged" in query and "value" not in query:
+            raise ValueError("null value in column value")
+        return [{"inserted": 1, "updated": 0}] if "merged" in query else []
+
+    conn = FakeConnection(merged)
+    writer = Session(conn).writer(SearchIndexInt, on_conflict="nothing")
+    written = await writer.add(doc_id=1, key_id=1, value=1)
+    rejected = await writer.add(doc_id=2, key_id=1)
+    await writer.close()
+
+    assert await written is None
+    assert "ON CONFLICT (doc_id, key_id) DO NOTHING" in conn.log[3][1]
+    with pytest.raises(ValueError):
+        await rejected
+    assert (writer.written, writer.failed) == (1, 1)
+
+
+async def test_writer_unawaited_failures():
+    def failing(query, args):
+        raise ValueError("connection lost")
+
+    errors = []
+    loop = asyncio.get_running_loop()
+    loop.set_exception_handler(lambda _, context: errors.append(context))
+
+    session = Session(FakeConnection(failing))
+    async with session.writer(SearchKey, on_conflict="nothing") as writer:
+        await writer.add(key="key-1", date_created=NOW)
+    gc.collect()
+
+    loop.set_exception_handler(None)
+    assert writer.failed == 1
+    assert errors == []
+
+
+async def test_writer_after_a_cancelled_batch():
+    conn = FakeConnection()
+    copy = conn.copy_records_to_table
+
+    async def stalled_copy(*args, **kwargs):
+        conn.copy_records_to_table = copy
+        await asyncio.sleep(10)
+
+    conn.copy_records_to_table = stalled_copy
+    writer = Session(conn).writer(SearchIndexInt, max_rows=1)
+    first = await writer.add(doc_id=1, key_id=1, value=1)
+    stalled = writer._writing
+    second = await writer.add(doc_id=2, key_id=1, value=2)
+    await asyncio.sleep(0)
+    stalled.cancel()
+
+    assert await asyncio.wait_for(second, 1) is None
+    assert first.cancelled()
+    assert (writer.written, writer.failed) == (1, 1)
+
+
+async def test_writer_backpressure():
+    writer = Session(FakeConnection()).writer(
+        SearchIndexInt, max_rows=10, max_delay=10, max_pending=2
+    )
+    for i in range(2):
+        await writer.add(doc_id=i, key_id=1)
+
+    blocked = asyncio.ensure_future(writer.add(doc_id=2, key_id=1))
+    await asyncio.sleep(0)
+    assert not blocked.done()
+
+    await writer.flush()
+    await asyncio.wait_for(blocked, 1)
+    await writer.close()
+    assert writer.written == 3
+
+
+async def test_single_flight():
+    pool = FakePool(search_keys, size=4)
+    for conn in pool.connections:
+        stall(conn, 0.01)
+    stats = QueryStats()
+    session = Session(pool, identity_map_size=0, single_flight=True)
+    session.add_hook(stats)
+
+    keys = await asyncio.gather(
+        *(session.get_one(SearchKey, Where(id=1)) for _ in range(5)),
+        session.get_one(SearchKey, Where(id=2)),
+    )
+    assert [key.id for key in keys] == [1, 1, 1, 1, 1, 2]
+    assert keys[0] == keys[1] and keys[0] is not keys[1]
+    assert len(pool.log) == 2
+    assert session.deduplicated == 4
+    (shape,) = stats.summary()
+    assert (shape["calls"], shape["deduplicated"]) == (2, 4)
+
+    await session.get_one(SearchKey, Where(id=1))
+    assert len(pool.log) == 3
+
+
+async def test_resolve_keys():
+    ids = {"a": 1, "b": 2, "c": 3, "d": 4}
+    hidden = {"d"}
+
+    def resolved(query, args):
+        if query.startswith("DELETE"):
+            return []
+        rows = [{"key": v, "id": ids[v]} for v in args[0] if v not in hidden]
+        hidden.difference_update(args[0])
+        return rows
+
+    conn = FakeConnection(resolved)
+    session = Session(conn)
+
+    mapping = await session.resolve_keys(SearchKey, "key", ["a", "b", "a", None, "c"])
+    assert mapping == {"a": 1, "b": 2, "c": 3}
+    ((_, query, args),) = conn.log
+    assert "FROM unnest($1::text[])" in query
+    assert "ON CONFLICT (key) DO NOTHING" in query
+    assert args == (["a", "b", "c"],)
+
+    assert await session.resolve_keys(SearchKey, "key", ["d", "a"]) == {"d": 4, "a": 1}
+    assert [args for _, _, args in conn.log[1:]] == [(["d"],), (["d"],)]
+
+    await session.resolve_keys(SearchKey, "key", ["a", "b", "c", "d"])
+    assert len(conn.log) == 3
+
+    await session.delete(SearchKey, Where(id=1))
+    await session.resolve_keys(SearchKey, "key", ["b"])
+    assert conn.log[-1][2] == (["b"],)
+
+
+async def test_resolve_keys_in_transaction():
+    ids = {"a": 1, "b": 2}
+    conn = FakeConnection(
+        lambda query, args: [{"key": v, "id": ids[v]} for v in args[0]]
+    )
+    session = Session(conn)
+
+    with pytest.raises(RuntimeError):
+        async with session.transaction() as tx:
+            await tx.resolve_keys(SearchKey, "key", ["a"])
+            raise RuntimeError("rolled back")
+    await session.resolve_keys(SearchKey, "key", ["a"])
+    assert conn.log[-1][2] == (["a"],)
+
+    async with session.transaction() as tx:
+        await tx.resolve_keys(SearchKey, "key", ["b"])
+    queries = len(conn.log)
+    assert await session.resolve_keys(SearchKey, "key", ["a", "b"]) == ids
+    assert len(conn.log) == queries
+
+    async with session.transaction() as tx:
+        tx.queue_delete(SearchKey, Where(id=1))
+    await session.resolve_keys(SearchKey, "key", ["a"])
+    assert conn.log[-1][2] == (["a"],)
+
+
+async def test_count_exists_aggregate():
+    def aggregated(query, args):
+        if "EXISTS" in query:
+            return [{"exists": True}]
+        if "GROUP BY" in query:
+            return [
+                {"key_id": 1, "count": 2, "sum_value": 5, "max_value": 4},
+                {"key_id": 2, "count": 1, "sum_value": 3, "max_value": 3},
+            ]
+        if "count(*)" in query:
+            return [{"count": 7}]
+        return [{"min_value": 1, "min_doc_id": 10}]
+
+    conn = FakeConnection(aggregated)
+    session = Session(conn)
+
+    assert await session.count(SearchIndexInt, Where(key_id=1)) == 7
+    assert "SELECT count(*) FROM search_index_int WHERE (key_id = $1)" in conn.log[0][1]
+
+    assert await session.exists(SearchIndexInt, Where(In("key_id", [1, 2]))) is True
+    assert "SELECT EXISTS ( SELECT 1" in conn.log[1][1]
+    assert "LIMIT 1 )" in conn.log[1][1]
+
+    groups = await session.aggregate(
+        SearchIndexInt, group_by="key_id", count="*", sum="value", max="value"
+    )
+    assert groups[0] == {"key_id": 1, "count": 2, "sum_value": 5, "max_value": 4}
+    assert (
+        "SELECT key_id, count(*) AS count, sum(value) AS sum_value, "
+        "max(value) AS max_value FROM search_index_int GROUP BY key_id"
+    ) in conn.log[2][1]
+
+    totals = await session.aggregate(SearchIndexInt, min=["value", "doc_id"])
+    assert totals == {"min_value": 1, "min_doc_id": 10}
+
+    with pytest.raises(ValueError):
+        await session.aggregate(SearchIndexInt, sum="missing")
+    with pytest.raises(TypeError):
+        await session.aggregate(SearchIndexInt, median="value")
+    with pytest.raises(TypeError):
+        await session.aggregate(SearchIndexInt, Where(key_id=1))
+    with pytest.raises(TypeError):
+        await session.aggregate(SearchIndexInt, min=[])
+    assert len(conn.log) == 4